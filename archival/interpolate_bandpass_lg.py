@@ -3,6 +3,9 @@ import matplotlib.pyplot as plt
 from copy import deepcopy
 import shutil
 
+# Strided, edge-replicated window view shared with the pipeline version.
+from lband_pipeline.line_tools.line_tools import rolling_window
+
 tablename = 'test.tbl'
 
 spw = 0
@@ -15,19 +18,6 @@ poly_order = 2
 ###############
 
 
-def rolling_window(x, k):
-    y = np.ma.zeros((len(x), k), dtype='complex128')
-    k2 = (k - 1) // 2
-    y[:, k2] = x
-    for i in range(k2):
-        j = k2 - i
-        y[j:, i] = x[:-j]
-        y[:j, i] = x[0]
-        y[:-j, -(i + 1)] = x[j:]
-        y[-j:, -(i + 1)] = x[-1]
-    return y
-
-
 def interpolate_bandpass(spw, min_chan, max_chan, window_size, poly_order):
 
     original_table_backup = tablename + '.bak'
@@ -0,0 +1,126 @@
+'''
+Compare the row-by-row and vectorized uvdist flagging statistics from
+`flagging_summary_plots` on synthetic `ms.getdata` and `flagdata` summary output.
+
+Run as:
+python benchmarks/bench_flagsummary_uvdist.py --nant 27 --ntime 3000
+
+The row loops below are the original `create_baseline_dict` and `bin_statistics`.
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from lband_pipeline.qa_plotting.flagging_summary_plots import (baseline_uvdist_modes,
+                                                               match_flags_to_uvdist,
+                                                               flag_match_baseline,
+                                                               bin_statistics)
+
+
+def create_baseline_dict_loop(antenna_names, antdata):
+
+    baseline_pairs = {}
+    i = 0
+    while i <= antdata['antenna1'].max():
+        j = i + 1
+        while j <= antdata['antenna2'].max():
+            baseline_pairs[str(antenna_names[i]) + '&&' + str(antenna_names[j])] = []
+            j += 1
+        i += 1
+    i = 0
+    while i < len(antdata['antenna1']):
+        temp_dict_key = str(antenna_names[antdata['antenna1'][i]]) + '&&' + str(antenna_names[antdata['antenna2'][i]])
+        baseline_pairs[temp_dict_key].append(antdata['uvdist'][i])
+        i += 1
+
+    return baseline_pairs
+
+
+def bin_statistics_loop(dpoints, nbins):
+
+    binned = [[], []]
+    i = 0
+    width = int(1.05 * max(dpoints[0]) / nbins)
+
+    while i < nbins:
+        j = 0
+        temp_flg, temp_total = 0., 0.
+        while j < len(dpoints[0]):
+            if dpoints[0][j] >= (i * width) and dpoints[0][j] <= ((i + 1) * width):
+                temp_flg += dpoints[1][j][0]
+                temp_total += dpoints[1][j][1]
+            j += 1
+        binned[0].append(i * width)
+        if temp_total == 0:
+            binned[1].append(0)
+        else:
+            binned[1].append(temp_flg / temp_total)
+        i += 1
+
+    return np.array(binned), width
+
+
+def make_uvdata(nant, ntime, seed=0):
+    '''
+    All cross-correlations for `ntime` integrations with a rotating, foreshortened uv-track.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    ant1, ant2 = np.triu_indices(nant, k=1)
+
+    positions = rng.uniform(-5000, 5000, size=(nant, 2))
+    baselines = positions[ant2] - positions[ant1]
+
+    angles = np.linspace(0, np.pi / 2, ntime)
+
+    u = np.outer(np.cos(angles), baselines[:, 0]) - np.outer(np.sin(angles), baselines[:, 1])
+    # Foreshortening in v so the baseline lengths change along the track.
+    v = 0.6 * (np.outer(np.sin(angles), baselines[:, 0]) + np.outer(np.cos(angles), baselines[:, 1]))
+
+    antdata = {'antenna1': np.tile(ant1, ntime),
+               'antenna2': np.tile(ant2, ntime),
+               'uvdist': np.sqrt(u**2 + v**2).ravel()}
+
+    antenna_names = np.array(["ea{:02d}".format(ant + 1) for ant in range(nant)])
+
+    flgdata = {}
+    for a1, a2 in zip(ant1, ant2):
+        total = int(rng.integers(1000, 10000))
+        flgdata["{0}&&{1}".format(antenna_names[a1], antenna_names[a2])] = \
+            {'flagged': int(rng.integers(0, total)), 'total': total}
+
+    return antenna_names, antdata, flgdata
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nant", type=int, default=27)
+    parser.add_argument("--ntime", type=int, default=1000)
+    parser.add_argument("--nbin", type=int, default=25)
+    args = parser.parse_args()
+
+    antenna_names, antdata, flgdata = make_uvdata(args.nant, args.ntime)
+
+    print("{} rows".format(antdata['uvdist'].size))
+
+    t0 = time.perf_counter()
+    base_dict = create_baseline_dict_loop(antenna_names, antdata)
+    datamatch = flag_match_baseline(flgdata, base_dict)
+    binned_loop, _ = bin_statistics_loop(datamatch, args.nbin)
+    t_loop = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    uvdist_modes = baseline_uvdist_modes(antdata, len(antenna_names))
+    datamatch_vect = match_flags_to_uvdist(flgdata, antenna_names, uvdist_modes)
+    binned_vect, _ = bin_statistics(datamatch_vect, args.nbin)
+    t_vect = time.perf_counter() - t0
+
+    print("loop: {0:.3f} s".format(t_loop))
+    print("vectorized: {0:.3f} s".format(t_vect))
+    print("Speed-up: {0:.1f}x".format(t_loop / t_vect))
+    print("Identical binned fractions: {}".format(np.array_equal(binned_loop, binned_vect)))
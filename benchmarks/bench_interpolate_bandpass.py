@@ -0,0 +1,69 @@
+'''
+Compare the batched and per-channel polyfit bandpass gap interpolation on a
+synthetic CPARAM/FLAG cube.
+
+Run as:
+python benchmarks/bench_interpolate_bandpass.py --nchan 4096 --nant 27 --gap 1800 2000
+
+The default is a smaller cube as the polyfit loop takes several minutes for a
+full 4096-channel HI SPW.
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from lband_pipeline.line_tools.line_tools import interpolate_bandpass_gaps
+
+
+def make_bandpass_cube(npol, nchan, nant, gap, nedge, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    chans = np.linspace(-1, 1, nchan)
+    shape = (npol, nchan, nant)
+
+    amp = 1 + 0.1 * chans[np.newaxis, :, np.newaxis] + 0.01 * rng.standard_normal(shape)
+    phase = 0.2 * chans[np.newaxis, :, np.newaxis]**2 + 0.01 * rng.standard_normal(shape)
+
+    dat = np.ma.array(amp * np.exp(1j * phase), mask=np.zeros(shape, dtype=bool))
+
+    dat.mask[:, :nedge] = True
+    dat.mask[:, -nedge:] = True
+    dat.mask[:, gap[0]:gap[1]] = True
+
+    return dat
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--npol", type=int, default=2)
+    parser.add_argument("--nchan", type=int, default=1024)
+    parser.add_argument("--nant", type=int, default=27)
+    parser.add_argument("--gap", type=int, nargs=2, default=[450, 500])
+    parser.add_argument("--nedge", type=int, default=20)
+    parser.add_argument("--poly_order", type=int, default=2)
+    args = parser.parse_args()
+
+    dat = make_bandpass_cube(args.npol, args.nchan, args.nant, args.gap, args.nedge)
+
+    timings = {}
+    outputs = {}
+
+    for method in ['batched', 'polyfit']:
+        t0 = time.perf_counter()
+        outputs[method] = interpolate_bandpass_gaps(dat.copy(),
+                                                    poly_order=args.poly_order,
+                                                    add_residuals=False,
+                                                    method=method)
+        timings[method] = time.perf_counter() - t0
+
+        print("{0}: {1:.3f} s".format(method, timings[method]))
+
+    max_diff = np.abs(outputs['batched'].data - outputs['polyfit'].data).max()
+
+    print("Speed-up: {0:.1f}x".format(timings['polyfit'] / timings['batched']))
+    print("Max. absolute difference: {0:.3e}".format(max_diff))
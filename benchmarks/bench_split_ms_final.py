@@ -0,0 +1,166 @@
+'''
+Compare the serial and concurrent target/calibrator splits in `split_ms_final_all`
+with a single `mstransform` over all intents, on a synthetic MS.
+
+`split_ms_final_all` is not a single-pass splitter. It runs one `mstransform` per
+intent, but the target and calibrator selections cover different rows. The bytes
+read by the two splits should be close to the single `mstransform` reference, which
+reads the CORRECTED column once, and not twice the size of that column.
+
+Requires modular CASA (casatools + casatasks). Run as:
+python benchmarks/bench_split_ms_final.py --nchan 256 --target_time 1800 --drop_caches
+
+Reports the wall-clock time and the bytes read from disk (block input from
+`getrusage`) for each mode, and the bytes read relative to the size of the
+CORRECTED column on disk. The disk reads are only meaningful with a cold page
+cache, so drop the caches between modes (requires root) with --drop_caches.
+'''
+
+import argparse
+import glob
+import os
+import resource
+import shutil
+import subprocess
+import time
+
+from lband_pipeline.ms_split_tools import split_ms_final_all
+
+
+def make_synthetic_ms(msname, nchan=64, cal_time=120, target_time=600):
+    '''
+    Simulate a short VLA D-config track with one phase calibrator and one target
+    scan, and add a CORRECTED column.
+    '''
+
+    from casatools import simulator, measures, ctsys
+    from casatasks import clearcal
+    from casatasks.private import simutil
+
+    if os.path.exists(msname):
+        shutil.rmtree(msname)
+
+    me = measures()
+    sm = simulator()
+
+    util = simutil.simutil()
+    x, y, z, d, padnames, antnames, telescope, posobs = \
+        util.readantenna(ctsys.resolve('alma/simmos/vla.d.cfg'))
+
+    sm.open(msname)
+    sm.setconfig(telescopename='VLA', x=x, y=y, z=z, dishdiameter=d.tolist(),
+                 mount=['alt-az'], antname=antnames.tolist(), padname=padnames.tolist(),
+                 coordsystem='global', referencelocation=me.observatory('VLA'))
+    sm.setspwindow(spwname='L0', freq='1.4GHz', deltafreq='1MHz', freqresolution='1MHz',
+                   nchannels=nchan, stokes='RR LL')
+    sm.setfield(sourcename='J0137+3309',
+                sourcedirection=me.direction('J2000', '01h37m41.3s', '+33d09m35s'))
+    sm.setfield(sourcename='M33_1',
+                sourcedirection=me.direction('J2000', '01h33m50.9s', '+30d39m37s'))
+    sm.setlimits(shadowlimit=0.001, elevationlimit='8.0deg')
+    sm.setauto(autocorrwt=0.0)
+    sm.settimes(integrationtime='2s', usehourangle=True,
+                referencetime=me.epoch('utc', '2020/01/01/00:00:00'))
+
+    sm.observe('J0137+3309', 'L0', starttime='0s', stoptime='{}s'.format(cal_time),
+               state_obs_mode='CALIBRATE_PHASE#UNSPECIFIED')
+    sm.observe('M33_1', 'L0', starttime='{}s'.format(cal_time),
+               stoptime='{}s'.format(cal_time + target_time),
+               state_obs_mode='OBSERVE_TARGET#UNSPECIFIED')
+    sm.close()
+
+    clearcal(vis=msname, addmodel=False)
+
+
+def column_size(msname, colname='CORRECTED_DATA'):
+    '''
+    Size on disk of the data manager files holding `colname`.
+    '''
+
+    from casatools import table
+
+    tb = table()
+    tb.open(msname)
+    dminfo = tb.getdminfo()
+    tb.close()
+
+    size = 0
+    for manager in dminfo.values():
+        if colname in manager['COLUMNS']:
+            for filename in glob.glob(os.path.join(msname, "table.f{}*".format(manager['SEQNR']))):
+                size += os.path.getsize(filename)
+
+    return size
+
+
+def split_all_intents(msname, output_path):
+    '''
+    Reference: one mstransform over all intents, reading the CORRECTED column once.
+    '''
+
+    from casatasks import mstransform
+
+    mstransform(vis=msname, outputvis=os.path.join(output_path, "all_intents.ms"),
+                datacolumn='corrected', keepflags=True)
+
+
+def drop_caches():
+    subprocess.run("sync; echo 3 > /proc/sys/vm/drop_caches", shell=True, check=True)
+
+
+def bytes_read():
+    # ru_inblock is in 512-byte blocks. Include the spawned split workers.
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return 512 * (self_usage.ru_inblock + child_usage.ru_inblock)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nchan", type=int, default=64)
+    parser.add_argument("--cal_time", type=float, default=120)
+    parser.add_argument("--target_time", type=float, default=600)
+    parser.add_argument("--workdir", type=str, default="bench_split_ms_final")
+    parser.add_argument("--drop_caches", action='store_true')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.workdir):
+        os.mkdir(args.workdir)
+
+    msname = os.path.join(args.workdir, "synthetic.continuum.ms")
+
+    make_synthetic_ms(msname, nchan=args.nchan, cal_time=args.cal_time,
+                      target_time=args.target_time)
+
+    corrected_size = column_size(msname)
+    print("CORRECTED column: {0:.1f} MB".format(corrected_size / 1e6))
+
+    modes = {'single mstransform': None, 'serial': False, 'concurrent': True}
+
+    for mode, concurrent in modes.items():
+
+        output_path = os.path.join(args.workdir, mode.replace(" ", "_"))
+        if os.path.exists(output_path):
+            shutil.rmtree(output_path)
+        os.mkdir(output_path)
+
+        if args.drop_caches:
+            drop_caches()
+
+        read0 = bytes_read()
+        t0 = time.perf_counter()
+
+        if concurrent is None:
+            split_all_intents(msname, output_path)
+        else:
+            split_ms_final_all(msname, {}, keep_flags=True, overwrite=True,
+                               output_path=output_path, concurrent=concurrent)
+
+        t1 = time.perf_counter()
+        read1 = bytes_read()
+
+        print("{0}: {1:.2f} s, {2:.1f} MB read ({3:.2f}x the CORRECTED column)"
+              .format(mode, t1 - t0, (read1 - read0) / 1e6,
+                      (read1 - read0) / corrected_size))
@@ -0,0 +1,103 @@
+'''
+Compare the nested-loop and lexsort-based per-baseline and per-scan statistics in
+`uvresid_plot` on a synthetic plotms amp vs. uvwave table.
+
+Run as:
+python benchmarks/bench_uvresid_binning.py --nant 27 --nscan 20 --ntime 10
+
+The loops below are the original `bin_uvdata` and `bin_uvdata_perscan`.
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+from lband_pipeline.qa_plotting.uvresid_plot import bin_uvdata, bin_uvdata_perscan
+
+
+def bin_uvdata_loop(dat):
+    list_x, list_y, list_yerr = [], [], []
+    for ant1 in np.unique(dat['ant1']):
+        for ant2 in np.unique(dat['ant2']):
+            hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2))[0]
+            if len(hits) > 5:
+                q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
+                iqr = (1 / 1.35) * (q75 - q25)
+                list_x.append(np.median(dat['x'][hits]))
+                list_y.append(q50)
+                list_yerr.append(np.abs(iqr) / np.sqrt(len(hits)))
+    return np.array([list_x, list_y, list_yerr])
+
+
+def bin_uvdata_perscan_loop(dat):
+    list_x, list_y, list_yerr = [], [], []
+    for ant1 in np.unique(dat['ant1']):
+        for ant2 in np.unique(dat['ant2']):
+            for scan in np.unique(dat['scan']):
+                hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2) & (dat['scan'] == scan))[0]
+                if len(hits) > 5:
+                    q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
+                    iqr = (1 / 1.35) * (q75 - q25)
+                    list_x.append(np.median(dat['x'][hits]))
+                    list_y.append(q50)
+                    list_yerr.append(np.abs(iqr) / np.sqrt(len(hits)))
+    return np.array([list_x, list_y, list_yerr])
+
+
+def make_plotms_table(nant, nscan, ntime, nspw=16, ncorr=2, seed=0):
+    '''
+    One row per baseline, integration, SPW and correlation, as in a plotms
+    export averaged over channels.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    ant1, ant2 = np.triu_indices(nant, k=1)
+    nbl = ant1.size
+
+    nrep = nscan * ntime * nspw * ncorr
+
+    dat = np.zeros(nbl * nrep, dtype=[('x', float), ('y', float), ('ant1', int),
+                                      ('ant2', int), ('scan', int), ('spw', int)])
+
+    dat['ant1'] = np.tile(ant1, nrep)
+    dat['ant2'] = np.tile(ant2, nrep)
+    dat['scan'] = np.repeat(np.arange(1, nscan + 1), nbl * ntime * nspw * ncorr)
+    dat['spw'] = np.tile(np.repeat(np.arange(nspw), nbl * ncorr), nscan * ntime)
+
+    uvdist = rng.uniform(100, 30000, nbl)
+    dat['x'] = np.tile(uvdist, nrep) * rng.uniform(0.9, 1.1, dat.size)
+    dat['y'] = rng.normal(0, 5, dat.size)
+
+    return dat
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nant", type=int, default=27)
+    parser.add_argument("--nscan", type=int, default=10)
+    parser.add_argument("--ntime", type=int, default=2)
+    parser.add_argument("--nspw", type=int, default=16)
+    args = parser.parse_args()
+
+    dat = make_plotms_table(args.nant, args.nscan, args.ntime, nspw=args.nspw)
+
+    print("{} rows".format(dat.size))
+
+    for name, func_loop, func in [('per-baseline', bin_uvdata_loop, bin_uvdata),
+                                  ('per-baseline-per-scan', bin_uvdata_perscan_loop,
+                                   bin_uvdata_perscan)]:
+
+        t0 = time.perf_counter()
+        out_loop = func_loop(dat)
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        out = func(dat)
+        t_vect = time.perf_counter() - t0
+
+        print("{0}: loop {1:.3f} s, lexsort {2:.3f} s, speed-up {3:.1f}x, identical: {4}"
+              .format(name, t_loop, t_vect, t_loop / t_vect, np.array_equal(out, out_loop)))
@@ -0,0 +1,292 @@
+'''
+Parsed and indexed VLA antenna position corrections from the pre-downloaded
+yearly text files used in `offline_antposn_corrections`.
+
+The text files are parsed once per folder and kept in memory until one of the
+files changes (by modification time or size). The corrections are indexed by
+antenna and, for each antenna and pad, the offsets for every range of
+observation times between the sorted move/put times are computed once. Looking
+up the offsets for an observation is then a binary search.
+
+The offsets are identical to the sequential search in the VLA pipeline's
+`correct_ant_posns`, including the order in which the offsets are summed.
+'''
+
+import os
+import datetime
+from bisect import bisect_right
+
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+          'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+FIRST_YEAR = 2010
+
+# Parsed databases keyed by folder.
+_ANTCORR_CACHE = {}
+
+
+def _month_index(date_str):
+    '''
+    1-based month for the first month name in `date_str`. 13 when there is none,
+    as in the original search.
+    '''
+
+    for ii, month in enumerate(MONTHS):
+        if date_str.find(month) >= 0:
+            return ii + 1
+
+    return len(MONTHS) + 1
+
+
+def antcorr_filenames(data_folder, last_year=None):
+    '''
+    The yearly correction files from 2010 to `last_year` (default: the current year).
+    '''
+
+    if last_year is None:
+        last_year = datetime.datetime.now().year
+
+    return [data_folder + "/" + str(year) + ".txt" for year in range(FIRST_YEAR, last_year + 1)]
+
+
+def parse_antcorr_line(year, correction_line):
+    '''
+    Parse one line of a correction file.
+
+    Returns
+    -------
+    correction : tuple
+        (moved_time, put_time, ant, pad, Bx, By, Bz). `moved_time` is 0 when the
+        antenna did not move. None when the line is not a correction.
+    '''
+
+    if len(correction_line) == 0 or correction_line[0] in ['<', ';']:
+        return None
+
+    if not any([month in correction_line for month in MONTHS]):
+        return None
+
+    correction_line_fields = (str(year) + ' ' + correction_line).split()
+
+    if len(correction_line_fields) > 9:
+        [c_year, moved_date, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
+        moved_time = 10000 * int(c_year) + 100 * _month_index(moved_date) + int(moved_date[3:])
+    else:
+        [c_year, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
+        moved_time = 0
+
+    put_time = 10000 * int(c_year) + 100 * _month_index(put_date[:3]) + int(put_date[3:])
+    [put_hr, put_min] = put_time_str.split(':')
+    put_time += (int(put_hr) / 24.0 + int(put_min) / 1440.0)
+
+    # Validated as in the original parser though not used for the offsets.
+    int(obs_date[3:])
+
+    return (moved_time, put_time, int(ant), pad, float(Bx), float(By), float(Bz))
+
+
+def read_antcorr_tables(data_folder, last_year=None):
+    '''
+    Parse all of the yearly correction files into a list of corrections in file order.
+    '''
+
+    corrections = []
+
+    for filename in antcorr_filenames(data_folder, last_year=last_year):
+
+        year = int(os.path.basename(filename).split(".")[0])
+
+        with open(filename, 'r') as f:
+            lines = f.read()
+
+        for correction_line in lines.split('\n'):
+            correction = parse_antcorr_line(year, correction_line)
+            if correction is not None:
+                corrections.append(correction)
+
+    return corrections
+
+
+def build_antcorr_index(corrections):
+    '''
+    Group the corrections by antenna, keeping the file order.
+
+    Returns
+    -------
+    database : dict
+        'corrections' is the full list, 'antennas' the per-antenna list of the
+        positions in 'corrections', and 'offset_tables' the (lazily filled)
+        per-antenna and pad lookup tables.
+    '''
+
+    antennas = {}
+
+    for seq, correction in enumerate(corrections):
+        antennas.setdefault(correction[2], []).append(seq)
+
+    return {'corrections': corrections,
+            'antennas': antennas,
+            'offset_tables': {}}
+
+
+def _folder_signature(data_folder, last_year=None):
+    signature = []
+    for filename in antcorr_filenames(data_folder, last_year=last_year):
+        stat = os.stat(filename)
+        signature.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_antcorr_database(data_folder="VLA_antcorr_tables", last_year=None):
+    '''
+    Load the indexed corrections for `data_folder`, re-using the parsed database
+    when none of the files have changed.
+
+    Raises `FileNotFoundError` when one of the yearly files is missing.
+    '''
+
+    key = (os.path.abspath(data_folder), last_year)
+
+    signature = _folder_signature(data_folder, last_year=last_year)
+
+    if key in _ANTCORR_CACHE and _ANTCORR_CACHE[key][0] == signature:
+        return _ANTCORR_CACHE[key][1]
+
+    database = build_antcorr_index(read_antcorr_tables(data_folder, last_year=last_year))
+
+    _ANTCORR_CACHE[key] = (signature, database)
+
+    return database
+
+
+def clear_antcorr_cache():
+    '''
+    Drop all parsed correction databases.
+    '''
+    _ANTCORR_CACHE.clear()
+
+
+def _sequential_offsets(corrections, seqs, pad, obs_time):
+    '''
+    The per-antenna search from `correct_ant_posns` over the corrections at `seqs`.
+    '''
+
+    offsets = [0.0, 0.0, 0.0]
+    done = False
+
+    for seq in seqs:
+        moved_time, put_time, ant, this_pad, Bx, By, Bz = corrections[seq]
+
+        if moved_time:
+            # the antenna moved
+            if moved_time > obs_time:
+                # we are done considering this antenna
+                done = True
+            else:
+                # otherwise, it moved, so the offsets should be reset
+                offsets = [0.0, 0.0, 0.0]
+
+        if put_time > obs_time and not done and this_pad == pad:
+            # it's the right antenna/pad; add the offsets to those already accumulated
+            offsets[0] += Bx
+            offsets[1] += By
+            offsets[2] += Bz
+
+    return offsets
+
+
+def _offset_table(database, ant, pad):
+    '''
+    Sorted move/put times and the offsets for each range of observation times for
+    one antenna on one pad.
+    '''
+
+    key = (ant, pad)
+
+    if key not in database['offset_tables']:
+
+        seqs = database['antennas'].get(ant, [])
+        corrections = database['corrections']
+
+        times = sorted(set([corrections[seq][0] for seq in seqs if corrections[seq][0]] +
+                           [corrections[seq][1] for seq in seqs]))
+
+        # The result only changes at the move/put times. Evaluate once below the
+        # first time and at each time, which covers [times[i], times[i + 1]).
+        if len(times) > 0:
+            eval_times = [times[0] - 1.0] + times
+        else:
+            eval_times = [0.0]
+
+        offsets = [_sequential_offsets(corrections, seqs, pad, obs_time)
+                   for obs_time in eval_times]
+
+        database['offset_tables'][key] = (times, offsets)
+
+    return database['offset_tables'][key]
+
+
+def lookup_antenna_offsets(database, ant, pad, obs_time):
+    '''
+    Offsets for antenna number `ant` on `pad` for an observation at `obs_time`
+    (YYYYMMDD plus the fraction of the day).
+    '''
+
+    times, offsets = _offset_table(database, ant, pad)
+
+    return list(offsets[bisect_right(times, obs_time)])
+
+
+def antcorr_offsets(database, ant_num_stas, obs_time, legacy_unmatched=True):
+    '''
+    Offsets for all antennas in an observation.
+
+    Parameters
+    ----------
+    database : dict
+        From `load_antcorr_database`.
+    ant_num_stas : list
+        (antenna number, antenna name, station) for each antenna in the MS.
+    obs_time : float
+        Observation start as YYYYMMDD plus the fraction of the day.
+    legacy_unmatched : bool, optional
+        In the original search, a correction for an antenna that is not in the MS
+        falls through to the last antenna in the MS. Keep this behaviour to reproduce
+        the original offsets exactly. Otherwise these corrections are skipped.
+
+    Returns
+    -------
+    offsets : list
+        [Bx, By, Bz] for each antenna in `ant_num_stas`.
+    '''
+
+    ant_nums = [ant_num_sta[0] for ant_num_sta in ant_num_stas]
+
+    offsets = []
+
+    for ii, (ant, name, pad) in enumerate(ant_num_stas):
+
+        # Only the first antenna with a number gets its corrections.
+        if ant in ant_nums[:ii]:
+            this_offsets = [0.0, 0.0, 0.0]
+        else:
+            this_offsets = lookup_antenna_offsets(database, ant, pad, obs_time)
+
+        offsets.append(this_offsets)
+
+    if legacy_unmatched and len(ant_num_stas) > 0:
+
+        unmatched = [seq for this_ant, seqs in database['antennas'].items()
+                     if this_ant not in ant_nums for seq in seqs]
+
+        if len(unmatched) > 0:
+            last_ant, last_name, last_pad = ant_num_stas[-1]
+
+            seqs = [] if last_ant in ant_nums[:-1] else database['antennas'].get(last_ant, [])
+
+            offsets[-1] = _sequential_offsets(database['corrections'],
+                                              sorted(seqs + unmatched),
+                                              last_pad, obs_time)
+
+    return offsets
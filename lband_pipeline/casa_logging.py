@@ -0,0 +1,54 @@
+'''
+CASA logger shared by the pipeline modules. The `logsink` is only made (and
+`casatools` imported) when the first message is posted, so the modules can be
+imported without CASA.
+
+Without `casatools` (e.g. pure helper functions called from tests), messages go
+to the standard `logging` logger "lband_pipeline" instead.
+'''
+
+import logging
+from types import SimpleNamespace
+
+
+_CASALOG = None
+
+# CASA priorities to `logging` levels
+_LOGGING_LEVELS = {'SEVERE': logging.ERROR,
+                   'WARN': logging.WARNING,
+                   'INFO': logging.INFO}
+
+
+def _logging_post(message, origin='', priority='INFO'):
+    level = _LOGGING_LEVELS.get(priority, logging.DEBUG)
+    logging.getLogger("lband_pipeline").log(level, "%s: %s", origin, message)
+
+
+def get_casalog():
+    '''
+    Return the CASA `logsink`, creating it on the first call.
+    '''
+
+    global _CASALOG
+
+    if _CASALOG is None:
+        try:
+            from casatools import logsink
+
+            _CASALOG = logsink()
+        except ImportError:
+            _CASALOG = SimpleNamespace(post=_logging_post, logfile=lambda: None)
+
+    return _CASALOG
+
+
+class LazyCasalog:
+    '''
+    Stand-in for a `logsink` that forwards to `get_casalog` on first use.
+    '''
+
+    def __getattr__(self, name):
+        return getattr(get_casalog(), name)
+
+
+casalog = LazyCasalog()
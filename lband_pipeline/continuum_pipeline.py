@@ -60,7 +60,7 @@ myvis = mySDM if mySDM.endswith("ms") else mySDM + ".ms"
 proj_code = mySDM.split(".")[0]
 
 # Get the SPW mapping for the continuum MS.
-spwdict_filename = "spw_definitions.npy"
+spwdict_filename = "spw_definitions.json"
 contspw_dict = create_spw_dict(myvis, save_spwdict=True,
                                spwdict_filename=spwdict_filename)
 
@@ -176,10 +176,11 @@ if not skip_pipeline:
 
         if restart_stage <= 2:
 
-            for thisspw in spws_with_hi:
+            # All SPWs covering HI are flagged in one flagdata call.
+            if len(spws_with_hi) > 0:
                 flag_hi_foreground(myvis,
                                    calibrator_line_range_kms,
-                                   thisspw,
+                                   spws_with_hi,
                                    cal_intents=["CALIBRATE*"],
                                    test_run=False,
                                    test_print=True)
@@ -1,10 +1,10 @@
 
-from casatasks import flagdata
-from casatools import table
-
 
 def flag_quack_integrations(myvis, num_ints=2.5):
 
+    from casatasks import flagdata
+    from casatools import table
+
     tb = table()
 
     tb.open(myvis)
@@ -69,7 +69,7 @@ myvis = mySDM if mySDM.endswith("ms") else mySDM + ".ms"
 proj_code = mySDM.split(".")[0]
 
 # Get the SPW mapping for the line MS.
-spwdict_filename = "spw_definitions.npy"
+spwdict_filename = "spw_definitions.json"
 linespw_dict = create_spw_dict(myvis, save_spwdict=True,
                                spwdict_filename=spwdict_filename)
 
@@ -199,22 +199,17 @@ if not skip_pipeline:
                         append=False)
 
         if restart_stage <= 1:
-            flag_hi_foreground(myvis,
-                            calibrator_line_range_kms,
-                            hi_spw,
-                            cal_intents=["CALIBRATE*"],
-                            test_run=False,
-                            test_print=True)
-
             # Also flag on continuum SPWs that cover the range
+            hi_flag_spws = [hi_spw]
             if hi_spw_continuum_backup is not None:
+                hi_flag_spws.append(hi_spw_continuum_backup)
 
-                flag_hi_foreground(myvis,
-                                   calibrator_line_range_kms,
-                                   hi_spw_continuum_backup,
-                                   cal_intents=["CALIBRATE*"],
-                                   test_run=False,
-                                   test_print=True)
+            flag_hi_foreground(myvis,
+                               calibrator_line_range_kms,
+                               hi_flag_spws,
+                               cal_intents=["CALIBRATE*"],
+                               test_run=False,
+                               test_print=True)
 
             # Hanning smoothing is turned off for spectral lines.
             # hifv_hanning(pipelinemode="automatic")
@@ -8,9 +8,76 @@ import os
 
 # from taskinit import casalog
 
-from casatools import logsink
+from lband_pipeline.casa_logging import casalog
 
-casalog = logsink()
+
+# km/s. Upper limit on the observatory velocity relative to the LSR: Earth's orbit
+# (~30 km/s), the solar motion (~20 km/s) and Earth's rotation.
+_MAX_LSRK_SPEED_KMS = 50.
+
+
+def hi_foreground_flag_commands(field_names, vels_lsrk_dict,
+                                calibrator_line_range_kms,
+                                test_print=False):
+    '''
+    Build `flagdata` list-mode commands to flag the HI velocity range for each
+    calibrator field over all of the given SPWs.
+
+    Parameters
+    ----------
+    field_names : list
+        Calibrator field names.
+    vels_lsrk_dict : dict
+        LSRK (radio) velocities in km/s of the channels, keyed by SPW number.
+    calibrator_line_range_kms : dict
+        Dictionary with velocity range (in LSRK; radio) to flag.
+
+    Returns
+    -------
+    flag_cmds : list
+        One `mode='manual'` command per field covering all SPWs.
+    '''
+
+    flag_cmds = []
+
+    for field in field_names:
+
+        if field not in calibrator_line_range_kms:
+            casalog.post('Unable to locate calibrator {} in calibrator list.'.format(field))
+            casalog.post('Check `calibrator_setup.py` to see if this source is missing')
+
+            continue
+
+        vel_start = calibrator_line_range_kms[field]['HI'][0]
+        vel_stop = calibrator_line_range_kms[field]['HI'][1]
+
+        # Keep red to blue shifted order.
+        if vel_start < vel_stop:
+            vel_stop, vel_start = vel_start, vel_stop
+
+        spw_selections = []
+
+        for hi_spw_num in vels_lsrk_dict:
+
+            vels_lsrk = vels_lsrk_dict[hi_spw_num]
+
+            chan_start = np.abs(vels_lsrk - vel_start).argmin()
+            chan_stop = np.abs(vels_lsrk - vel_stop).argmin()
+
+            # Keep the channel range in increasing order regardless of the SPW frequency order.
+            chan_start, chan_stop = min(chan_start, chan_stop), max(chan_start, chan_stop)
+
+            if test_print:
+                print('Field {0} flagging region {1}:{2}~{3}'.format(field, hi_spw_num,
+                                                                     chan_start, chan_stop))
+                print('Velocity: {0}, {1}'.format(vel_start, vel_stop))
+
+            spw_selections.append('{0}:{1}~{2}'.format(hi_spw_num, chan_start, chan_stop))
+
+        flag_cmds.append("mode='manual' field='{0}' spw='{1}'".format(field,
+                                                                      ",".join(spw_selections)))
+
+    return flag_cmds
 
 
 def flag_hi_foreground(myvis,
@@ -23,20 +90,28 @@ def flag_hi_foreground(myvis,
     Define velocity regions to flag for all (or chosen) calibration
     fields based on intent.
 
+    All field and SPW channel ranges are applied in a single `flagdata` list-mode
+    call so the MS is only scanned once.
+
     Parameters
     ----------
     myvis : str
         MS name.
     calibrator_line_range_kms : dict
         Dictionary with velocity range (in LSRK; radio) to flag.
-    hi_spw_num : int
-        The SPW of HI in the MS. If None is given, the context is used to
-        identify the SPW overlapping the HI line (where we can ignore wideband
-        continuum SPWs).
+    hi_spw_num : int or list
+        The SPW(s) covering the HI line in the MS.
     cal_intents : list, optional
         List of the calibrator field intents to apply flagging to.
     test_print : bool, optional
         Print out additional information for testing purposes.
+    test_run : bool, optional
+        Return the flagging commands without applying them.
+
+    Returns
+    -------
+    flag_cmds : list
+        The `flagdata` commands used for the flagging.
 
     '''
 
@@ -53,6 +128,11 @@ def flag_hi_foreground(myvis,
 
     from casatasks import flagdata, flagmanager
 
+    if isinstance(hi_spw_num, (list, tuple, np.ndarray)):
+        hi_spw_nums = list(hi_spw_num)
+    else:
+        hi_spw_nums = [hi_spw_num]
+
     # msmd = msmdtool()
     # ms = mstool()
 
@@ -84,49 +164,102 @@ def flag_hi_foreground(myvis,
     # and convert mapping from velocity -> freq (LSRK) -> channel.
     # myms.open(myvis)
 
-    freqs_lsrk = myms.cvelfreqs(spwids=[hi_spw_num], outframe='LSRK')
+    # in Hz
+    hi_restfreq = 1.420405752e9
+
+    vels_lsrk_dict = {}
+    for this_spw in hi_spw_nums:
+        freqs_lsrk = myms.cvelfreqs(spwids=[this_spw], outframe='LSRK')
+        vels_lsrk_dict[this_spw] = lines_freq2vels(freqs_lsrk, hi_restfreq)
 
     myms.close()
 
-    # in Hz
-    hi_restfreq = 1.420405752e9
-    vels_lsrk = lines_freq2vels(freqs_lsrk, hi_restfreq)
+    flag_cmds = hi_foreground_flag_commands(field_names, vels_lsrk_dict,
+                                            calibrator_line_range_kms,
+                                            test_print=test_print)
 
-    for field in field_names:
+    if test_print:
+        print("Flagging commands: {}".format(flag_cmds))
 
-        if field not in calibrator_line_range_kms:
-            casalog.post('Unable to locate calibrator {} in calibrator list.'.format(field))
-            casalog.post('Check `calibrator_setup.py` to see if this source is missing')
+    if test_run or len(flag_cmds) == 0:
+        return flag_cmds
 
-            continue
+    flagdata(myvis, mode='list', inpfile=flag_cmds, flagbackup=False)
 
-        vel_start = calibrator_line_range_kms[field]['HI'][0]
-        vel_stop = calibrator_line_range_kms[field]['HI'][1]
+    flagmanager(myvis, mode='save', versionname='MW_HI_abs_flagging',
+                comment='Flag Milky Way HI absorption for calibrators.')
 
-        # Keep red to blue shifted order.
-        if vel_start < vel_stop:
-            vel_stop, vel_start = vel_start, vel_stop
+    return flag_cmds
 
-        chan_start = np.abs(vels_lsrk - vel_start).argmin()
-        chan_stop = np.abs(vels_lsrk - vel_stop).argmin()
 
-        # Do the flagging and save a new version
+def merge_line_ranges(line_freqs):
+    """
+    Merge overlapping or touching line ranges.
 
-        if test_print:
-            print('Field {0} flagging region {1}:{2}~{3}'.format(field, hi_spw_num,
-                                                                 chan_start, chan_stop))
-            print('Velocity: {0}, {1}'.format(vel_start, vel_stop))
+    :param line_freqs: (N, 2) array-like of line start and end freqs.
+    :return: sorted, disjoint arrays of the merged start and end freqs.
+    """
 
-        if test_run:
-            continue
+    line_freqs = np.asarray(line_freqs, dtype=float).reshape(-1, 2)
+
+    if line_freqs.shape[0] == 0:
+        return np.empty(0), np.empty(0)
+
+    order = np.argsort(line_freqs[:, 0], kind='stable')
+    line_starts = line_freqs[order, 0]
+    line_ends = line_freqs[order, 1]
+
+    # Running max of the end freqs. A new merged range begins where a line starts
+    # after every previous line has ended.
+    max_ends = np.maximum.accumulate(line_ends)
+
+    new_range = np.ones(line_starts.size, dtype=bool)
+    new_range[1:] = line_starts[1:] > max_ends[:-1]
+
+    range_starts = np.flatnonzero(new_range)
+    range_stops = np.append(range_starts[1:], line_starts.size) - 1
+
+    return line_starts[range_starts], max_ends[range_stops]
+
+
+def partition_cont_ranges(line_freqs, spw_starts, spw_ends):
+    """
+    Cut the continuum ranges of several SPWs to avoid the same set of lines.
+
+    The line ranges are merged once and located in each SPW with a binary search,
+    so the cost is O((nlines + nspw) log nlines).
 
-        flagdata(myvis, mode='manual', field=field,
-                 spw='{0}:{1}~{2}'.format(hi_spw_num, chan_start, chan_stop),
-                 flagbackup=False)
+    :param line_freqs: line frequencies in GHz. Given as a list of two component
+        [start, end] freqs.
+    :param spw_starts: starts of the SPWs in GHz
+    :param spw_ends: ends of the SPWs in GHz
+    :return: list with the continuum chunks of each SPW, each defined as a dictionary
+        with start and end freqs in GHz.
+    """
+
+    merged_starts, merged_ends = merge_line_ranges(line_freqs)
+
+    spw_starts = np.atleast_1d(np.asarray(spw_starts, dtype=float))
+    spw_ends = np.atleast_1d(np.asarray(spw_ends, dtype=float))
+
+    # Merged ranges that overlap each SPW: end >= SPW start and start <= SPW end.
+    first_idx = np.searchsorted(merged_ends, spw_starts, side='left')
+    last_idx = np.searchsorted(merged_starts, spw_ends, side='right')
+
+    all_chunks = []
+
+    for spw_start, spw_end, lo, hi in zip(spw_starts, spw_ends, first_idx, last_idx):
+
+        # Continuum runs between the end of one line range and the start of the next.
+        chunk_starts = np.maximum(np.append(spw_start, merged_ends[lo:hi]), spw_start)
+        chunk_ends = np.minimum(np.append(merged_starts[lo:hi], spw_end), spw_end)
+
+        keep = chunk_ends > chunk_starts
+
+        all_chunks.append([dict(start=float(start), end=float(end))
+                           for start, end in zip(chunk_starts[keep], chunk_ends[keep])])
 
-    if not test_run:
-        flagmanager(myvis, mode='save', versionname='MW_HI_abs_flagging',
-                    comment='Flag Milky Way HI absorption for calibrators.')
+    return all_chunks
 
 
 def partition_cont_range(line_freqs=[], spw_start=1, spw_end=2,
@@ -141,66 +274,129 @@ def partition_cont_range(line_freqs=[], spw_start=1, spw_end=2,
         freqs in GHz.
     """
 
-    # make sure lists are treaded as float vectors
-    line_freqs = np.array(line_freqs)
+    if test_print:
+        print("All line freqs {}".format(line_freqs))
+        print("SPW limits: {0}~{1}".format(spw_start, spw_end))
 
-    # define line ranges that will be excluded
-    # line_starts = line_freqs - 0.5 * line_widths
-    # line_ends = line_freqs + 0.5 * line_widths
+    cont_chunks = partition_cont_ranges(line_freqs, [spw_start], [spw_end])[0]
 
     if test_print:
-        print("All line freqs {}".format(line_freqs))
-        print("Start line freqs {}".format(line_freqs[:, 0]))
-        print("End line freqs {}".format(line_freqs[:, 1]))
+        print("Found cont chunks: {}".format(cont_chunks))
 
-    line_starts = line_freqs[:, 0]
-    line_ends = line_freqs[:, 1]
+    return cont_chunks
 
-    # start with the whole spw as one continuum chunk
-    cont_chunks = [dict(start=spw_start, end=spw_end)]
 
-    if test_print:
-        print("SPW limits: {}".format(cont_chunks))
-        print("SPW len: {}".format(len(cont_chunks)))
-
-    for i in range(len(line_starts)):
-        # for each line loop over the continuum chunk collection and modify it in the process
-        j = 0
-        while j < len(cont_chunks):
-            # line outside chunk, skip
-            if line_ends[i] < cont_chunks[j]["start"] or line_starts[i] > cont_chunks[j]["end"]:
-                pass
-
-            # line covers whole chunk, delete it
-            elif line_starts[i] <= cont_chunks[j]["start"] and line_ends[i] >= cont_chunks[j]["end"]:
-                cont_chunks.pop(j)
-                j = j - 1
-
-            # line covers left edge only, edit cont chunk start
-            elif line_starts[i] < cont_chunks[j]["start"] and line_ends[i] >= cont_chunks[j]["start"]:
-                cont_chunks[j]["start"] = line_ends[i]
-
-            # line covers right edge only, edit cont chunk end
-            elif line_starts[i] <= cont_chunks[j]["end"] and line_ends[i] > cont_chunks[j]["end"]:
-                cont_chunks[j]["end"] = line_starts[i]
-
-            # line in the middle, splits chunk into two
-            elif line_starts[i] > cont_chunks[j]["start"] and line_ends[i] < cont_chunks[j]["end"]:
-                cont_chunks.insert(j + 1, dict(start=line_ends[i], end=cont_chunks[j]["end"]))
-                cont_chunks[j]["end"] = line_starts[i]
-                j = j + 1
-
-            # other non-implemented scenarios (are all useful cases covered? any pathological edge case?)
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Angular distance between two sky directions from the Vincenty formula.
+
+    :param ra1: RA of the first direction in radians
+    :param dec1: Dec of the first direction in radians
+    :param ra2: RA of the second direction in radians
+    :param dec2: Dec of the second direction in radians
+    :return: separation in radians
+    """
+
+    dra = ra2 - ra1
+
+    num1 = np.cos(dec2) * np.sin(dra)
+    num2 = np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(dra)
+    denom = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(dra)
+
+    return np.arctan2(np.hypot(num1, num2), denom)
+
+
+def lsrk_direction_tolerance(freqs, max_shift_chan=0.1):
+    """
+    Largest separation between two directions whose LSRK frequency grids differ
+    by less than `max_shift_chan` channels.
+
+    The LSRK correction is the observatory velocity relative to the LSR projected
+    on the line of sight, so it changes by at most `_MAX_LSRK_SPEED_KMS` times the
+    separation in radians (~0.9 km/s per degree).
+
+    :param freqs: channel frequencies of the SPW
+    :param max_shift_chan: largest shift of the grid as a fraction of a channel
+    :return: separation in radians. 0 for a single channel.
+    """
+
+    freqs = np.asarray(freqs, dtype=float)
+
+    if freqs.size < 2:
+        return 0.
+
+    ckms = 299792458.0 / 1000.
+    chan_width_kms = ckms * np.median(np.abs(np.diff(freqs))) / np.mean(freqs)
+
+    return min(np.pi, max_shift_chan * chan_width_kms / _MAX_LSRK_SPEED_KMS)
+
+
+def get_freq_grid(myms, spw, frame, field_id=None, direction=None,
+                  freq_grid_cache=None, tolerance_arcmin=None, max_shift_chan=0.1):
+    """
+    Channel frequencies of an SPW in the given frame from `ms.cvelfreqs`, cached
+    by (spw, frame, field direction).
+
+    Fields of a mosaic share the SPW setup, so the frame conversion is reused for
+    pointings close to a direction already in the cache. By default, the tolerance
+    is set from the channel width with `lsrk_direction_tolerance`, so the shared grid
+    is within `max_shift_chan` channels of the field's own grid. For L-band mosaics
+    with pointings ~15 arcmin apart, all pointings share the grids of the continuum
+    SPWs with 1 MHz channels (~24 deg), but not of the HI SPW (~1.4 arcmin for
+    0.2 km/s channels). The TOPO grid does not depend on the direction and is shared
+    by all fields.
+
+    :param myms: open casatools ms tool
+    :param spw: SPW number
+    :param frame: output frame (e.g., 'LSRK' or 'TOPO')
+    :param field_id: field number used for the frame conversion
+    :param direction: (RA, Dec) of the field in radians. Required for sharing
+        non-TOPO grids between fields.
+    :param freq_grid_cache: dictionary to store the grids in. No caching when None.
+    :param tolerance_arcmin: largest separation in arcmin between directions that
+        share a grid. Overrides the tolerance set from the channel width.
+    :param max_shift_chan: largest shift of a shared grid as a fraction of a channel,
+        when `tolerance_arcmin` is None
+    :return: channel frequencies in Hz
+    """
+
+    frame = frame.upper()
+
+    if frame == 'TOPO':
+        key = (spw, frame, None)
+    elif direction is not None:
+        key = (spw, frame, (float(direction[0]), float(direction[1])))
+
+        if freq_grid_cache is not None:
+            if tolerance_arcmin is None:
+                # The channel width from the (shared) TOPO grid.
+                tolerance = lsrk_direction_tolerance(get_freq_grid(myms, spw, 'TOPO',
+                                                                   freq_grid_cache=freq_grid_cache),
+                                                     max_shift_chan=max_shift_chan)
             else:
-                pass
+                tolerance = np.deg2rad(tolerance_arcmin / 60.)
 
-            # progress to the next chunk
-            j = j + 1
+            for cache_key in freq_grid_cache:
+                if cache_key[:2] != (spw, frame) or not isinstance(cache_key[2], tuple):
+                    continue
 
-    if test_print:
-        print("Found cont chunks: {}".format(cont_chunks))
+                if angular_separation(*cache_key[2], *key[2]) <= tolerance:
+                    key = cache_key
+                    break
+    else:
+        key = (spw, frame, field_id)
 
-    return cont_chunks
+    if freq_grid_cache is not None and key in freq_grid_cache:
+        return freq_grid_cache[key]
+
+    fieldids = [] if field_id is None else [int(field_id)]
+
+    freqs = np.asarray(myms.cvelfreqs(spwids=[spw], fieldids=fieldids, outframe=frame))
+
+    if freq_grid_cache is not None:
+        freq_grid_cache[key] = freqs
+
+    return freqs
 
 
 def build_cont_dat(vis, target_line_range_kms,
@@ -208,7 +404,10 @@ def build_cont_dat(vis, target_line_range_kms,
                    fields=[],
                    outfile="cont.dat", overwrite=False, append=False,
                    test_print=False,
-                   raise_missing_target=False):
+                   raise_missing_target=False,
+                   freq_grid_cache=None,
+                   direction_tolerance_arcmin=None,
+                   max_shift_chan=0.1):
     """
     Creates a cont.dat file for the VLA pipeline. Must be run in CASA (uses msmetadata).
     It currently reads SPW edges in the original observed frame (usually TOPO),
@@ -222,6 +421,13 @@ def build_cont_dat(vis, target_line_range_kms,
     :param outfile: path to the output cont.dat file
     :param overwrite: if True and the outfile exists, it will be overriten
     :param append: add at the end of existing cont.dat file, useful for optimising lines per field
+    :param freq_grid_cache: dictionary of cached frequency grids (see `get_freq_grid`).
+        A new cache is used for this MS when None.
+    :param direction_tolerance_arcmin: fields within this many arcmin share the LSRK
+        frequency grids. By default, the tolerance is set per SPW from the channel
+        width (see `get_freq_grid`).
+    :param max_shift_chan: largest shift of a shared LSRK grid as a fraction of a
+        channel, when `direction_tolerance_arcmin` is None
     :return: None
     """
 
@@ -255,10 +461,18 @@ def build_cont_dat(vis, target_line_range_kms,
         print("ERROR: file already exists!")
         return
 
+    if freq_grid_cache is None:
+        freq_grid_cache = {}
+
     # generate a dictonary containing continuum chunks for every spw of every field
     cont_dat = {}
     for field in fields:
         spws = mymsmd.spwsforfield(field)
+
+        # Field direction for the LSRK conversion. Nearby mosaic pointings share the grids.
+        field_id = mymsmd.fieldsforname(field)[0]
+        phasecenter = mymsmd.phasecenter(field_id)
+        field_direction = (phasecenter['m0']['value'], phasecenter['m1']['value'])
         cont_dat_field = {}
 
         # Match target with the galaxy. Names should be unique enough to do this
@@ -275,6 +489,12 @@ def build_cont_dat(vis, target_line_range_kms,
                 casalog.post("Unable to match field {} to expected galaxy targets. Skipping.".format(field))
                 continue
 
+        # SPWs with lines in range, with their TOPO extents and line ranges.
+        partition_spws = []
+        spw_starts = []
+        spw_ends = []
+        field_line_freqs = []
+
         for spw in spws:
             # Get freq range of the SPW
             # chan_freqs = mymsmd.chanfreqs(spw)
@@ -282,10 +502,16 @@ def build_cont_dat(vis, target_line_range_kms,
             # TODO: implement some transformations to LSRK for the edges?
 
             # Grab freqs in LSRK and TOPO
-            freqs_lsrk = myms.cvelfreqs(spwids=[spw], outframe='LSRK')
-            freqs_topo = myms.cvelfreqs(spwids=[spw], outframe='TOPO')
+            freqs_lsrk = get_freq_grid(myms, spw, 'LSRK', field_id=field_id,
+                                       direction=field_direction,
+                                       freq_grid_cache=freq_grid_cache,
+                                       tolerance_arcmin=direction_tolerance_arcmin,
+                                       max_shift_chan=max_shift_chan)
+            freqs_topo = get_freq_grid(myms, spw, 'TOPO', field_id=field_id,
+                                       freq_grid_cache=freq_grid_cache)
 
             line_freqs_topo = []
+            line_freqs_used = None
 
             for line in line_freqs:
 
@@ -335,18 +561,29 @@ def build_cont_dat(vis, target_line_range_kms,
                 if skip_line:
                     continue
 
-                spw_start = np.min(freqs_topo) * 1e-9  # GHz
-                spw_end = np.max(freqs_topo) * 1e-9  # GHz
+                # Line ranges included up to the last line within the SPW.
+                line_freqs_used = list(line_freqs_topo)
+
+            # Collect the SPW extents and line ranges to partition once per field.
+            if line_freqs_used is not None:
 
                 if test_print:
-                    print("SPW {}: {}".format(spw, line_freqs_topo))
+                    print("SPW {}: {}".format(spw, line_freqs_used))
 
-                cont_chunks = partition_cont_range(line_freqs_topo, spw_start, spw_end,
-                                                   test_print=test_print)
-                cont_dat_field.update({spw: cont_chunks})
+                partition_spws.append(spw)
+                spw_starts.append(np.min(freqs_topo) * 1e-9)  # GHz
+                spw_ends.append(np.max(freqs_topo) * 1e-9)  # GHz
+                field_line_freqs.extend(line_freqs_used)
+
+        # Each SPW only keeps the merged line ranges that overlap it.
+        if len(partition_spws) > 0:
+            all_cont_chunks = partition_cont_ranges(field_line_freqs, spw_starts, spw_ends)
 
-            # print(spw, cont_chunks)
-            # print(spw_start, spw_end)
+            for spw, cont_chunks in zip(partition_spws, all_cont_chunks):
+                if test_print:
+                    print("SPW {} cont chunks: {}".format(spw, cont_chunks))
+
+                cont_dat_field.update({spw: cont_chunks})
 
         cont_dat.update({field: cont_dat_field})
 
@@ -395,13 +632,43 @@ def lines_freq2vels(freqs, restfreq):
     return vrad
 
 
+def nearest_channel(freq, freqs):
+    '''
+    Index of the channel closest to `freq` in a monotonic frequency grid.
+
+    Uses a binary search and gives the same channel as
+    `np.abs(freqs - freq).argmin()`, including ties.
+    '''
+
+    freqs = np.asarray(freqs)
+
+    if freqs.size == 1:
+        return 0
+
+    # Channel freqs decrease for flipped SPWs. Search on the reversed view.
+    descending = freqs[0] > freqs[-1]
+    sorted_freqs = freqs[::-1] if descending else freqs
+
+    idx = int(np.clip(np.searchsorted(sorted_freqs, freq), 1, freqs.size - 1))
+
+    dist_left = abs(freq - sorted_freqs[idx - 1])
+    dist_right = abs(sorted_freqs[idx] - freq)
+
+    # argmin returns the lower channel index on ties.
+    if descending:
+        chan = idx if dist_right <= dist_left else idx - 1
+        return freqs.size - 1 - chan
+
+    return idx - 1 if dist_left <= dist_right else idx
+
+
 def freq_match_lsrk_to_topo(freq_to_match, freqs_lsrk, freqs_topo):
     '''
     Match channel in freq and return the freq. in TOPO.
     '''
 
     # Match in LSRK
-    chan = np.abs(freqs_lsrk - freq_to_match).argmin()
+    chan = nearest_channel(freq_to_match, freqs_lsrk)
 
     # Return channel in TOPO
     return freqs_topo[chan]
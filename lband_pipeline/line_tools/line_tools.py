@@ -3,13 +3,11 @@ import os
 from glob import glob
 from copy import copy, deepcopy
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import shutil
-import scipy.ndimage as nd
 
-from casatasks import bandpass
-from casatools import logsink
-
-casalog = logsink()
+from lband_pipeline.casa_logging import casalog
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
 
 
 def bandpass_with_gap_interpolation_deprecated(myvis, context, refantignore="",
@@ -30,6 +28,8 @@ def bandpass_with_gap_interpolation_deprecated(myvis, context, refantignore="",
 
     '''
 
+    from casatasks import bandpass
+
     import pipeline.hif.heuristics.findrefant as findrefant
 
     # Look for BP table
@@ -153,7 +153,8 @@ def bandpass_with_gap_interpolation_deprecated(myvis, context, refantignore="",
 
 def bandpass_with_gap_interpolation(myvis, hi_spwid,
                                     search_string="test",
-                                    task_string="hifv_testBPdcals"):
+                                    task_string="hifv_testBPdcals",
+                                    nworkers=1):
     '''
     Improved interpolation across bandpass gaps. This time without needing to recompute the bandpass!
 
@@ -169,9 +170,23 @@ def bandpass_with_gap_interpolation(myvis, hi_spwid,
 
     Parameters
     ----------
+    myvis : str
+        MS name.
+    hi_spwid : int or list
+        SPW(s) to interpolate across. A list of SPWs is read and written in a single
+        pass over the table.
+    nworkers : int, optional
+        Number of processes used to interpolate multiple SPWs. Default is 1.
 
     '''
 
+    from casatasks import bandpass
+
+    if isinstance(hi_spwid, (list, tuple, np.ndarray)):
+        spw_ids = list(hi_spwid)
+    else:
+        spw_ids = [hi_spwid]
+
     # Look for BP table
     bpname = glob("{0}.{1}.s*_4.{2}BPcal*.tbl".format(myvis, task_string, search_string))
 
@@ -197,12 +212,13 @@ def bandpass_with_gap_interpolation(myvis, hi_spwid,
     # Add better interpolation scheme. This should only be need for HI?
 
     interpolate_bandpass(bpname,
-                         spw_ids=[hi_spwid],
+                         spw_ids=spw_ids,
                          poly_order=2,  # Works well from Josh and Eric's testing
                          add_residuals=False,  # We re-add residuals to match the noise in the gap
                          backup_table=True,  # A backup table is always made.
                          test_output_nowrite=False,
-                         test_print=False)
+                         test_print=False,
+                         nworkers=nworkers)
 
 ###############################
 # Josh Marvil's code for bandpass interpolation across gaps.
@@ -210,17 +226,353 @@ def bandpass_with_gap_interpolation(myvis, hi_spwid,
 ###############################
 
 
-def rolling_window(x, k):
-    y = np.ma.zeros((len(x), k), dtype='complex128')
+def strided_window_view(arr, k):
+    '''
+    Read-only (len(arr), k) view of windows centred on each element of a 1D array.
+
+    The array is padded by repeating the edge values so every window has `k`
+    elements. Only the padded array is allocated; the windows are a strided
+    view into it.
+    '''
+
     k2 = (k - 1) // 2
-    y[:, k2] = x
-    for i in range(k2):
-        j = k2 - i
-        y[j:, i] = x[:-j]
-        y[:j, i] = x[0]
-        y[:-j, -(i + 1)] = x[j:]
-        y[-j:, -(i + 1)] = x[-1]
-    return y
+
+    padded = np.pad(arr, (k2, k - 1 - k2), mode='edge')
+
+    return as_strided(padded, shape=(len(arr), k),
+                      strides=(padded.strides[0], padded.strides[0]),
+                      writeable=False)
+
+
+def rolling_window(x, k):
+    '''
+    Rolling windows of size `k` (odd) centred on each channel of the masked
+    array `x`, replicating the edge values (and their flags) past the ends.
+
+    Returns a read-only masked array view with shape (len(x), k). Memory use
+    is O(len(x) + k) instead of O(len(x) * k).
+    '''
+
+    x = np.ma.asarray(x)
+
+    return np.ma.array(strided_window_view(x.data, k),
+                       mask=strided_window_view(np.ma.getmaskarray(x), k),
+                       copy=False)
+
+
+def masked_savgol_fit(data, mask, window_size, poly_order):
+    '''
+    Batched Savitzky-Golay smoothing for masked spectra.
+
+    Computes the same local polynomial fits as calling `np.ma.polyfit` on every
+    row of `rolling_window`, but for all channels of all spectra at once. The
+    weighted moment sums for the normal equations are built by correlating the
+    data and mask with powers of the window offsets, and the small
+    (poly_order + 1) x (poly_order + 1) systems are then solved together.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Spectra with shape (nspec, nchan).
+    mask : np.ndarray
+        Boolean mask matching `data`. True values are excluded from the fits.
+    window_size : int
+        Number of channels in the smoothing window. Must be odd.
+    poly_order : int
+        Order of the local polynomial fits.
+
+    Returns
+    -------
+    smooth_data : np.ndarray
+        The fitted value at the centre of the window for every channel. Channels with
+        fewer than `poly_order + 1` unmasked points in the window are set to NaN.
+    '''
+
+    import scipy.ndimage as nd
+
+    if window_size % 2 == 0:
+        raise ValueError("window_size must be odd. Given {}".format(window_size))
+
+    data = np.atleast_2d(data)
+    weights = (~np.atleast_2d(mask)).astype(float)
+
+    # Masked values cannot contribute to the sums.
+    wdata = np.where(weights > 0, data, 0.)
+
+    nterms = poly_order + 1
+    half_window = (window_size - 1) // 2
+
+    # Scale the offsets to [-1, 1] to keep the normal equations well-conditioned.
+    # This does not change the constant term of the fit.
+    x_offsets = (np.arange(window_size) - half_window) / max(half_window, 1)
+
+    # mode='nearest' reproduces the edge replication in `rolling_window`.
+    moments = np.empty((2 * poly_order + 1,) + weights.shape)
+    for kk in range(2 * poly_order + 1):
+        moments[kk] = nd.correlate1d(weights, x_offsets**kk, axis=-1, mode='nearest')
+
+    rhs = np.empty((nterms,) + weights.shape, dtype=np.result_type(data, float))
+    for kk in range(nterms):
+        rhs[kk] = nd.correlate1d(wdata.real, x_offsets**kk, axis=-1, mode='nearest')
+        if np.iscomplexobj(wdata):
+            rhs[kk] += 1j * nd.correlate1d(wdata.imag, x_offsets**kk, axis=-1, mode='nearest')
+
+    # Too few points for the fit. Same condition as the per-channel loop.
+    valid = np.rint(moments[0]) >= nterms
+
+    # Normal equations: A[a, b] = sum(w x^(a + b)) and B[a] = sum(w x^a y)
+    term_idx = np.add.outer(np.arange(nterms), np.arange(nterms))
+    lhs = np.moveaxis(moments[term_idx], (0, 1), (-2, -1))
+    rhs = np.moveaxis(rhs, 0, -1)[..., np.newaxis]
+
+    # Avoid singular matrices for the invalid channels. These become NaNs below.
+    lhs[~valid] = np.eye(nterms)
+    rhs[~valid] = 0.
+
+    smooth_data = np.linalg.solve(lhs, rhs)[..., 0, 0]
+    smooth_data[~valid] = np.nan
+
+    return smooth_data
+
+
+def interpolate_bandpass_gaps(dat, spw=None,
+                              window_size_factor=2.5,
+                              poly_order=2,
+                              add_residuals=True,
+                              method='batched',
+                              rng=None,
+                              test_print=False):
+    '''
+    Interpolate across the flagged gaps for one SPW of a bandpass table.
+
+    Parameters
+    ----------
+    dat : np.ma.MaskedArray
+        CPARAM values masked by the FLAG column, with shape (npol, nchan, nant).
+        Modified in place.
+    spw : int, optional
+        SPW number. Only used for logging.
+    window_size_factor : float, optional
+        Size of the smoothing window relative to the largest gap.
+    poly_order : int, optional
+        Order of the Savitzky-Golay polynomial.
+    add_residuals : bool, optional
+        Add residuals randomly sampled from the smoothed fit to the interpolated
+        region to keep a consistent noise level.
+    method : str, optional
+        'batched' fits all spectra at once with `masked_savgol_fit`. 'polyfit'
+        uses the original per-channel `np.ma.polyfit` loop.
+    rng : np.random.Generator, optional
+        Random generator used to sample the residuals when `add_residuals=True`.
+        Defaults to the global `np.random` state.
+
+    Returns
+    -------
+    dat : np.ma.MaskedArray
+        The bandpass with the gaps filled and unflagged.
+    '''
+
+    import scipy.ndimage as nd
+
+    if method not in ['batched', 'polyfit']:
+        raise ValueError("method must be 'batched' or 'polyfit'. Given {}".format(method))
+
+    if rng is None:
+        rng = np.random
+
+    dat_shape = dat.shape
+
+    smooth_dat = deepcopy(dat)
+
+    # Find the gaps and window size for each antenna and polarization.
+    gap_info = {}
+
+    for ant in range(dat_shape[2]):
+        for pol in range(dat_shape[0]):
+
+            # Skip if all flagged.
+            if np.all(dat.mask[pol, :, ant]):
+                continue
+
+            # Determine ranges to interpolate over
+            blank_slices = nd.find_objects(*nd.label(dat[pol, :, ant].mask))
+
+            # If there's only 2 slices, it's the SPW edge flagging.
+            # No interpolation needed.
+            if len(blank_slices) == 2:
+                continue
+
+            # Otherwise we'll mask out the middle gaps
+            # Remove the edges.
+            if len(blank_slices) > 1:
+                blank_slices.pop(0)
+                blank_slices.pop(-1)
+
+            nchans_in_gap = max([(thisslc[0].stop - thisslc[0].start)
+                                 for thisslc in blank_slices])
+
+            # Define the window size based on the given fraction of the num of SPW channels
+            window_size = int(np.floor(window_size_factor * nchans_in_gap))
+
+            # Force odd window size
+            if window_size % 2 == 0:
+                window_size += 1
+
+            casalog.post(message="Using window size of {0} for SPW {1}".format(window_size, spw),
+                         origin='interpolate_bandpass')
+
+            # Print a warning if the gap is >50% of the whole SPW
+            if window_size / dat.shape[1] > 0.5:
+                casalog.post(message="Warning: the window size is >50% of the SPW",
+                             origin='interpolate_bandpass')
+
+            # Mask out the gap.
+            for slicer in blank_slices:
+                smooth_dat.mask[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = True
+
+            gap_info[(pol, ant)] = (blank_slices, window_size)
+
+    if method == 'batched':
+        # Spectra with the same window size are fit together. This is normally
+        # all of them as the gap is flagged on every antenna.
+        for window_size in sorted(set([info[1] for info in gap_info.values()])):
+
+            pols = [key[0] for key in gap_info if gap_info[key][1] == window_size]
+            ants = [key[1] for key in gap_info if gap_info[key][1] == window_size]
+
+            smooth_dat[pols, :, ants] = masked_savgol_fit(smooth_dat.data[pols, :, ants],
+                                                          smooth_dat.mask[pols, :, ants],
+                                                          window_size, poly_order)
+
+    else:
+        for (pol, ant) in gap_info:
+
+            window_size = gap_info[(pol, ant)][1]
+
+            x_polyfit = np.arange(window_size) - np.floor(window_size / 2.)
+
+            rolled_array = rolling_window(smooth_dat[pol, :, ant], window_size)
+
+            for i in range(dat_shape[1]):
+                # Skip if too few points:
+                if (rolled_array[i].mask == False).sum() < poly_order + 1:
+                    smooth_dat[pol, i, ant] = np.nan
+                    continue
+
+                smooth_dat[pol, i, ant] = np.ma.polyfit(x_polyfit,
+                                                        rolled_array[i],
+                                                        poly_order)[-1]
+
+    # Keep the antenna/polarization order so residuals are drawn from the
+    # RNG in the same sequence for both methods.
+    for ant in range(dat_shape[2]):
+        casalog.post(message='processing antenna {0}'.format(ant),
+                     origin='interpolate_bandpass')
+        for pol in range(dat_shape[0]):
+
+            if (pol, ant) not in gap_info:
+                continue
+
+            blank_slices = gap_info[(pol, ant)][0]
+
+            casalog.post(message="replacing values with smoothed",
+                         origin='interpolate_bandpass')
+
+            if add_residuals:
+                resids = dat[pol, :, ant] - smooth_dat[pol, :, ant]
+
+            # Add the interpolated values back to the original array
+            for slicer in blank_slices:
+
+                dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = \
+                    smooth_dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))]
+
+                # Optionally sample residuals from the difference and add to the interpolated
+                # region to keep a consistent noise level.
+                if add_residuals:
+
+                    gap_size = slicer[0].stop - slicer[0].start
+                    resid_samps = rng.choice(resids[~resids.mask], size=gap_size)
+
+                    # Pad some axes on.
+                    resid_samps = resid_samps[np.newaxis, :, np.newaxis]
+
+                    dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] += resid_samps
+
+                # Reset the mask across the interp region
+                dat.mask[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = False
+
+            # Keeping just for diagnosing issues
+            if test_print:
+                print((slice(pol, pol + 1), slicer[0], slice(ant, ant + 1)))
+                print(dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))].shape)
+                print(dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))][:10])
+                print(smooth_dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))][:10])
+
+    return dat
+
+
+def _interpolate_bandpass_gaps_worker(args):
+    '''
+    Process pool wrapper for `interpolate_bandpass_gaps`.
+    '''
+
+    dat, kwargs = args
+
+    return interpolate_bandpass_gaps(dat, **kwargs)
+
+
+def interpolate_bandpass_spws(spw_data,
+                              window_size_factor=2.5,
+                              poly_order=2,
+                              add_residuals=True,
+                              method='batched',
+                              nworkers=1,
+                              seed=None,
+                              test_print=False):
+    '''
+    Run `interpolate_bandpass_gaps` on a set of SPWs, optionally in a process pool.
+
+    Parameters
+    ----------
+    spw_data : dict
+        Masked CPARAM arrays keyed by SPW number.
+    nworkers : int, optional
+        Number of worker processes. Default is 1 (serial).
+    seed : int, optional
+        Seed for sampling the residuals when `add_residuals=True`. Each SPW
+        uses a generator seeded by (seed, spw) so the output does not depend
+        on `nworkers` or the order the SPWs finish in. When None, the global
+        `np.random` state is used, which is only reproducible for `nworkers=1`.
+
+    Returns
+    -------
+    out_data : dict
+        Interpolated masked arrays keyed by SPW number.
+    '''
+
+    spw_ids = list(spw_data.keys())
+
+    job_args = []
+    for spw in spw_ids:
+        kwargs = {'spw': spw,
+                  'window_size_factor': window_size_factor,
+                  'poly_order': poly_order,
+                  'add_residuals': add_residuals,
+                  'method': method,
+                  'rng': None if seed is None else np.random.default_rng([seed, int(spw)]),
+                  'test_print': test_print}
+
+        job_args.append((spw_data[spw], kwargs))
+
+    results, failures = run_process_pool(_interpolate_bandpass_gaps_worker, job_args,
+                                         nworkers=min(nworkers, len(spw_ids)),
+                                         label="Bandpass interpolation",
+                                         job_names=spw_ids)
+
+    raise_job_failures(failures, label="Bandpass interpolation")
+
+    return dict(zip(spw_ids, results))
 
 
 def interpolate_bandpass(tablename,
@@ -229,15 +581,28 @@ def interpolate_bandpass(tablename,
                          poly_order=2,
                          add_residuals=True,
                          backup_table=True, test_output_nowrite=False,
-                         test_print=False):
+                         test_print=False,
+                         method='batched',
+                         nworkers=1,
+                         seed=None):
     '''
     Use Savitzky-Golay smoothing across flagged channels in the bandpass.
 
     The smoothing window size is set by `window_size_factor`. This will create
     a smoothing length (by default) 2.5 times larger than the gap that will be interpolated
     across. Smaller window sizes will produce artifacts over the interpolated region.
+
+    By default, the fits for all antennas and polarizations in an SPW are computed
+    together (`method='batched'`). `method='polyfit'` uses the original per-channel
+    loop. See `interpolate_bandpass_gaps`.
+
+    The table is read once for all SPWs in `spw_ids`, the SPWs are interpolated
+    (in parallel when `nworkers > 1`), and all SPWs are written back under a single
+    write lock. Set `seed` to make the added residuals reproducible.
     '''
 
+    import scipy.ndimage as nd
+
     from casatools import table
 
     # from taskinit import tbtool, casalog
@@ -252,30 +617,26 @@ def interpolate_bandpass(tablename,
 
     tb.open(tablename)
     all_spw_ids = np.unique(tb.getcol("SPECTRAL_WINDOW_ID"))
-    tb.close()
 
     if spw_ids is None:
         spw_ids = all_spw_ids
     else:
         for spw in spw_ids:
             if spw not in all_spw_ids:
+                tb.close()
                 raise ValueError("SPW {} specified does not exist in the table.".format(spw))
 
-    # We'll just output the corrected data as numpy arrays instead of writing
-    # back to the table.
-    if test_output_nowrite:
-        bp_pass_dict = dict()
+    # Read all requested SPWs in one pass.
+    spw_data = dict()
 
     for spw in spw_ids:
-        casalog.post(message='processing SPW {0}'.format(spw),
+        casalog.post(message='reading SPW {0}'.format(spw),
                      origin='interpolate_bandpass')
 
-        tb.open(tablename)
         stb = tb.query('SPECTRAL_WINDOW_ID == {0}'.format(spw))
         dat = np.ma.array(stb.getcol('CPARAM'))
         dat.mask = stb.getcol('FLAG')
         stb.close()
-        tb.close()
 
         # Identify if there are gaps to interpolate across
         # We ignore the edge masking in all cases.
@@ -289,124 +650,47 @@ def interpolate_bandpass(tablename,
                          origin='interpolate_bandpass')
             continue
 
-        dat_shape = dat.shape
-
-        smooth_dat = deepcopy(dat)
-
-        for ant in range(dat_shape[2]):
-            casalog.post(message='processing antenna {0}'.format(ant),
-                         origin='interpolate_bandpass')
-            for pol in range(dat_shape[0]):
-
-                # Skip if all flagged.
-                if np.all(dat.mask[pol, :, ant]):
-                    continue
-
-                # Determine ranges to interpolate over
-                blank_slices = nd.find_objects(*nd.label(dat[pol, :, ant].mask))
-
-                # If there's only 2 slices, it's the SPW edge flagging.
-                # No interpolation needed.
-                if len(blank_slices) == 2:
-                    continue
-
-                # Otherwise we'll mask out the middle gaps
-                # Remove the edges.
-                if len(blank_slices) > 1:
-                    blank_slices.pop(0)
-                    blank_slices.pop(-1)
-
-                nchans_in_gap = max([(thisslc[0].stop - thisslc[0].start)
-                                     for thisslc in blank_slices])
-
-                # Define the window size based on the given fraction of the num of SPW channels
-                window_size = int(np.floor(window_size_factor * nchans_in_gap))
-
-                # Force odd window size
-                if window_size % 2 == 0:
-                    window_size += 1
-
-                casalog.post(message="Using window size of {0} for SPW {1}".format(window_size, spw),
-                            origin='interpolate_bandpass')
-
-                # Print a warning if the gap is >50% of the whole SPW
-                if window_size / dat.shape[1] > 0.5:
-                    casalog.post(message="Warning: the window size is >50% of the SPW",
-                                 origin='interpolate_bandpass')
-
-                x_polyfit = np.arange(window_size) - np.floor(window_size / 2.)
-
-                # Mask out the gap.
-                for slicer in blank_slices:
-                    smooth_dat.mask[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = True
-
-                rolled_array = rolling_window(smooth_dat[pol, :, ant], window_size)
+        spw_data[spw] = dat
 
-                for i in range(dat_shape[1]):
-                    # Skip if too few points:
-                    if (rolled_array[i].mask == False).sum() < poly_order + 1:
-                        smooth_dat[pol, i, ant] = np.NaN
-                        continue
-
-                    # try:
-                    smooth_dat[pol, i, ant] = np.ma.polyfit(x_polyfit,
-                                                            rolled_array[i],
-                                                            poly_order)[-1]
-                    # What's the catch here? ValueError is all flagged?
-                    # except:
-                    #     pass
-
-                casalog.post(message="replacing values with smoothed",
-                             origin='interpolate_bandpass')
-
-                if add_residuals:
-                    resids = dat[pol, :, ant] - smooth_dat[pol, :, ant]
-
-                # Add the interpolated values back to the original array
-                for slicer in blank_slices:
-
-                    dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = \
-                        smooth_dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))]
-
-                    # Optionally sample residuals from the difference and add to the interpolated
-                    # region to keep a consistent noise level.
-                    if add_residuals:
+    tb.close()
 
-                        gap_size = slicer[0].stop - slicer[0].start
-                        resid_samps = np.random.choice(resids[~resids.mask], size=gap_size)
+    bp_pass_dict = interpolate_bandpass_spws(spw_data,
+                                             window_size_factor=window_size_factor,
+                                             poly_order=poly_order,
+                                             add_residuals=add_residuals,
+                                             method=method,
+                                             nworkers=nworkers,
+                                             seed=seed,
+                                             test_print=test_print)
 
-                        # Pad some axes on.
-                        resid_samps = resid_samps[np.newaxis, :, np.newaxis]
+    # We'll just output the corrected data as numpy arrays instead of writing
+    # back to the table.
+    if test_output_nowrite:
+        return bp_pass_dict
 
-                        dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] += resid_samps
+    if len(bp_pass_dict) == 0:
+        return
 
-                    # Reset the mask across the interp region
-                    dat.mask[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))] = False
+    casalog.post(message="writing out smoothed gaps to table for spws {}".format(list(bp_pass_dict.keys())),
+                 origin='interpolate_bandpass')
 
-                # Keeping just for diagnosing issues
-                if test_print:
-                    print((slice(pol, pol + 1), slicer[0], slice(ant, ant + 1)))
-                    print(dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))].shape)
-                    print(dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))][:10])
-                    print(smooth_dat[(slice(pol, pol + 1), slicer[0], slice(ant, ant + 1))][:10])
+    tb.open(tablename, nomodify=False)
+    tb.lock(write=True)
 
-        if test_output_nowrite:
-            bp_pass_dict[spw] = dat
-            continue
+    try:
+        for spw in bp_pass_dict:
+            dat = bp_pass_dict[spw]
 
-        casalog.post(message="writing out smoothed gaps to table for spw {}".format(spw),
-                     origin='interpolate_bandpass')
+            stb = tb.query('SPECTRAL_WINDOW_ID == {0}'.format(spw))
+            # Set new data
+            stb.putcol('CPARAM', dat.data)
+            # Set new flags
+            stb.putcol('FLAG', dat.mask)
+            stb.close()
 
-        tb.open(tablename, nomodify=False)
-        stb = tb.query('SPECTRAL_WINDOW_ID == {0}'.format(spw))
-        # Set new data
-        stb.putcol('CPARAM', dat.data)
-        # Set new flags
-        stb.putcol('FLAG', dat.mask)
-        stb.close()
+        tb.flush()
 
+    finally:
+        tb.unlock()
         tb.clearlocks()
         tb.close()
-
-    if test_output_nowrite:
-        return bp_pass_dict
@@ -0,0 +1,311 @@
+'''
+Read the SPW, field, scan and intent metadata of an MS without the CASA
+`ms`/`msmetadata` tools.
+
+The FIELD, STATE, SPECTRAL_WINDOW, DATA_DESCRIPTION and POLARIZATION subtables
+and the ID columns of the main table are read with `python-casacore` ('casacore'
+backend) or the CASA `table` tool ('casa' backend). Both give the same metadata
+dictionary. The query functions below mirror the `msmetadata` methods of the
+same name.
+'''
+
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+
+METADATA_BACKENDS = ['casacore', 'casa']
+
+# Subtable columns read for the metadata
+SUBTABLE_COLUMNS = {'FIELD': {'scalar': ['NAME'], 'array': ['PHASE_DIR']},
+                    'STATE': {'scalar': ['OBS_MODE'], 'array': []},
+                    'SPECTRAL_WINDOW': {'scalar': ['NAME', 'NUM_CHAN', 'TOTAL_BANDWIDTH',
+                                                   'REF_FREQUENCY'],
+                                        'array': ['CHAN_FREQ', 'CHAN_WIDTH']},
+                    'DATA_DESCRIPTION': {'scalar': ['SPECTRAL_WINDOW_ID', 'POLARIZATION_ID'],
+                                         'array': []},
+                    'POLARIZATION': {'scalar': ['NUM_CORR'], 'array': []}}
+
+MAIN_COLUMNS = ['FIELD_ID', 'SCAN_NUMBER', 'STATE_ID', 'DATA_DESC_ID']
+
+
+def default_metadata_backend():
+    '''
+    'casacore' when `python-casacore` is installed, otherwise 'casa'.
+    '''
+
+    try:
+        import casacore.tables
+        return 'casacore'
+    except ImportError:
+        return 'casa'
+
+
+def _open_table(tablename, backend):
+    '''
+    Open a table read-only. Both backends give `getcol`, `getcell`, `nrows` and `close`.
+    '''
+
+    if backend == 'casacore':
+        from casacore.tables import table
+
+        return table(tablename, readonly=True, ack=False)
+
+    if backend == 'casa':
+        from casatools import table
+
+        tb = table()
+        tb.open(tablename)
+        return tb
+
+    raise ValueError("backend must be one of {0}. Given {1}".format(METADATA_BACKENDS, backend))
+
+
+def read_subtable_columns(tablename, scalar_columns, array_columns=None, backend='casacore'):
+    '''
+    Read the columns of a (small) subtable.
+
+    Array columns are read per row as they can have a different shape in each row
+    (e.g. CHAN_FREQ for SPWs with different numbers of channels).
+    '''
+
+    if array_columns is None:
+        array_columns = []
+
+    tb = _open_table(tablename, backend)
+
+    try:
+        nrow = tb.nrows()
+
+        columns = {}
+        for colname in scalar_columns:
+            columns[colname] = np.asarray(tb.getcol(colname)) if nrow > 0 else np.array([])
+
+        for colname in array_columns:
+            columns[colname] = [np.asarray(tb.getcell(colname, row)) for row in range(nrow)]
+
+    finally:
+        tb.close()
+
+    return columns
+
+
+def read_main_id_combinations(myvis, backend='casacore', chunk_rows=1000000):
+    '''
+    Unique (FIELD_ID, SCAN_NUMBER, STATE_ID, DATA_DESC_ID) rows of the main table,
+    read in chunks of `chunk_rows`.
+    '''
+
+    tb = _open_table(myvis, backend)
+
+    try:
+        nrow = tb.nrows()
+
+        combos = []
+        for startrow in range(0, nrow, chunk_rows):
+            this_nrow = min(chunk_rows, nrow - startrow)
+
+            chunk = np.stack([np.asarray(tb.getcol(colname, startrow, this_nrow))
+                              for colname in MAIN_COLUMNS], axis=1)
+            combos.append(np.unique(chunk, axis=0))
+
+    finally:
+        tb.close()
+
+    if len(combos) == 0:
+        return np.zeros((0, len(MAIN_COLUMNS)), dtype=int)
+
+    return np.unique(np.concatenate(combos), axis=0)
+
+
+def read_ms_tables(myvis, backend=None, chunk_rows=1000000):
+    '''
+    Read the subtable columns and main table IDs used by `ms_metadata_from_tables`.
+    '''
+
+    if backend is None:
+        backend = default_metadata_backend()
+
+    tables = {}
+    for subtable in SUBTABLE_COLUMNS:
+        tables[subtable] = read_subtable_columns("{0}/{1}".format(myvis.rstrip("/"), subtable),
+                                                 SUBTABLE_COLUMNS[subtable]['scalar'],
+                                                 SUBTABLE_COLUMNS[subtable]['array'],
+                                                 backend=backend)
+
+    tables['MAIN'] = read_main_id_combinations(myvis, backend=backend, chunk_rows=chunk_rows)
+
+    return tables
+
+
+def ms_metadata_from_tables(tables):
+    '''
+    Build the metadata dictionary from the table columns.
+
+    Parameters
+    ----------
+    tables : dict
+        Columns for each subtable in `SUBTABLE_COLUMNS` and 'MAIN', the unique
+        (FIELD_ID, SCAN_NUMBER, STATE_ID, DATA_DESC_ID) rows of the main table.
+
+    Returns
+    -------
+    metadata : dict
+        'field_names', 'phase_dirs' (radians), 'state_intents' (the intents of
+        each state), 'spws' (name, nchan, chan_freqs, chan_widths, bandwidth and
+        ref_freq per SPW), 'ddid_spw', 'ddid_ncorr' and 'rows', the unique
+        (field, scan, state, SPW, DDID) combinations with data.
+    '''
+
+    field = tables['FIELD']
+    field_names = [str(name) for name in field['NAME']]
+    phase_dirs = [np.asarray(direction, dtype=float).ravel()[:2] for direction in field['PHASE_DIR']]
+
+    state_intents = [str(obs_mode).split(",") for obs_mode in tables['STATE']['OBS_MODE']]
+
+    spw = tables['SPECTRAL_WINDOW']
+    spws = []
+    for ii in range(len(spw['NAME'])):
+        spws.append({'name': str(spw['NAME'][ii]),
+                     'nchan': int(spw['NUM_CHAN'][ii]),
+                     'chan_freqs': np.asarray(spw['CHAN_FREQ'][ii], dtype=float).ravel(),
+                     'chan_widths': np.asarray(spw['CHAN_WIDTH'][ii], dtype=float).ravel(),
+                     'bandwidth': float(spw['TOTAL_BANDWIDTH'][ii]),
+                     'ref_freq': float(spw['REF_FREQUENCY'][ii])})
+
+    ddid_spw = np.asarray(tables['DATA_DESCRIPTION']['SPECTRAL_WINDOW_ID'], dtype=int)
+    ddid_pol = np.asarray(tables['DATA_DESCRIPTION']['POLARIZATION_ID'], dtype=int)
+    pol_ncorr = np.asarray(tables['POLARIZATION']['NUM_CORR'], dtype=int)
+
+    main = np.asarray(tables['MAIN'], dtype=int).reshape(-1, len(MAIN_COLUMNS))
+
+    rows = np.zeros(main.shape[0], dtype=[('field', int), ('scan', int), ('state', int),
+                                          ('spw', int), ('ddid', int)])
+    rows['field'] = main[:, 0]
+    rows['scan'] = main[:, 1]
+    rows['state'] = main[:, 2]
+    rows['ddid'] = main[:, 3]
+    rows['spw'] = ddid_spw[main[:, 3]]
+
+    return {'field_names': field_names,
+            'phase_dirs': phase_dirs,
+            'state_intents': state_intents,
+            'spws': spws,
+            'ddid_spw': ddid_spw,
+            'ddid_ncorr': pol_ncorr[ddid_pol] if ddid_pol.size > 0 else ddid_pol,
+            'rows': rows}
+
+
+def read_ms_metadata(myvis, backend=None, chunk_rows=1000000):
+    '''
+    Read the metadata of `myvis` with `python-casacore` or the CASA `table` tool.
+
+    Parameters
+    ----------
+    myvis : str
+        MS name.
+    backend : str, optional
+        'casacore' or 'casa'. Defaults to 'casacore' when it is installed.
+    chunk_rows : int, optional
+        Number of main table rows read at a time.
+
+    Returns
+    -------
+    metadata : dict
+        See `ms_metadata_from_tables`.
+    '''
+
+    return ms_metadata_from_tables(read_ms_tables(myvis, backend=backend,
+                                                  chunk_rows=chunk_rows))
+
+
+def _field_id(metadata, field):
+    if isinstance(field, str):
+        return fieldsforname(metadata, field)[0]
+    return int(field)
+
+
+def _rows_for_intent(metadata, intent):
+    states = [ii for ii, intents in enumerate(metadata['state_intents'])
+              if any([fnmatchcase(this_intent, intent) for this_intent in intents])]
+    return metadata['rows'][np.isin(metadata['rows']['state'], states)]
+
+
+def fieldnames(metadata):
+    return list(metadata['field_names'])
+
+
+def fieldsforname(metadata, name):
+    return [ii for ii, field_name in enumerate(metadata['field_names']) if field_name == name]
+
+
+def namesforfields(metadata, field_ids):
+    return [metadata['field_names'][field_id] for field_id in np.atleast_1d(field_ids)]
+
+
+def fieldsforintent(metadata, intent, asnames=False):
+    '''
+    Fields with data for states matching `intent` (e.g. "*TARGET*").
+    '''
+
+    field_ids = [int(field_id) for field_id in np.unique(_rows_for_intent(metadata, intent)['field'])]
+
+    if asnames:
+        return namesforfields(metadata, field_ids)
+
+    return field_ids
+
+
+def scansforintent(metadata, intent):
+    return [int(scan) for scan in np.unique(_rows_for_intent(metadata, intent)['scan'])]
+
+
+def scansforfield(metadata, field):
+    rows = metadata['rows']
+    return [int(scan) for scan in np.unique(rows['scan'][rows['field'] == _field_id(metadata, field)])]
+
+
+def fieldsforscan(metadata, scan):
+    rows = metadata['rows']
+    return [int(field_id) for field_id in np.unique(rows['field'][rows['scan'] == scan])]
+
+
+def spwsforfield(metadata, field):
+    rows = metadata['rows']
+    return [int(spw) for spw in np.unique(rows['spw'][rows['field'] == _field_id(metadata, field)])]
+
+
+def spwsforscan(metadata, scan):
+    rows = metadata['rows']
+    return [int(spw) for spw in np.unique(rows['spw'][rows['scan'] == scan])]
+
+
+def namesforspws(metadata, spw_ids):
+    return [metadata['spws'][spw]['name'] for spw in np.atleast_1d(spw_ids)]
+
+
+def nchan(metadata, spw):
+    return metadata['spws'][spw]['nchan']
+
+
+def chanfreqs(metadata, spw):
+    return metadata['spws'][spw]['chan_freqs']
+
+
+def chanwidths(metadata, spw):
+    return metadata['spws'][spw]['chan_widths']
+
+
+def bandwidths(metadata, spw):
+    return metadata['spws'][spw]['bandwidth']
+
+
+def phasecenter(metadata, field):
+    '''
+    Phase centre in radians in the `msmetadata.phasecenter` format (without the frame).
+    '''
+
+    ra, dec = metadata['phase_dirs'][_field_id(metadata, field)]
+
+    return {'m0': {'unit': 'rad', 'value': float(ra)},
+            'm1': {'unit': 'rad', 'value': float(dec)}}
@@ -8,6 +8,8 @@ An example format of spw_dict is shown in 20A-246_spw_setup.py.
 
 import os
 
+from lband_pipeline.casa_logging import casalog
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
 from lband_pipeline.spw_setup import create_spw_dict
 
 
@@ -126,6 +128,86 @@ def get_line_spws(spw_dict, include_rrls=False, return_string=True,
     return spw_list
 
 
+def _run_mstransform(mstransform_kwargs, ionice_level=None, start_delay=0.):
+    '''
+    Run `mstransform` in the current process. Used directly for serial splits and as the
+    worker for concurrent splits, where each worker process imports its own CASA tools.
+
+    Raises a RuntimeError when `mstransform` returns without creating the output MS,
+    as the CASA tasks can log an error and return instead of raising.
+
+    Parameters
+    ----------
+    mstransform_kwargs : dict
+        Keyword arguments passed to `mstransform`.
+    ionice_level : int, optional
+        Best-effort I/O priority (0 highest, 7 lowest) set with `ionice` for this process.
+    start_delay : float, optional
+        Seconds to wait before starting. Staggers concurrent reads of the same MS.
+    '''
+
+    import time
+    import subprocess
+
+    if start_delay > 0:
+        time.sleep(start_delay)
+
+    if ionice_level is not None:
+        try:
+            subprocess.run(["ionice", "-c", "2", "-n", str(int(ionice_level)),
+                            "-p", str(os.getpid())], check=True)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            casalog.post(message="Unable to set I/O priority with ionice: {}".format(exc),
+                         origin='split_ms', priority='WARN')
+
+    from casatasks import mstransform
+
+    mstransform(**mstransform_kwargs)
+
+    if not os.path.exists(mstransform_kwargs['outputvis']):
+        raise RuntimeError("mstransform did not create {}".format(mstransform_kwargs['outputvis']))
+
+    return mstransform_kwargs['outputvis']
+
+
+def _run_mstransform_job(job):
+    return _run_mstransform(*job)
+
+
+def _run_mstransform_jobs(split_jobs, concurrent=False, ionice_level=None,
+                          stagger_start=0.):
+    '''
+    Run a set of `mstransform` calls, either serially or at the same time in
+    separate processes. All splits are run when one fails, then a RuntimeError
+    naming the failed splits is raised.
+
+    Parameters
+    ----------
+    split_jobs : dict
+        `mstransform` keyword arguments keyed by a name for each split.
+    concurrent : bool, optional
+        Run all splits at once in spawned worker processes.
+    ionice_level : int, optional
+        Best-effort I/O priority (0-7) for the worker processes.
+    stagger_start : float, optional
+        Delay in seconds between starting each worker.
+    '''
+
+    split_names = list(split_jobs.keys())
+
+    if concurrent:
+        jobs = [(split_jobs[split_name], ionice_level, ii * stagger_start)
+                for ii, split_name in enumerate(split_names)]
+    else:
+        jobs = [(split_jobs[split_name], None, 0.) for split_name in split_names]
+
+    _, failures = run_process_pool(_run_mstransform_job, jobs,
+                                   nworkers=len(jobs) if concurrent else 1,
+                                   label="Split", job_names=split_names)
+
+    raise_job_failures(failures, label="Split")
+
+
 def split_ms(ms_name,
              outfolder_prefix=None,
              split_type='all',
@@ -134,7 +216,10 @@ def split_ms(ms_name,
                           "keep_backup_continuum": True},
              overwrite=False,
              reindex=False,
-             hanningsmooth_continuum=False):
+             hanningsmooth_continuum=False,
+             concurrent=False,
+             ionice_level=None,
+             stagger_start=0.):
     '''
     Split an MS into continuum and line SPWs.
 
@@ -165,9 +250,19 @@ def split_ms(ms_name,
         Apply Hanning smoothing to the continuum. Default is False.
         If enabled, do NOT use `hifv_hanning` in the pipeline!
 
-    '''
+    concurrent : bool, optional
+        Run the continuum and line splits at the same time in separate processes
+        when `split_type='all'`. Default is False.
 
-    from casatasks import mstransform
+    ionice_level : int, optional
+        Best-effort I/O priority (0-7) for the split processes. Only used when
+        `concurrent=True`. Default is None (no change).
+
+    stagger_start : float, optional
+        Delay in seconds before starting the line split when `concurrent=True`.
+        Default is 0.
+
+    '''
 
     folder_base, ms_name_base = os.path.split(ms_name)
 
@@ -193,6 +288,8 @@ def split_ms(ms_name,
     # Define the spw mapping dictionary
     spw_dict = create_spw_dict(ms_name)
 
+    split_jobs = {}
+
     if do_split_continuum:
 
         continuum_folder = os.path.join(folder_base, "{}_continuum".format(outfolder_prefix))
@@ -207,14 +304,14 @@ def split_ms(ms_name,
         continuum_spw_str = get_continuum_spws(spw_dict, return_string=True,
                                                **continuum_kwargs)
 
-        mstransform(vis=ms_name,
-                    outputvis="{0}/{1}.continuum.ms".format(continuum_folder,
-                                                            ms_name_base),
-                    spw=continuum_spw_str,
-                    datacolumn='DATA',
-                    hanning=hanningsmooth_continuum,
-                    field="",
-                    reindex=reindex)
+        split_jobs['continuum'] = dict(vis=ms_name,
+                                       outputvis="{0}/{1}.continuum.ms".format(continuum_folder,
+                                                                               ms_name_base),
+                                       spw=continuum_spw_str,
+                                       datacolumn='DATA',
+                                       hanning=hanningsmooth_continuum,
+                                       field="",
+                                       reindex=reindex)
 
     if do_split_lines:
 
@@ -230,75 +327,36 @@ def split_ms(ms_name,
         line_spw_str = get_line_spws(spw_dict, return_string=True,
                                      **line_kwargs)
 
-        mstransform(vis=ms_name,
-                    outputvis="{0}/{1}.speclines.ms".format(lines_folder,
-                                                            ms_name_base),
-                    spw=line_spw_str,
-                    datacolumn='DATA',
-                    field="",
-                    reindex=reindex)
-
-
-def split_ms_final(ms_name,
-                   spw_dict,
-                   data_column='CORRECTED',
-                   target_name_prefix="",
-                   line_intents='*TARGET*',
-                   continuum_intents='*TARGET*',
-                   time_bin='0s',
-                   keep_flags=False,
-                   keep_lines_only=True,
-                   overwrite=False,
-                   output_suffix="",
-                   output_path="."):
+        split_jobs['speclines'] = dict(vis=ms_name,
+                                       outputvis="{0}/{1}.speclines.ms".format(lines_folder,
+                                                                               ms_name_base),
+                                       spw=line_spw_str,
+                                       datacolumn='DATA',
+                                       field="",
+                                       reindex=reindex)
+
+    _run_mstransform_jobs(split_jobs, concurrent=concurrent,
+                          ionice_level=ionice_level,
+                          stagger_start=stagger_start)
+
+
+def _split_ms_final_job(ms_name,
+                        spw_dict,
+                        data_column='CORRECTED',
+                        target_name_prefix="",
+                        line_intents='*TARGET*',
+                        continuum_intents='*TARGET*',
+                        time_bin='0s',
+                        keep_flags=False,
+                        keep_lines_only=True,
+                        overwrite=False,
+                        output_suffix="",
+                        output_path="."):
     '''
-    Split a calibrated MS into a final version with target or required
-    calibrators (if continuum).
-
-
-    Parameters
-    ----------
-    ms_name : str
-        Name of MS.
-
-    data_column : str, optional
-        Column to keep in the split data. Default is "CORRECTED".
-
-    target_name_prefix : str, optional
-        Give string to match to target fields to split out.
-        Not normally needed if the split intent is TARGET.
-
-    line_intents : str, optional
-        Intents to keep in split for the spectral line data. Default is "*TARGET*".
-
-    continuum intents : str, optional
-        Intents to keep in split for the continuum data. Default is "*" (all).
-        NOTE: Eventually this may be changed to just the target fields, but we want
-        to keep the calibrators for now to test polarization calibration.
-
-    time_bin : str, optional
-        Time average the data to reduce the volume. Default is "0s" (no time averaging).
-
-    keep_flags : bool, optional
-        Keep or removed flag data in the split. Default is False.
-
-    keep_lines_only : bool, optional
-        For the spectral lines, split out only the spectral line SPWs. In 20A-346
-        tracks, this will remove all backup continuum SPWs. Default is True.
-
-    overwrite : bool, optional
-        Overwrite an existing MS with the same output name. Default is False.
-
-    output_path : str, optional
-        Output path. Default is "." (current working directory).
-
+    Build the `mstransform` arguments for `split_ms_final`. Returns None when the
+    output already exists and overwrite is disabled.
     '''
 
-    from casatasks import mstransform
-    from casatools import logsink
-
-    casalog = logsink()
-
     folder_base, ms_name_base = os.path.split(ms_name)
 
     if len(folder_base) == 0:
@@ -314,7 +372,7 @@ def split_ms_final(ms_name,
 
     if os.path.exists(output_ms_name):
         casalog.post(f"Found existing MS and overwrite=False. Skipping. Name: {output_ms_name}")
-        return
+        return None
 
     # We're classifying based on "continuum" or "speclines" in the name.
     if 'speclines' in ms_name_base:
@@ -331,7 +389,7 @@ def split_ms_final(ms_name,
         else:
             spw_select_str = ""
 
-        mstransform(vis=ms_name,
+        return dict(vis=ms_name,
                     outputvis="{0}/{1}".format(output_path,
                                                output_ms_name),
                     spw=spw_select_str,
@@ -347,7 +405,7 @@ def split_ms_final(ms_name,
         # For now, we're keeping the whole MS intact in case data issues/additional
         # flagging is needed.
 
-        mstransform(vis=ms_name,
+        return dict(vis=ms_name,
                     outputvis="{0}/{1}".format(output_path,
                                                output_ms_name),
                     spw="",
@@ -362,6 +420,80 @@ def split_ms_final(ms_name,
         raise ValueError(f"Cannot find 'continuum' or 'speclines' in name {ms_name_base}")
 
 
+def split_ms_final(ms_name,
+                   spw_dict,
+                   data_column='CORRECTED',
+                   target_name_prefix="",
+                   line_intents='*TARGET*',
+                   continuum_intents='*TARGET*',
+                   time_bin='0s',
+                   keep_flags=False,
+                   keep_lines_only=True,
+                   overwrite=False,
+                   output_suffix="",
+                   output_path="."):
+    '''
+    Split a calibrated MS into a final version with target or required
+    calibrators (if continuum).
+
+
+    Parameters
+    ----------
+    ms_name : str
+        Name of MS.
+
+    data_column : str, optional
+        Column to keep in the split data. Default is "CORRECTED".
+
+    target_name_prefix : str, optional
+        Give string to match to target fields to split out.
+        Not normally needed if the split intent is TARGET.
+
+    line_intents : str, optional
+        Intents to keep in split for the spectral line data. Default is "*TARGET*".
+
+    continuum intents : str, optional
+        Intents to keep in split for the continuum data. Default is "*" (all).
+        NOTE: Eventually this may be changed to just the target fields, but we want
+        to keep the calibrators for now to test polarization calibration.
+
+    time_bin : str, optional
+        Time average the data to reduce the volume. Default is "0s" (no time averaging).
+
+    keep_flags : bool, optional
+        Keep or removed flag data in the split. Default is False.
+
+    keep_lines_only : bool, optional
+        For the spectral lines, split out only the spectral line SPWs. In 20A-346
+        tracks, this will remove all backup continuum SPWs. Default is True.
+
+    overwrite : bool, optional
+        Overwrite an existing MS with the same output name. Default is False.
+
+    output_path : str, optional
+        Output path. Default is "." (current working directory).
+
+    '''
+
+    split_job = _split_ms_final_job(ms_name,
+                                    spw_dict,
+                                    data_column=data_column,
+                                    target_name_prefix=target_name_prefix,
+                                    line_intents=line_intents,
+                                    continuum_intents=continuum_intents,
+                                    time_bin=time_bin,
+                                    keep_flags=keep_flags,
+                                    keep_lines_only=keep_lines_only,
+                                    overwrite=overwrite,
+                                    output_suffix=output_suffix,
+                                    output_path=output_path)
+
+    if split_job is None:
+        return
+
+    _run_mstransform(split_job)
+
+
 def split_ms_final_all(ms_name,
                        spw_dict,
                        data_column='CORRECTED',
@@ -369,35 +501,56 @@ def split_ms_final_all(ms_name,
                        time_bin='0s',
                        keep_flags=False,
                        overwrite=False,
-                       output_path="."):
+                       output_path=".",
+                       concurrent=False,
+                       ionice_level=None):
     '''
     Wrapper to split out the target and calibrator data using `split_ms_final`.
+
+    This is not a single-pass splitter: the targets and the calibrators are split
+    by separate `mstransform` calls. The two intent selections cover different rows,
+    so each row of `data_column` is only read by one of the calls. The data read
+    for both splits is about one pass over the column, and the second call only
+    adds the metadata and subtable reads. `benchmarks/bench_split_ms_final.py`
+    compares the bytes read with a single `mstransform` over all intents.
+
+    With `concurrent=True`, the target and calibrator splits run at the same time
+    in separate processes. This reads the same data as the serial splits and only
+    reduces the wall-clock time when a single `mstransform` does not saturate the disk.
     '''
 
+    split_jobs = {}
+
     # Target
-    split_ms_final(ms_name,
-                   spw_dict,
-                   data_column=data_column,
-                   target_name_prefix=target_name_prefix,
-                   line_intents='*TARGET*',
-                   continuum_intents='*TARGET*',
-                   time_bin=time_bin,
-                   keep_flags=keep_flags,
-                   keep_lines_only=True,
-                   overwrite=overwrite,
-                   output_suffix="",
-                   output_path=output_path)
+    split_jobs['target'] = _split_ms_final_job(ms_name,
+                                               spw_dict,
+                                               data_column=data_column,
+                                               target_name_prefix=target_name_prefix,
+                                               line_intents='*TARGET*',
+                                               continuum_intents='*TARGET*',
+                                               time_bin=time_bin,
+                                               keep_flags=keep_flags,
+                                               keep_lines_only=True,
+                                               overwrite=overwrite,
+                                               output_suffix="",
+                                               output_path=output_path)
 
     # Calibrators
-    split_ms_final(ms_name,
-                   spw_dict,
-                   data_column=data_column,
-                   target_name_prefix=target_name_prefix,
-                   line_intents='*CALIBRATE*',
-                   continuum_intents='*CALIBRATE*',
-                   time_bin=time_bin,
-                   keep_flags=keep_flags,
-                   keep_lines_only=False,
-                   overwrite=overwrite,
-                   output_suffix="calibrators",
-                   output_path=output_path)
+    split_jobs['calibrators'] = _split_ms_final_job(ms_name,
+                                                    spw_dict,
+                                                    data_column=data_column,
+                                                    target_name_prefix=target_name_prefix,
+                                                    line_intents='*CALIBRATE*',
+                                                    continuum_intents='*CALIBRATE*',
+                                                    time_bin=time_bin,
+                                                    keep_flags=keep_flags,
+                                                    keep_lines_only=False,
+                                                    overwrite=overwrite,
+                                                    output_suffix="calibrators",
+                                                    output_path=output_path)
+
+    # Remove splits that already exist
+    split_jobs = {name: job for name, job in split_jobs.items() if job is not None}
+
+    _run_mstransform_jobs(split_jobs, concurrent=concurrent,
+                          ionice_level=ionice_level)
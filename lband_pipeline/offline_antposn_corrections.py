@@ -21,24 +21,22 @@ try:
 except ImportError:
     import pipeline.infrastructure.casa_tools as casa_tools
 
-LOG = infrastructure.get_logger(__name__)
+from lband_pipeline.antcorr_database import load_antcorr_database, antcorr_offsets
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
 
-def correct_ant_posns(vis_name, print_offsets=False,
-                      data_folder="VLA_antcorr_tables"):
-    """
-    Return antenna correction for the given measurement set.
+LOG = infrastructure.get_logger(__name__)
 
-    This function is identical to the VLA pipeline version except that we
-    read from pre-downloaded files instead of querying the VLA baseline
-    website. This is to allow for corrections when running on machines without
-    internet access (e.g., clusters where job nodes have limited access).
+def read_antpos_metadata(vis_name):
+    '''
+    Read the observation start time and the antenna to station mapping of an MS.
 
-    Use "https://github.com/LocalGroup-VLALegacy/AutoDataIngest/blob/master/autodataingest/download_vlaant_corrections.py"
-    to download the corrections files.
-    """
+    Returns
+    -------
+    metadata : dict
+        'obs_year', 'obs_time' (YYYYMMDD plus the fraction of the day) and
+        'ant_num_stas', the (antenna number, name, station) for each antenna.
+    '''
 
-    MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
-              'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
     #
     # get start date+time of observation
     #
@@ -46,15 +44,10 @@ def correct_ant_posns(vis_name, print_offsets=False,
         # observation = tb.open(vis_name+'/OBSERVATION')
         time_range = table.getcol('TIME_RANGE')
 
-    MJD_start_time = time_range[0][0] / 86400
     q1 = casa_tools.quanta.quantity(time_range[0][0], 's')
     date_time = casa_tools.quanta.time(q1, form='ymd')
     # date_time looks like: '2011/08/10/06:56:49'
     [obs_year, obs_month, obs_day, obs_time_string] = date_time[0].split('/')
-    if (int(obs_year) < 2010):
-        if (print_offsets):
-            LOG.warn('Does not work for VLA observations')
-        return [1, '', []]
     [obs_hour, obs_minute, obs_second] = obs_time_string.split(':')
     obs_time = 10000*int(obs_year) + 100*int(obs_month) + int(obs_day) + \
                int(obs_hour)/24.0 + int(obs_minute)/1440.0 + \
@@ -69,99 +62,33 @@ def correct_ant_posns(vis_name, print_offsets=False,
         ant_stations = table.getcol('STATION')
     ant_num_stas = []
     for ii in range(len(ant_names)):
-        ant_num_stas.append([int(ant_names[ii][2:]), ant_names[ii], ant_stations[ii], 0.0, 0.0, 0.0, False])
+        ant_num_stas.append([int(ant_names[ii][2:]), ant_names[ii], ant_stations[ii]])
 
-    correction_lines = []
-    current_year = datetime.datetime.now().year
-    # first, see if the internet connection is possible
-    try:
-        with open(data_folder + "/" + str(current_year) + ".txt", 'r') as f:
-            lines = f.read()
+    return {'vis': vis_name,
+            'obs_year': int(obs_year),
+            'obs_time': obs_time,
+            'ant_num_stas': ant_num_stas}
 
-    except FileNotFoundError as err:
 
-        # LOG.warn('Cannot find antenna position correction txt file {}'.format(err.reason))
-        LOG.warn('Cannot find antenna position correction txt file {}'.format(err))
+def antpos_offsets_from_metadata(metadata, antcorr_db, print_offsets=False):
+    '''
+    Antenna corrections for an MS from `read_antpos_metadata` and the corrections
+    from `load_antcorr_database`. Returns the same output as `correct_ant_posns`.
+    '''
 
-        return [2, '', []]
+    if (metadata['obs_year'] < 2010):
+        if (print_offsets):
+            LOG.warn('Does not work for VLA observations')
+        return [1, '', []]
 
-    for year in range(2010, current_year+1):
-        with open(data_folder + "/" + str(year) + ".txt", 'r') as f:
-            lines = f.read()
-
-        html_lines = lines.split('\n')
-
-        for correction_line in html_lines:
-            if len(correction_line) and correction_line[0] != '<' and correction_line[0] != ';':
-                for month in MONTHS:
-                    if month in correction_line:
-                        correction_lines.append(str(year)+' '+correction_line)
-                        break
-
-    corrections_list = []
-    for correction_line in correction_lines:
-        correction_line_fields = correction_line.split()
-        if (len(correction_line_fields) > 9):
-            [c_year, moved_date, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
-            s_moved = moved_date[:3]
-            i_month = 1
-            for month in MONTHS:
-                if (moved_date.find(month) >= 0):
-                    break
-                i_month = i_month + 1
-            moved_time = 10000 * int(c_year) + 100 * i_month + \
-                         int(moved_date[3:])
-        else:
-            [c_year, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
-            moved_date = '     '
-            moved_time = 0
-        s_obs = obs_date[:3]
-        i_month = 1
-        for month in MONTHS:
-            if (s_obs.find(month) >= 0):
-                break
-            i_month = i_month + 1
-        obs_time_2 = 10000 * int(c_year) + 100 * i_month + int(obs_date[3:])
-        s_put = put_date[:3]
-        i_month = 1
-        for month in MONTHS:
-            if (s_put.find(month) >= 0):
-                break
-            i_month = i_month + 1
-        put_time = 10000 * int(c_year) + 100 * i_month + int(put_date[3:])
-        [put_hr, put_min] = put_time_str.split(':')
-        put_time += (int(put_hr)/24.0 + int(put_min)/1440.0)
-        corrections_list.append([c_year, moved_date, moved_time, obs_date, obs_time_2, put_date, put_time, int(ant),
-                                 pad, float(Bx), float(By), float(Bz)])
-
-    for correction_list in corrections_list:
-        [c_year, moved_date, moved_time, obs_date, obs_time_2, put_date, put_time, ant, pad, Bx, By, Bz] = correction_list
-        ant_ind = -1
-        for ii in range(len(ant_num_stas)):
-            ant_num_sta = ant_num_stas[ii]
-            if (ant == ant_num_sta[0]):
-                ant_ind = ii
-                break
-        if ((ant_ind == -1) or (ant_num_sta[6])):
-            # the antenna in this correction isn't in the observation, or is done,
-            # so skip it
-            pass
-        ant_num_sta = ant_num_stas[ant_ind]
-        if (moved_time):
-            # the antenna moved
-            if (moved_time > obs_time):
-                # we are done considering this antenna
-                ant_num_sta[6] = True
-            else:
-                # otherwise, it moved, so the offsets should be reset
-                ant_num_sta[3] = 0.0
-                ant_num_sta[4] = 0.0
-                ant_num_sta[5] = 0.0
-        if ((put_time > obs_time) and (not ant_num_sta[6]) and (pad == ant_num_sta[2])):
-            # it's the right antenna/pad; add the offsets to those already accumulated
-            ant_num_sta[3] += Bx
-            ant_num_sta[4] += By
-            ant_num_sta[5] += Bz
+    ant_num_stas = [list(ant_num_sta) + [0.0, 0.0, 0.0, False]
+                    for ant_num_sta in metadata['ant_num_stas']]
+
+    all_offsets = antcorr_offsets(antcorr_db, metadata['ant_num_stas'],
+                                  metadata['obs_time'])
+
+    for ant_num_sta, offsets in zip(ant_num_stas, all_offsets):
+        ant_num_sta[3:6] = offsets
 
     ants = []
     parms = []
@@ -181,20 +108,47 @@ def correct_ant_posns(vis_name, print_offsets=False,
     return [0, ant_string, parms]
 
 
-def make_offline_antpos_table(vis_name, data_folder="VLA_antcorr_tables",
-                              skip_existing=False):
-    '''
-    Run `gencal` to create the baseline correction table using pre-downloaded
-    correction files instead of querying the website.
+def correct_ant_posns(vis_name, print_offsets=False,
+                      data_folder="VLA_antcorr_tables"):
+    """
+    Return antenna correction for the given measurement set.
 
-    Reproduces the expected table name made by `hifv_priorcals`
+    This function is identical to the VLA pipeline version except that we
+    read from pre-downloaded files instead of querying the VLA baseline
+    website. This is to allow for corrections when running on machines without
+    internet access (e.g., clusters where job nodes have limited access).
 
     Use "https://github.com/LocalGroup-VLALegacy/AutoDataIngest/blob/master/autodataingest/download_vlaant_corrections.py"
     to download the corrections files.
+    """
 
-    '''
+    metadata = read_antpos_metadata(vis_name)
 
-    from casatasks import gencal
+    if (metadata['obs_year'] < 2010):
+        return antpos_offsets_from_metadata(metadata, None, print_offsets=print_offsets)
+
+    current_year = datetime.datetime.now().year
+    try:
+        os.stat(data_folder + "/" + str(current_year) + ".txt")
+
+    except FileNotFoundError as err:
+
+        # LOG.warn('Cannot find antenna position correction txt file {}'.format(err.reason))
+        LOG.warn('Cannot find antenna position correction txt file {}'.format(err))
+
+        return [2, '', []]
+
+    # Parsed once per folder and re-read only when the files change.
+    antcorr_db = load_antcorr_database(data_folder, last_year=current_year)
+
+    return antpos_offsets_from_metadata(metadata, antcorr_db, print_offsets=print_offsets)
+
+
+def antpos_table_name(vis_name, skip_existing=False):
+    '''
+    Name of the antenna position table made by `hifv_priorcals`. Returns None when
+    the table exists and `skip_existing` is enabled.
+    '''
 
     # Search for an existing antpos file:
     priorcal_tbls = glob("{0}.hifv_priorcals.*".format(vis_name))
@@ -204,16 +158,9 @@ def make_offline_antpos_table(vis_name, data_folder="VLA_antcorr_tables",
         if 'ants' in tbl:
             if skip_existing:
                 LOG.info("Antenna offset table already exists. Skipping.")
-                return
+                return None
 
             antpos_tblname = tbl
-            os.system("rm -r {0}".format(tbl))
-
-    try:
-        antenna_offsets = correct_ant_posns(vis_name, data_folder=data_folder)
-    except FileNotFoundError:
-        LOG.warning("Unable to find downloaded antenna correction tables. Skipping.")
-        return
 
     # Come up with the right name for the pipeline when it doesn't already exist
     if antpos_tblname is None:
@@ -225,6 +172,38 @@ def make_offline_antpos_table(vis_name, data_folder="VLA_antcorr_tables",
 
         antpos_tblname = "{0}_{1}.ants.tbl".format(prefix, len(priorcal_tbls) + 2)
 
+    return antpos_tblname
+
+
+def make_offline_antpos_table(vis_name, data_folder="VLA_antcorr_tables",
+                              skip_existing=False):
+    '''
+    Run `gencal` to create the baseline correction table using pre-downloaded
+    correction files instead of querying the website.
+
+    Reproduces the expected table name made by `hifv_priorcals`
+
+    Use "https://github.com/LocalGroup-VLALegacy/AutoDataIngest/blob/master/autodataingest/download_vlaant_corrections.py"
+    to download the corrections files.
+
+    '''
+
+    from casatasks import gencal
+
+    antpos_tblname = antpos_table_name(vis_name, skip_existing=skip_existing)
+
+    if antpos_tblname is None:
+        return
+
+    if os.path.exists(antpos_tblname):
+        os.system("rm -r {0}".format(antpos_tblname))
+
+    try:
+        antenna_offsets = correct_ant_posns(vis_name, data_folder=data_folder)
+    except FileNotFoundError:
+        LOG.warning("Unable to find downloaded antenna correction tables. Skipping.")
+        return
+
     if (antenna_offsets[0] == 0):
         gencal(vis=vis_name,
                caltable=antpos_tblname,
@@ -234,3 +213,171 @@ def make_offline_antpos_table(vis_name, data_folder="VLA_antcorr_tables",
 
     else:
         LOG.info("No antenna offsets found for this MS")
+
+
+def _antpos_result(vis_name, status=None, table=None, antennas='', error=None):
+    '''
+    Per-MS result from `make_offline_antpos_tables`.
+    '''
+
+    return {'vis': vis_name, 'status': status, 'table': table,
+            'antennas': antennas, 'error': error}
+
+
+def _gencal_antpos(job):
+    '''
+    Make one antenna position table.
+    '''
+
+    from casatasks import gencal
+
+    # Replace the existing table only once there are offsets to write.
+    if os.path.exists(job['caltable']):
+        os.system("rm -r {0}".format(job['caltable']))
+
+    gencal(vis=job['vis'],
+           caltable=job['caltable'],
+           caltype='antpos',
+           antenna=job['antenna'],
+           parameter=job['parameter'])
+
+
+def run_gencal_antpos_jobs(jobs, nworkers=1):
+    '''
+    Run `gencal` for each antenna position table, serially or in a pool of worker
+    processes. Errors are kept in the per-MS results.
+    '''
+
+    _, failures = run_process_pool(_gencal_antpos, jobs, nworkers=nworkers,
+                                   label="gencal",
+                                   job_names=[job['vis'] for job in jobs])
+
+    return [_antpos_result(job['vis'],
+                           status='failed' if job['vis'] in failures else 'corrected',
+                           table=job['caltable'],
+                           antennas=job['antenna'],
+                           error=failures.get(job['vis']))
+            for job in jobs]
+
+
+def make_offline_antpos_tables(vis_names, data_folder="VLA_antcorr_tables",
+                               skip_existing=False, nworkers=1,
+                               report_file=None):
+    '''
+    Make the antenna position tables for many MSs with `make_offline_antpos_table`.
+
+    The correction files are parsed once and shared by all MSs. The OBSERVATION and
+    ANTENNA tables of every MS are read first, then the `gencal` calls are run in
+    `nworkers` processes.
+
+    Parameters
+    ----------
+    vis_names : list
+        MS names.
+    data_folder : str, optional
+        Folder with the pre-downloaded correction files.
+    skip_existing : bool, optional
+        Skip MSs that already have an antenna position table.
+    nworkers : int, optional
+        Number of processes for `gencal`.
+    report_file : str, optional
+        Write the summary report to this file.
+
+    Returns
+    -------
+    results : list
+        One dict per MS with the 'vis', 'status', 'table', 'antennas' and 'error'.
+        The status is one of 'corrected', 'no_offsets', 'pre-2010', 'skipped',
+        'no_correction_files' or 'failed'.
+
+    Raises
+    ------
+    RuntimeError
+        When any MS failed. All MSs are processed and the report is written first.
+    '''
+
+    current_year = datetime.datetime.now().year
+
+    try:
+        antcorr_db = load_antcorr_database(data_folder, last_year=current_year)
+    except FileNotFoundError as err:
+        LOG.warning("Unable to find downloaded antenna correction tables: {}".format(err))
+        antcorr_db = None
+
+    results = {}
+    jobs = []
+
+    for vis_name in vis_names:
+
+        result = _antpos_result(vis_name)
+        results[vis_name] = result
+
+        if antcorr_db is None:
+            result['status'] = 'no_correction_files'
+            continue
+
+        try:
+            antpos_tblname = antpos_table_name(vis_name, skip_existing=skip_existing)
+
+            if antpos_tblname is None:
+                result['status'] = 'skipped'
+                continue
+
+            metadata = read_antpos_metadata(vis_name)
+
+            antenna_offsets = antpos_offsets_from_metadata(metadata, antcorr_db)
+
+        except Exception as exc:
+            LOG.warning("Unable to find the antenna offsets for {0}: {1}".format(vis_name, exc))
+            result['status'] = 'failed'
+            result['error'] = exc
+            continue
+
+        if antenna_offsets[0] != 0:
+            result['status'] = 'pre-2010'
+            continue
+
+        # gencal would query the online corrections for an empty antenna list.
+        if len(antenna_offsets[1]) == 0:
+            result['status'] = 'no_offsets'
+            continue
+
+        jobs.append({'vis': vis_name,
+                     'caltable': antpos_tblname,
+                     'antenna': antenna_offsets[1],
+                     'parameter': antenna_offsets[2]})
+
+    for job_result in run_gencal_antpos_jobs(jobs, nworkers=nworkers):
+        results[job_result['vis']] = job_result
+
+    results = [results[vis_name] for vis_name in vis_names]
+
+    statuses = [result['status'] for result in results]
+    LOG.info("Antenna position tables: " +
+             ", ".join(["{0} {1}".format(statuses.count(status), status)
+                        for status in sorted(set(statuses))]))
+
+    if report_file is not None:
+        write_antpos_report(results, report_file)
+
+    raise_job_failures({result['vis']: result['error'] for result in results
+                        if result['status'] == 'failed'},
+                       label="Antenna position tables")
+
+    return results
+
+
+def write_antpos_report(results, filename):
+    '''
+    Write the per-MS results from `make_offline_antpos_tables` to a text file.
+    '''
+
+    with open(filename, 'w') as f:
+        f.write("# vis status nant antennas table\n")
+
+        for result in results:
+            antennas = result['antennas'] if len(result['antennas']) > 0 else "-"
+            nant = len(result['antennas'].split(",")) if len(result['antennas']) > 0 else 0
+
+            f.write("{0} {1} {2} {3} {4}\n".format(result['vis'], result['status'], nant,
+                                                   antennas, result['table'] or "-"))
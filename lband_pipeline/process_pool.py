@@ -0,0 +1,120 @@
+'''
+Run independent jobs serially or in a pool of spawned worker processes.
+
+All of the process pools in the pipeline use `run_process_pool`, with the same
+failure handling: every job is run even when others fail, each failure is logged,
+and `raise_job_failures` raises one RuntimeError naming the failed jobs once the
+caller has recorded the results.
+'''
+
+from lband_pipeline.casa_logging import casalog
+
+
+def run_process_pool(func, jobs, nworkers=1, label="Job", job_names=None,
+                     job_memory_gb=None, memory_limit_gb=None):
+    '''
+    Run `func(job)` for each job, serially or in a pool of worker processes.
+
+    The workers are started with 'spawn' so each job imports its own CASA tools.
+    Forking a process with the CASA tools loaded can deadlock.
+
+    Parameters
+    ----------
+    func : function
+        Module-level function taking one job. It is imported by the worker processes.
+    jobs : list
+        Job arguments. Must be picklable when `nworkers > 1`.
+    nworkers : int, optional
+        Maximum number of worker processes. Runs in the current process when 1
+        or when there is only one job.
+    label : str, optional
+        Describes the jobs in the log messages.
+    job_names : list, optional
+        Name of each job in the log messages and `failures`. Defaults to the job index.
+    job_memory_gb : list, optional
+        Memory estimate for each job. With `memory_limit_gb`, jobs are started in
+        order while the running jobs fit within the limit. A job larger than the
+        limit is run on its own.
+    memory_limit_gb : float, optional
+        Memory budget for the running jobs.
+
+    Returns
+    -------
+    results : list
+        Output of `func` for each job, in the order of `jobs`. None for failed jobs.
+    failures : dict
+        The exception for each failed job keyed by the job name, in the order of `jobs`.
+    '''
+
+    if job_names is None:
+        job_names = list(range(len(jobs)))
+
+    results = [None] * len(jobs)
+    errors = {}
+
+    def record_result(ii, get_result):
+        # Keep going when one job fails. The others are independent.
+        try:
+            results[ii] = get_result()
+        except Exception as exc:
+            casalog.post(message="{0} failed for {1}: {2}".format(label, job_names[ii], exc),
+                         origin='run_process_pool', priority='WARN')
+            errors[ii] = exc
+
+    if nworkers <= 1 or len(jobs) < 2:
+        for ii, job in enumerate(jobs):
+            record_result(ii, lambda: func(job))
+
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        casalog.post(message="Running {0} jobs for {1} with {2} workers"
+                     .format(len(jobs), label, nworkers),
+                     origin='run_process_pool')
+
+        mp_context = multiprocessing.get_context('spawn')
+
+        pending = list(range(len(jobs)))
+        running = {}
+
+        with ProcessPoolExecutor(max_workers=nworkers, mp_context=mp_context) as executor:
+
+            while len(pending) > 0 or len(running) > 0:
+
+                while len(pending) > 0 and len(running) < nworkers:
+
+                    if job_memory_gb is not None and memory_limit_gb is not None and \
+                            len(running) > 0:
+
+                        used_memory_gb = sum([job_memory_gb[ii] for ii in running.values()])
+
+                        if used_memory_gb + job_memory_gb[pending[0]] > memory_limit_gb:
+                            break
+
+                    ii = pending.pop(0)
+                    running[executor.submit(func, jobs[ii])] = ii
+
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    record_result(running.pop(future), future.result)
+
+    failures = {job_names[ii]: errors[ii] for ii in sorted(errors)}
+
+    return results, failures
+
+
+def raise_job_failures(failures, label="Job"):
+    '''
+    Raise one RuntimeError naming all failed jobs, chained from the first error.
+    Does nothing when `failures` is empty.
+    '''
+
+    if len(failures) == 0:
+        return
+
+    failed_names = list(failures.keys())
+
+    raise RuntimeError("{0} failed for: {1}. Errors: {2}"
+                       .format(label, failed_names, failures)) from failures[failed_names[0]]
@@ -3,9 +3,8 @@ import os
 from glob import glob
 import numpy as np
 
-from casatools import logsink
-
-casalog = logsink()
+from lband_pipeline.casa_logging import casalog
+from .qa_table_io import qa_table_formats, convert_txt_table
 
 CALTABLE_MAPPING = {'bandpass_amp': {'output_folder': 'final_caltable_txt',
                                 'search_string': '*.finalBPcal.tbl',
@@ -58,14 +57,19 @@ CALTABLE_MAPPING = {'bandpass_amp': {'output_folder': 'final_caltable_txt',
 
 
 def make_caltable_txt(ms_active, caltable_type,
-                      caltable_mapping=CALTABLE_MAPPING):
+                      caltable_mapping=CALTABLE_MAPPING, outtype='txt'):
     '''
     Output txt files using plotms to make plots of various calibration tables.
     See definitions in `CALTABLE_MAPPING`.
     The naming convention follows the VLA pipeline table names from `hifv_finalcals`
 
+    `outtype` can be a list of formats from `qa_table_io.QA_TABLE_FORMATS`. plotms
+    always writes the txt file, which is then converted to the other formats.
+
     '''
 
+    outtypes = qa_table_formats(outtype)
+
     caltable_values = caltable_mapping[caltable_type]
 
     # from taskinit import tb, casalog
@@ -131,6 +135,20 @@ def make_caltable_txt(ms_active, caltable_type,
         else:
             casalog.post("File {} already exists. Skipping".format(thisplotfile))
 
+        extra_outtypes = []
+        for this_outtype in outtypes:
+            if this_outtype == 'txt':
+                continue
+            if not os.path.exists("{0}.{1}".format(os.path.splitext(thisplotfile)[0], this_outtype)):
+                extra_outtypes.append(this_outtype)
+
+        if len(extra_outtypes) > 0:
+            convert_txt_table(thisplotfile, extra_outtypes,
+                              metadata={'caltable': caltable_name,
+                                        'caltable_type': caltable_type,
+                                        'axes': [caltable_values['x'], caltable_values['y']],
+                                        'iter': "{0}{1}".format(caltable_values['iter'], ii)})
+
 
 def make_all_caltable_txt(msname, caltable_mapping=CALTABLE_MAPPING):
 
@@ -3,24 +3,31 @@
 Summary plots from flagdata.
 '''
 
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-from casatools import logsink
+from lband_pipeline.casa_logging import casalog
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
+from .qa_table_io import write_qa_table_data, qa_table_formats
 
-casalog = logsink()
 
+# Number of FLAG values (rows x correlations x channels) read at once. 128 MB.
+_FLAG_CHUNK_ELEMENTS = 2**27
 
-def make_flagsummary_freq_plot(myvis, flag_dict=None, save_name=None):
+
+def make_flagsummary_freq_plot(myvis, flag_dict=None, save_name=None,
+                               chunk_elements=_FLAG_CHUNK_ELEMENTS):
     '''
     This mimics the summary plots made by flagdata, but removes the interactive
     part so we can save it.
+
+    Without a `flag_dict` from a `flagdata` summary with `spwchan=True`, the
+    per-channel flag fractions are summed directly from the FLAG column.
     '''
 
-    from casatools import ms
+    import matplotlib.pyplot as plt
 
-    from casatasks import flagdata
+    from casatools import ms
 
     myms = ms()
 
@@ -29,7 +36,8 @@ def make_flagsummary_freq_plot(myvis, flag_dict=None, save_name=None):
     mymsmd = myms.metadata()
 
     if flag_dict is None or 'spw:channel' not in flag_dict:
-        flag_dict = flagdata(vis=myvis, mode='summary', spwchan=True, action='calculate')
+        field_counts = channel_flag_counts(myvis, chunk_elements=chunk_elements)
+        spw_counts = sum_field_channel_counts(field_counts)
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
@@ -39,9 +47,10 @@ def make_flagsummary_freq_plot(myvis, flag_dict=None, save_name=None):
     for spw in spw_nums:
         spw_freqs = mymsmd.chanfreqs(spw) / 1e9  # GHz
 
-        spw_flagfracs = []
-        for chan in range(len(spw_freqs)):
-            spw_flagfracs.append(flag_dict['spw:channel'][f"{spw}:{chan}"]['flagged'] / flag_dict['spw:channel'][f'{spw}:{chan}']['total'])
+        if flag_dict is None or 'spw:channel' not in flag_dict:
+            spw_flagfracs = channel_flag_fractions(spw_counts.get(spw), len(spw_freqs))
+        else:
+            spw_flagfracs = flagdata_channel_fractions(flag_dict, spw, len(spw_freqs))
 
         # Plot it.
         plt.plot(spw_freqs, spw_flagfracs, drawstyle='steps-mid', label=f"SPW {spw}")
@@ -61,27 +70,48 @@ def make_flagsummary_freq_plot(myvis, flag_dict=None, save_name=None):
 
     plt.close()
 
-def make_all_flagsummary_data(myvis, output_folder='perfield_flagfraction'):
+def make_all_flagsummary_data(myvis, output_folder='perfield_flagfraction',
+                              outtype='txt', nworkers=1):
 
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
 
-    make_flagsummary_freq_data(myvis, output_folder=output_folder)
+    make_flagsummary_freq_data(myvis, output_folder=output_folder, outtype=outtype)
+
+    make_flagsummary_uvdist_data(myvis, output_folder=output_folder, outtype=outtype,
+                                 nworkers=nworkers)
 
-    make_flagsummary_uvdist_data(myvis, output_folder=output_folder)
+
+def _remove_existing(filenames):
+    for filename in filenames:
+        if os.path.isdir(filename):
+            os.system(f"rm -r {filename}")
+        elif os.path.exists(filename):
+            os.system(f"rm {filename}")
 
 
 def make_flagsummary_freq_data(myvis, output_folder='perfield_flagfraction',
-                               intent="*", overwrite=False):
+                               intent="*", overwrite=False, outtype='txt',
+                               method='flagcol', chunk_elements=_FLAG_CHUNK_ELEMENTS):
     '''
     This mimics the summary plots made by flagdata, but removes the interactive
     part so we can save it.
+
+    `outtype` can be one or a list of the formats in `qa_table_io.QA_TABLE_FORMATS`.
+
+    By default (`method='flagcol'`), the per-channel flag fractions for all fields
+    are summed from the FLAG column in one pass over the MS. `method='flagdata'`
+    uses a `flagdata` summary per field instead, and is kept to validate the
+    FLAG column counts.
     '''
 
     from casatools import ms
 
     from casatasks import flagdata
 
+    if method not in ['flagcol', 'flagdata']:
+        raise ValueError("method must be 'flagcol' or 'flagdata'. Given {}".format(method))
+
     myms = ms()
 
     myms.open(myvis)
@@ -100,42 +130,73 @@ def make_flagsummary_freq_data(myvis, output_folder='perfield_flagfraction',
     casalog.post(f"Selecting on fields: {fields}")
     print(f"Selecting on fields: {fields}")
 
-    for field in fields:
+    fields_to_run = {}
 
-        casalog.post(f"Creating freq. flagging fraction for {field}")
-        print(f"Creating freq. flagging fraction for {field}")
+    for field, field_id in zip(fields, fieldsnums):
 
-        save_name = f"{output_folder}/field_{field}_flagfrac_freq.txt"
+        save_basename = f"{output_folder}/field_{field}_flagfrac_freq"
+        save_names = [f"{save_basename}.{this_outtype}" for this_outtype in qa_table_formats(outtype)]
 
-        if os.path.exists(save_name) and overwrite:
-            os.system(f"rm {save_name}")
+        if overwrite:
+            _remove_existing(save_names)
 
-        if not os.path.exists(save_name):
+        if all([os.path.exists(save_name) for save_name in save_names]):
+            casalog.post(message="File {} already exists. Skipping".format(save_names[0]),
+                         origin='make_qa_tables')
+            continue
 
+        fields_to_run[field] = int(field_id)
+
+    # One pass over the FLAG column for all of the fields.
+    if method == 'flagcol' and len(fields_to_run) > 0:
+        field_counts = channel_flag_counts(myvis, field_ids=list(fields_to_run.values()),
+                                           chunk_elements=chunk_elements)
+
+    for field in fields_to_run:
+
+        casalog.post(f"Creating freq. flagging fraction for {field}")
+        print(f"Creating freq. flagging fraction for {field}")
+
+        save_basename = f"{output_folder}/field_{field}_flagfrac_freq"
+
+        if method == 'flagdata':
             flag_dict = flagdata(vis=myvis, mode='summary', spwchan=True, action='calculate',
-                                field=field)
+                                 field=field)
 
-            flag_data = []
+        flag_data = []
 
-            for spw in spw_nums:
-                spw_freqs = mymsmd.chanfreqs(spw) / 1e9  # GHz
+        for spw in spw_nums:
+            spw_freqs = mymsmd.chanfreqs(spw) / 1e9  # GHz
 
-                spw_flagfracs = []
-                for chan in range(len(spw_freqs)):
-                    spw_flagfracs.append(flag_dict['spw:channel'][f"{spw}:{chan}"]['flagged'] / flag_dict['spw:channel'][f'{spw}:{chan}']['total'])
+            if method == 'flagdata':
+                spw_flagfracs = flagdata_channel_fractions(flag_dict, spw, len(spw_freqs))
+            else:
+                spw_flagfracs = channel_flag_fractions(field_counts[fields_to_run[field]].get(spw),
+                                                       len(spw_freqs))
 
-                # Make an equal length SPW column
-                spw_labels = [spw] * len(spw_freqs)
+            # Make an equal length SPW column
+            spw_labels = [spw] * len(spw_freqs)
 
-                flag_data.append([spw_labels, np.arange(len(spw_freqs)), spw_freqs, spw_flagfracs])
+            flag_data.append([spw_labels, np.arange(len(spw_freqs)), spw_freqs, spw_flagfracs])
 
-            output_data = np.hstack(flag_data).T
+        output_data = np.hstack(flag_data).T
 
-            np.savetxt(save_name, output_data, header="spw,channel,freq,frac")
+        out_table = np.zeros(output_data.shape[0],
+                             dtype=[('spw', int),
+                                    ('channel', int),
+                                    ('freq', float),
+                                    ('frac', float)])
 
-        else:
-            casalog.post(message="File {} already exists. Skipping".format(save_name),
-                         origin='make_qa_tables')
+        out_table['spw'] = output_data[:, 0]
+        out_table['channel'] = output_data[:, 1]
+        out_table['freq'] = output_data[:, 2]
+        out_table['frac'] = output_data[:, 3]
+
+        write_qa_table_data(save_basename, out_table, outtype=outtype,
+                            metadata={'ms_name': myvis, 'field': str(field),
+                                      'freq_unit': 'GHz'},
+                            txt_kwargs={'fmt': '%.18e',
+                                        'header': "spw,channel,freq,frac"})
 
 
     mymsmd.close()
@@ -143,16 +204,219 @@ def make_flagsummary_freq_data(myvis, output_folder='perfield_flagfraction',
 
 
 
+def accumulate_channel_flags(counts, field_ids, flag, spw):
+    '''
+    Add the per-channel flagged and total counts for a chunk of rows from one SPW.
+
+    Parameters
+    ----------
+    counts : dict
+        Nested dictionary keyed by field ID then SPW with 'flagged' and 'total'
+        per-channel arrays. Updated in place.
+    field_ids : np.ndarray
+        FIELD_ID for the rows.
+    flag : np.ndarray
+        FLAG column with shape (ncorr, nchan, nrow).
+    spw : int
+        SPW of the rows.
+    '''
+
+    ncorr, nchan = flag.shape[:2]
+
+    field_ids = np.asarray(field_ids)
+
+    # Rows are in time order, so each field is usually one contiguous block and
+    # the slices below are views. Sort the rows (a copy of the chunk) only when
+    # the fields are interleaved.
+    block_starts = np.append(0, np.flatnonzero(np.diff(field_ids)) + 1)
+
+    if block_starts.size > np.unique(field_ids).size:
+        order = np.argsort(field_ids, kind='stable')
+        field_ids = field_ids[order]
+        flag = flag[:, :, order]
+        block_starts = np.append(0, np.flatnonzero(np.diff(field_ids)) + 1)
+
+    block_ends = np.append(block_starts[1:], field_ids.size)
+
+    for start, end in zip(block_starts, block_ends):
+
+        this_counts = counts.setdefault(int(field_ids[start]), {}).setdefault(int(spw),
+                                                                              {'flagged': np.zeros(nchan),
+                                                                               'total': np.zeros(nchan)})
+
+        # Summing a view with an integer dtype does not copy the FLAG values.
+        this_counts['flagged'] += flag[:, :, start:end].sum(axis=(0, 2), dtype=np.int64)
+        this_counts['total'] += ncorr * (end - start)
+
+    return counts
+
+
+def _ddid_chunk_rows(myvis, chunk_elements):
+    '''
+    SPW of each DATA_DESC_ID and the number of rows to read at once so that each
+    FLAG chunk holds about `chunk_elements` values.
+    '''
+
+    from casatools import table
+
+    tb = table()
+
+    tb.open(os.path.join(myvis, "DATA_DESCRIPTION"))
+    ddid_spw = tb.getcol("SPECTRAL_WINDOW_ID")
+    ddid_pol = tb.getcol("POLARIZATION_ID")
+    tb.close()
+
+    tb.open(os.path.join(myvis, "POLARIZATION"))
+    num_corr = tb.getcol("NUM_CORR")
+    tb.close()
+
+    tb.open(os.path.join(myvis, "SPECTRAL_WINDOW"))
+    num_chan = tb.getcol("NUM_CHAN")
+    tb.close()
+
+    chunk_rows = [max(1, int(chunk_elements // (num_corr[pol] * num_chan[spw])))
+                  for spw, pol in zip(ddid_spw, ddid_pol)]
+
+    return ddid_spw, chunk_rows
+
+
+def channel_flag_counts(myvis, field_ids=None, chunk_elements=_FLAG_CHUNK_ELEMENTS):
+    '''
+    Per-channel flagged and total counts for each field and SPW from the FLAG column.
+
+    All fields are counted in one pass over each DATA_DESC_ID. This is equivalent
+    to the 'spw:channel' output of a `flagdata` summary for each field.
+
+    Parameters
+    ----------
+    myvis : str
+        MS name.
+    field_ids : list, optional
+        Only count these fields. Defaults to all fields.
+    chunk_elements : int, optional
+        Number of FLAG values to read at once. The rows per chunk are set from
+        the number of correlations and channels of each SPW.
+
+    Returns
+    -------
+    field_counts : dict
+        Nested dictionary keyed by field ID then SPW with 'flagged' and 'total'
+        per-channel arrays.
+    '''
+
+    from casatools import table
+
+    ddid_spw, ddid_chunk_rows = _ddid_chunk_rows(myvis, chunk_elements)
+
+    tb = table()
+
+    if field_ids is None:
+        field_selection = ""
+    else:
+        field_selection = " && FIELD_ID IN [{}]".format(",".join([str(int(field_id))
+                                                                 for field_id in field_ids]))
+
+    field_counts = {}
+
+    tb.open(myvis)
+
+    try:
+        for ddid, spw in enumerate(ddid_spw):
+
+            chunk_rows = ddid_chunk_rows[ddid]
+
+            sub_tb = tb.query("DATA_DESC_ID == {0}{1}".format(ddid, field_selection),
+                              columns="FIELD_ID,FLAG")
+
+            try:
+                nrows = sub_tb.nrows()
+
+                for startrow in range(0, nrows, chunk_rows):
+                    nrow = min(chunk_rows, nrows - startrow)
+
+                    accumulate_channel_flags(field_counts,
+                                             sub_tb.getcol("FIELD_ID", startrow=startrow, nrow=nrow),
+                                             sub_tb.getcol("FLAG", startrow=startrow, nrow=nrow),
+                                             spw)
+            finally:
+                sub_tb.close()
+
+    finally:
+        tb.close()
+
+    return field_counts
+
+
+def sum_field_channel_counts(field_counts):
+    '''
+    Sum the per-channel counts from `channel_flag_counts` over the fields.
+    '''
+
+    spw_counts = {}
+
+    for this_field_counts in field_counts.values():
+        for spw, counts in this_field_counts.items():
+            if spw not in spw_counts:
+                spw_counts[spw] = {'flagged': counts['flagged'].copy(),
+                                   'total': counts['total'].copy()}
+            else:
+                spw_counts[spw]['flagged'] += counts['flagged']
+                spw_counts[spw]['total'] += counts['total']
+
+    return spw_counts
+
+
+def channel_flag_fractions(counts, nchan):
+    '''
+    Per-channel flag fraction from the 'flagged' and 'total' counts. Channels
+    without data, or an SPW with no counts, are NaN.
+    '''
+
+    if counts is None:
+        return np.full(nchan, np.nan)
+
+    fracs = np.full(nchan, np.nan)
+
+    has_data = counts['total'] > 0
+    fracs[has_data] = counts['flagged'][has_data] / counts['total'][has_data]
+
+    return fracs
+
+
+def flagdata_channel_fractions(flag_dict, spw, nchan):
+    '''
+    Per-channel flag fraction for one SPW from a `flagdata` summary with `spwchan=True`.
+    '''
+
+    chan_dict = flag_dict['spw:channel']
+
+    return np.array([chan_dict[f"{spw}:{chan}"]['flagged'] / chan_dict[f"{spw}:{chan}"]['total']
+                     for chan in range(nchan)])
+
+
 def make_flagsummary_uvdist_data(myvis, nbin=25, output_folder="perfield_flagfraction",
-                                 intent='*', overwrite=False):
+                                 intent='*', overwrite=False, outtype='txt',
+                                 method='flagcol', nworkers=1,
+                                 chunk_elements=_FLAG_CHUNK_ELEMENTS):
     '''
     Make a binned flagging fraction vs. uv-distance.
+
+    `outtype` can be one or a list of the formats in `qa_table_io.QA_TABLE_FORMATS`.
+
+    By default (`method='flagcol'`), the per-SPW and per-baseline flag counts are
+    summed from the FLAG column in one pass over each field. `method='flagdata'`
+    uses one `flagdata` summary per field and SPW instead, and is kept to validate
+    the FLAG column counts. With `nworkers > 1`, the fields are counted in parallel
+    worker processes.
     '''
 
     from casatools import ms
 
     from casatasks import flagdata
 
+    if method not in ['flagcol', 'flagdata']:
+        raise ValueError("method must be 'flagcol' or 'flagdata'. Given {}".format(method))
+
     myms = ms()
 
     myms.open(myvis)
@@ -170,98 +434,384 @@ def make_flagsummary_uvdist_data(myvis, nbin=25, output_folder="perfield_flagfra
 
     fields = np.array(mymsmd.fieldnames())[fieldsnums]
 
-    # Get SPWs
-    spw_list = mymsmd.spwsforfield(fieldsnums[0])
-
     casalog.post(f"Selecting on fields: {fields}")
     print(f"Selecting on fields: {fields}")
 
-    for field in fields:
+    fields_to_run = {}
+
+    for field, field_id in zip(fields, fieldsnums):
+
+        save_basename = f"{output_folder}/field_{field}_flagfrac_uvdist"
+        save_names = [f"{save_basename}.{this_outtype}" for this_outtype in qa_table_formats(outtype)]
+
+        if overwrite:
+            _remove_existing(save_names)
+
+        if all([os.path.exists(save_name) for save_name in save_names]):
+            casalog.post(message="File {} already exists. Skipping".format(save_names[0]),
+                         origin='make_flagsummary_uvdist_data')
+            continue
+
+        fields_to_run[field] = int(field_id)
+
+    # Get SPWs. These can differ between fields.
+    field_spws = {field: list(mymsmd.spwsforfield(field_id))
+                  for field, field_id in fields_to_run.items()}
+
+    if len(fields_to_run) == 0:
+        mymsmd.close()
+        myms.close()
+        return
+
+    # The uv geometry does not change with SPW. Read it and find the per-baseline
+    # uvdist once.
+    myms.selectinit()
+    myms.selectchannel(1, 0, 1, 1) # look at data just for first channel - easily translates
+    gantdata = myms.getdata(['antenna1','antenna2','uvdist']) # get the points I need
+
+    uvdist_modes = baseline_uvdist_modes(gantdata, len(antenna_names))
+
+    mymsmd.close()
+    myms.close()
+
+    if method == 'flagcol':
+        field_flag_counts = all_field_baseline_flag_counts(myvis, list(fields_to_run.values()),
+                                                           len(antenna_names),
+                                                           nworkers=nworkers,
+                                                           chunk_elements=chunk_elements)
+
+    for field in fields_to_run:
 
         casalog.post(f"Creating uvdist flagging fraction for {field}")
         print(f"Creating uvdist flagging fraction for {field}")
 
+        spw_list = field_spws[field]
+
+        if method == 'flagdata':
+            # Per SPW: the 'baseline' summary is summed over all selected SPWs.
+            datamatches = {}
+            for spw in spw_list:
+                flag_dict = flagdata(vis=myvis, mode='summary', basecnt=True, action='calculate',
+                                     field=field, spw=str(spw))
+
+                datamatches[spw] = match_flags_to_uvdist(flag_dict['baseline'], antenna_names,
+                                                         uvdist_modes)
+        else:
+            this_counts = field_flag_counts[fields_to_run[field]]
+
+            # SPWs without rows for this field have no counts.
+            spw_list = [spw for spw in spw_list if spw in this_counts]
+
+            datamatches = {spw: match_counts_to_uvdist(this_counts[spw], uvdist_modes)
+                           for spw in spw_list}
+
+        if len(spw_list) == 0:
+            casalog.post(message="No data for field {}. Skipping".format(field),
+                         origin='make_flagsummary_uvdist_data')
+            continue
+
         baseline_flagging_table = []
 
-        save_name = f"{output_folder}/field_{field}_flagfrac_uvdist.txt"
+        for spw in spw_list:
 
-        if os.path.exists(save_name) and overwrite:
-            os.system(f"rm {save_name}")
+            # 25 is the number of uvdist bins such that there is minimal error in uvdist.
+            binned_stats, barwidth = bin_statistics(datamatches[spw], nbin)
 
-        if not os.path.exists(save_name):
+            spw_vals = [spw] * len(binned_stats[0])
+            field_vals = [field] * len(binned_stats[0])
 
-            for spw in spw_list:
+            baseline_flagging_table.append([field_vals, spw_vals, binned_stats[0], binned_stats[1]])
 
-                flag_dict = flagdata(vis=myvis, mode='summary', basecnt=True, action='calculate',
-                                    field=field, spw=str(spw))
+        baseline_flagging_table_hstack = np.hstack(baseline_flagging_table).T
 
-                # Make plot of flagging statistics
+        out_table = np.zeros(baseline_flagging_table_hstack.shape[0],
+                            dtype=[("field", 'U32'),
+                                    ('spw', int),
+                                    ('uvdist', float),
+                                    ('frac', float)])
 
-                # Get information for flagging percentage vs. uvdistance
-                myms.selectinit()
-                myms.selectchannel(1, 0, 1, 1) # look at data just for first channel - easily translates
-                gantdata = myms.getdata(['antenna1','antenna2','uvdist']) # get the points I need
+        out_table['field'] = baseline_flagging_table_hstack[:, 0].astype('U32')
+        out_table['spw'] = baseline_flagging_table_hstack[:, 1].astype(int)
+        out_table['uvdist'] = baseline_flagging_table_hstack[:, 2].astype(float)
+        out_table['frac'] = baseline_flagging_table_hstack[:, 3].astype(float)
 
-                # create adictionary with flagging info
-                base_dict = create_baseline_dict(antenna_names, gantdata)
+        write_qa_table_data(f"{output_folder}/field_{field}_flagfrac_uvdist", out_table,
+                            outtype=outtype,
+                            metadata={'ms_name': myvis, 'field': str(field),
+                                      'uvdist_unit': 'm', 'nbin': nbin},
+                            txt_kwargs={'fmt': '%s %d %f %f',
+                                        'header': "field,spw,uvdist,frac"})
 
-                # match flagging data to dictionary entry
-                datamatch = flag_match_baseline(flag_dict['baseline'], base_dict)
 
-                # 25 is the number of uvdist bins such that there is minimal error in uvdist.
-                binned_stats, barwidth = bin_statistics(datamatch, nbin)
+def accumulate_baseline_flags(counts, ant1, ant2, flag, nant):
+    '''
+    Add the flagged and total visibility counts per baseline from a chunk of rows.
+
+    Parameters
+    ----------
+    counts : dict
+        Dictionary with 'flagged' and 'total' arrays indexed by `baseline_index`.
+        Updated in place.
+    ant1, ant2 : np.ndarray
+        ANTENNA1 and ANTENNA2 for the rows.
+    flag : np.ndarray
+        FLAG column with shape (ncorr, nchan, nrow).
+    nant : int
+        Number of antennas.
+    '''
 
-                spw_vals = [spw] * len(binned_stats[0])
-                field_vals = [field] * len(binned_stats[0])
+    bl_idx = baseline_index(ant1, ant2, nant)
 
-                baseline_flagging_table.append([field_vals, spw_vals, binned_stats[0], binned_stats[1]])
+    counts['flagged'] += np.bincount(bl_idx, weights=flag.sum(axis=(0, 1), dtype=np.int64),
+                                     minlength=nant * nant)
+    counts['total'] += np.bincount(bl_idx, minlength=nant * nant) * flag.shape[0] * flag.shape[1]
 
-            baseline_flagging_table_hstack = np.hstack(baseline_flagging_table).T
+    return counts
 
-            out_table = np.zeros(baseline_flagging_table_hstack.shape[0],
-                                dtype=[("field", 'U32'),
-                                        ('spw', int),
-                                        ('uvdist', float),
-                                        ('frac', float)])
 
-            out_table['field'] = baseline_flagging_table_hstack[:, 0].astype('U32')
-            out_table['spw'] = baseline_flagging_table_hstack[:, 1].astype(int)
-            out_table['uvdist'] = baseline_flagging_table_hstack[:, 2].astype(float)
-            out_table['frac'] = baseline_flagging_table_hstack[:, 3].astype(float)
+def field_baseline_flag_counts(myvis, field_id, nant, chunk_elements=_FLAG_CHUNK_ELEMENTS):
+    '''
+    Flagged and total counts per SPW and baseline for one field from the FLAG column.
 
-            np.savetxt(save_name, out_table, fmt='%s %d %f %f', header="field,spw,uvdist,frac")
+    This is equivalent to the 'baseline' output of a `flagdata` summary for each SPW,
+    in a single pass over the field.
 
+    Returns
+    -------
+    spw_counts : dict
+        Per-SPW dictionary of 'flagged' and 'total' arrays indexed by `baseline_index`.
+    '''
 
-    mymsmd.close()
-    myms.close()
+    from casatools import table
+
+    ddid_spw, ddid_chunk_rows = _ddid_chunk_rows(myvis, chunk_elements)
+
+    tb = table()
+
+    spw_counts = {}
+
+    tb.open(myvis)
+
+    try:
+        for ddid, spw in enumerate(ddid_spw):
+
+            chunk_rows = ddid_chunk_rows[ddid]
+
+            sub_tb = tb.query("FIELD_ID == {0} && DATA_DESC_ID == {1}".format(field_id, ddid),
+                              columns="ANTENNA1,ANTENNA2,FLAG")
+
+            try:
+                nrows = sub_tb.nrows()
+
+                if nrows == 0:
+                    continue
+
+                counts = spw_counts.setdefault(int(spw),
+                                               {'flagged': np.zeros(nant * nant),
+                                                'total': np.zeros(nant * nant)})
+
+                for startrow in range(0, nrows, chunk_rows):
+                    nrow = min(chunk_rows, nrows - startrow)
+
+                    accumulate_baseline_flags(counts,
+                                              sub_tb.getcol("ANTENNA1", startrow=startrow, nrow=nrow),
+                                              sub_tb.getcol("ANTENNA2", startrow=startrow, nrow=nrow),
+                                              sub_tb.getcol("FLAG", startrow=startrow, nrow=nrow),
+                                              nant)
+            finally:
+                sub_tb.close()
+
+    finally:
+        tb.close()
 
+    return spw_counts
+
+
+def _field_baseline_flag_counts_job(args):
+    return field_baseline_flag_counts(*args)
+
+
+def all_field_baseline_flag_counts(myvis, field_ids, nant, nworkers=1,
+                                   chunk_elements=_FLAG_CHUNK_ELEMENTS):
+    '''
+    Run `field_baseline_flag_counts` for each field, optionally in parallel worker
+    processes.
+
+    Returns
+    -------
+    field_counts : dict
+        The per-SPW counts keyed by field ID.
+    '''
+
+    jobs = [(myvis, field_id, nant, chunk_elements) for field_id in field_ids]
+
+    field_counts, failures = run_process_pool(_field_baseline_flag_counts_job, jobs,
+                                              nworkers=nworkers,
+                                              label="Counting baseline flags",
+                                              job_names=list(field_ids))
+
+    raise_job_failures(failures, label="Counting baseline flags")
+
+    return dict(zip(field_ids, field_counts))
 
 
 ##########################
 # Code adapted from CHILES
 
+def baseline_index(ant1, ant2, nant):
+    '''
+    Encode antenna pairs as a single integer index `ant1 * nant + ant2`.
+    '''
+
+    return np.asarray(ant1, dtype=np.int64) * nant + np.asarray(ant2, dtype=np.int64)
+
+
 def create_baseline_dict(antenna_names, antdata):
     '''create a dictionary to hold all UVdists for antenna pairs and correlate them to station IDs'''
 
+    nant = len(antenna_names)
+
+    bl_idx = baseline_index(antdata['antenna1'], antdata['antenna2'], nant)
+
+    # Stable sort keeps the row order within each baseline.
+    order = np.argsort(bl_idx, kind='stable')
+    uniq_idx, split_idx = np.unique(bl_idx[order], return_index=True)
+    uvdist_groups = np.split(np.asarray(antdata['uvdist'])[order], split_idx[1:])
+
     ##Create dictionary
     baseline_pairs = {}
-    i = 0
-    while i <= antdata['antenna1'].max(): #create a dictionary antenna for each antenna pair
-        j = i + 1
-        while j <= antdata['antenna2'].max():
-            temp_dict_key = str(antenna_names[i]) + '&&' + str(antenna_names[j])
-            baseline_pairs[temp_dict_key] = []
-            j += 1
-        i += 1
+    for i in range(antdata['antenna1'].max() + 1):
+        for j in range(i + 1, antdata['antenna2'].max() + 1):
+            baseline_pairs[str(antenna_names[i]) + '&&' + str(antenna_names[j])] = []
+
     #add distances to dictionary
-    i = 0
-    while i < len(antdata['antenna1']):
-        temp_dict_key = str(antenna_names[antdata['antenna1'][i]]) + '&&' + str(antenna_names[antdata['antenna2'][i]])
-        baseline_pairs[temp_dict_key].append(antdata['uvdist'][i])
-        i += 1
+    for this_idx, uvdists in zip(uniq_idx, uvdist_groups):
+        temp_dict_key = str(antenna_names[this_idx // nant]) + '&&' + str(antenna_names[this_idx % nant])
+        baseline_pairs[temp_dict_key] = list(uvdists)
 
     return baseline_pairs
 
+
+def baseline_uvdist_modes(antdata, nant, nbins=20):
+    '''
+    Find the mode of the uvdist distribution for every baseline at once.
+
+    This is the grouped equivalent of calling `uvdist_max` on every list from
+    `create_baseline_dict`, and follows the equal-width binning in `np.histogram`
+    so the modes are identical.
+
+    Parameters
+    ----------
+    antdata : dict
+        'antenna1', 'antenna2' and 'uvdist' arrays from `ms.getdata`.
+    nant : int
+        Number of antennas.
+    nbins : int, optional
+        Number of histogram bins.
+
+    Returns
+    -------
+    uvdist_modes : np.ndarray
+        Centre of the most populated histogram bin, indexed by `baseline_index`.
+        Baselines without data follow `np.histogram` for an empty array and are
+        the centre of the first bin in [0, 1].
+    '''
+
+    uvdist = np.asarray(antdata['uvdist'], dtype=float)
+
+    bl_idx = baseline_index(antdata['antenna1'], antdata['antenna2'], nant)
+
+    nbl = nant * nant
+
+    counts = np.bincount(bl_idx, minlength=nbl)
+    has_data = counts > 0
+
+    # Outer edges per baseline, as in np.histogram.
+    first_edge = np.zeros(nbl)
+    last_edge = np.ones(nbl)
+
+    first_edge[has_data] = np.inf
+    last_edge[has_data] = -np.inf
+    np.minimum.at(first_edge, bl_idx, uvdist)
+    np.maximum.at(last_edge, bl_idx, uvdist)
+
+    same_edge = first_edge == last_edge
+    first_edge[same_edge] -= 0.5
+    last_edge[same_edge] += 0.5
+
+    bin_edges = np.linspace(first_edge, last_edge, nbins + 1, axis=-1)
+
+    row_first = first_edge[bl_idx]
+
+    indices = ((uvdist - row_first) / (last_edge[bl_idx] - row_first) * nbins).astype(np.intp)
+    indices[indices == nbins] -= 1
+
+    # Correct the indices within ~1 ULP of the edges.
+    flat_edges = bin_edges.ravel()
+    row_offset = bl_idx * (nbins + 1)
+
+    decrement = uvdist < flat_edges[row_offset + indices]
+    indices[decrement] -= 1
+    increment = (uvdist >= flat_edges[row_offset + indices + 1]) & (indices != nbins - 1)
+    indices[increment] += 1
+
+    hist = np.bincount(bl_idx * nbins + indices, minlength=nbl * nbins).reshape(nbl, nbins)
+
+    max_index = hist.argmax(axis=1)
+
+    all_bl = np.arange(nbl)
+
+    return (bin_edges[all_bl, max_index] + bin_edges[all_bl, max_index + 1]) / 2.
+
+
+def match_flags_to_uvdist(flgdata, antenna_names, uvdist_modes):
+    '''
+    Vectorized `flag_match_baseline` using the output of `baseline_uvdist_modes`.
+
+    Returns
+    -------
+    uvdists : np.ndarray
+        The uvdist mode for each baseline in `flgdata`.
+    flag_counts : np.ndarray
+        The flagged and total counts for each baseline, with shape (nbaseline, 2).
+    '''
+
+    nant = len(antenna_names)
+
+    ant_lookup = {str(name): idx for idx, name in enumerate(antenna_names)}
+
+    dictkeys = list(flgdata.keys())
+
+    ant1 = [ant_lookup[key.split("&&")[0]] for key in dictkeys]
+    ant2 = [ant_lookup[key.split("&&")[1]] for key in dictkeys]
+
+    uvdists = uvdist_modes[baseline_index(ant1, ant2, nant)]
+
+    flag_counts = np.array([[flgdata[key]['flagged'], flgdata[key]['total']]
+                            for key in dictkeys], dtype=float).reshape(-1, 2)
+
+    return uvdists, flag_counts
+
+
+def match_counts_to_uvdist(counts, uvdist_modes):
+    '''
+    Equivalent of `match_flags_to_uvdist` for the counts from `field_baseline_flag_counts`.
+
+    Only cross-correlation baselines with data are kept, as in the `flagdata`
+    baseline summary.
+    '''
+
+    nant = int(np.sqrt(uvdist_modes.size))
+
+    ant1, ant2 = np.divmod(np.arange(nant * nant), nant)
+
+    bl_idx = np.where((counts['total'] > 0) & (ant1 != ant2))[0]
+
+    flag_counts = np.vstack([counts['flagged'][bl_idx], counts['total'][bl_idx]]).T
+
+    return uvdist_modes[bl_idx], flag_counts
+
+
 def flag_match_baseline(flgdata, baselines):
     '''match the CASA flagging data to the baseline dictionaries and return flagging statitistics'''
 
@@ -286,30 +836,45 @@ def uvdist_max(flg_data):
 
 
 def bin_statistics(dpoints, nbins):
-    '''bin the data based on a desired width'''
+    '''
+    bin the data based on a desired width
+
+    Bins are closed on both sides, so points that fall on an inner edge count
+    towards both neighbouring bins.
+    '''
+
+    uvdists = np.asarray(dpoints[0], dtype=float)
+    flag_counts = np.asarray(dpoints[1], dtype=float).reshape(-1, 2)
 
-    binned = [[],[]]
-    i = 0
     width = int(1.05 * max(dpoints[0]) / nbins)
 
-    flg_tracker, tot_tracker = 0, 0
-    while i < nbins: #loop through number of bins
-        j = 0
-        temp_flg, temp_total = 0., 0. #to be filled with flagging stats
-        while j < len(dpoints[0]): #loop through data points
-            if dpoints[0][j] >= (i*width) and dpoints[0][j] <= ((i+1)*width):
-                temp_flg += dpoints[1][j][0]
-                temp_total += dpoints[1][j][1]
-                flg_tracker += dpoints[1][j][0]
-                tot_tracker += dpoints[1][j][1]
-            j += 1
-        binned[0].append(i*width)
-        if temp_total == 0:
-            binned[1].append(0)
-        else:
-            binned[1].append(temp_flg/temp_total)
-        i += 1
+    bin_starts = np.arange(nbins) * width
+
+    if width == 0:
+        # All the bins are [0, 0].
+        in_bin = uvdists == 0
+        temp_flg = np.full(nbins, flag_counts[in_bin, 0].sum())
+        temp_total = np.full(nbins, flag_counts[in_bin, 1].sum())
+
+    else:
+        edges = np.arange(nbins + 1) * width
+
+        # Index of the bin with edges[i] <= x < edges[i + 1]
+        indices = np.digitize(uvdists, edges) - 1
+
+        # Points on an edge are also in the previous bin.
+        on_edge = (indices >= 1) & (indices <= nbins) & (uvdists == edges[np.clip(indices, 0, nbins)])
+
+        all_indices = np.concatenate([indices, indices[on_edge] - 1])
+        all_counts = np.concatenate([flag_counts, flag_counts[on_edge]])
+
+        keep = (all_indices >= 0) & (all_indices < nbins)
+
+        temp_flg = np.bincount(all_indices[keep], weights=all_counts[keep, 0], minlength=nbins)
+        temp_total = np.bincount(all_indices[keep], weights=all_counts[keep, 1], minlength=nbins)
 
-    # total = (flg_tracker / tot_tracker) * 100.
+    fracs = np.zeros(nbins)
+    nonzero = temp_total != 0
+    fracs[nonzero] = temp_flg[nonzero] / temp_total[nonzero]
 
-    return np.array(binned), width
\ No newline at end of file
+    return np.array([bin_starts, fracs]), width
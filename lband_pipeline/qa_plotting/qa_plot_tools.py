@@ -9,9 +9,7 @@ Routines for creating additional QA plots.
 import os
 import numpy as np
 
-from casatools import logsink
-
-casalog = logsink()
+from lband_pipeline.casa_logging import casalog
 
 
 def make_qa_scan_figures(ms_name, output_folder='scan_plots',
@@ -327,12 +325,21 @@ def remove_minsize(filename, min_size=50):
 
 def make_qa_tables(ms_name, output_folder='scan_plots_txt',
                    outtype='txt', overwrite=True,
-                   chanavg=4096,):
+                   chanavg=4096,
+                   use_plotms=False,
+                   chunk_elements=2**25):
 
     '''
     Specifically for saving txt tables. Replace the scan loop in
     `make_qa_scan_figures` to make fewer but larger tables.
 
+    By default, the tables are computed in one pass over the MS with
+    `qa_table_export.export_qa_tables`, which does not need a display.
+    Set `use_plotms=True` to export each table with `plotms` instead.
+
+    `outtype` can be one or a list of the formats in `qa_table_io.QA_TABLE_FORMATS`
+    (e.g., ['txt', 'parquet']). The `plotms` export only supports 'txt'.
+
     '''
 
 
@@ -342,8 +349,6 @@ def make_qa_tables(ms_name, output_folder='scan_plots_txt',
     tb = table()
     msmd = msmetadata()
 
-    from casaplotms import plotms
-
     casalog.post("Running make_qa_tables to export txt files for QA.")
     print("Running make_qa_tables to export txt files for QA.")
 
@@ -409,6 +414,74 @@ def make_qa_tables(ms_name, output_folder='scan_plots_txt',
     print("Fields are: {}".format(names))
     print("Calibrator fields are: {}".format(names[is_calibrator]))
 
+    if use_plotms:
+        if outtype != 'txt':
+            raise ValueError("The plotms export only supports outtype='txt'.")
+
+        _make_qa_tables_plotms(ms_name, names, has_data, is_calibrator, scanlist_dict,
+                               output_folder=output_folder, outtype=outtype,
+                               chanavg=chanavg)
+        return
+
+    from .qa_table_export import QA_TABLE_PRODUCTS, qa_table_filename, export_qa_tables
+    from .qa_table_io import qa_table_formats
+
+    # Tables still to be made for each field and scan.
+    scans_to_write = {}
+
+    for ii in range(numFields):
+
+        # If field has data, continue. If not skip and log it.
+        if not has_data[ii]:
+            casalog.post(message='Field {} has no data in the table. Skipping.'.format(names[ii]),
+                         origin='make_qa_tables')
+            continue
+
+        for this_scan in scanlist_dict[names[ii]]:
+
+            products = []
+
+            for product in QA_TABLE_PRODUCTS:
+
+                # Phase and other products are only made for calibrators.
+                if QA_TABLE_PRODUCTS[product][3] and not is_calibrator[ii]:
+                    continue
+
+                this_filenames = [qa_table_filename(output_folder, names[ii], product, this_scan,
+                                                    outtype=this_outtype)
+                                  for this_outtype in qa_table_formats(outtype)]
+
+                # Remove existing file if it exists and is very small
+                # indicating a failed export
+                for this_filename in this_filenames:
+                    remove_minsize(this_filename, min_size=50)
+
+                if all([os.path.exists(this_filename) for this_filename in this_filenames]):
+                    casalog.post(message="File {} already exists. Skipping".format(this_filenames[0]),
+                                 origin='make_qa_tables')
+                    continue
+
+                products.append(product)
+
+            if len(products) > 0:
+                scans_to_write[(ii, this_scan)] = products
+
+    export_qa_tables(ms_name, names, is_calibrator, scans_to_write,
+                     output_folder=output_folder, outtype=outtype,
+                     chanavg=chanavg, chunk_elements=chunk_elements)
+
+
+def _make_qa_tables_plotms(ms_name, names, has_data, is_calibrator, scanlist_dict,
+                           output_folder='scan_plots_txt', outtype='txt',
+                           chanavg=4096):
+    '''
+    Export the QA tables for each field and scan with `plotms`. Requires a display.
+    '''
+
+    from casaplotms import plotms
+
+    numFields = len(names)
+
     # Loop through fields. Make separate tables only for different targets.
 
     for ii in range(numFields):
@@ -0,0 +1,521 @@
+'''
+Export the per-scan QA tables from one pass over the MS with NumPy reductions.
+
+Replaces the per-scan `plotms` text exports in `make_qa_tables`. The output files
+have the same names and columns as the `plotms` text exports.
+
+'''
+
+import os
+import numpy as np
+
+from lband_pipeline.casa_logging import casalog
+from .qa_table_io import write_qa_table_data, qa_table_formats
+
+
+# m/s
+_SPEED_OF_LIGHT = 299792458.
+
+# Number of visibilities (rows x correlations x channels) read at once. About 256 MB
+# per complex64 column.
+_QA_CHUNK_ELEMENTS = 2**25
+
+# Columns of the plotms text exports.
+QA_TABLE_COLUMNS = ['x', 'y', 'chan', 'scan', 'field', 'ant1', 'ant2', 'ant1name',
+                    'ant2name', 'time', 'freq', 'spw', 'corr', 'obs']
+
+QA_TABLE_FMT = ['%.10g', '%.10g', '%d', '%d', '%d', '%d', '%d', '%s', '%s', '%.10g',
+                '%.10g', '%d', '%s', '%d']
+
+# Product name: (x axis, y axis, averaging, calibrators only)
+# 'time': channel (bins of chanavg) and baseline averaged.
+# 'chan': time and baseline averaged.
+# 'baseline': channel (bins of chanavg) and time averaged per baseline.
+QA_TABLE_PRODUCTS = {'amp_time': ('time', 'amp', 'time', False),
+                     'amp_chan': ('chan', 'amp', 'chan', False),
+                     'amp_uvdist': ('uvdist', 'amp', 'baseline', False),
+                     'phase_time': ('time', 'phase', 'time', True),
+                     'phase_chan': ('chan', 'phase', 'chan', True),
+                     'phase_uvdist': ('uvdist', 'phase', 'baseline', True),
+                     'amp_phase': ('amp', 'phase', 'baseline', True),
+                     'ampresid_uvwave': ('uvwave', 'ampresid', 'baseline', True),
+                     'amp_ant1': ('antenna1', 'amp', 'baseline', True),
+                     'phase_ant1': ('antenna1', 'phase', 'baseline', True)}
+
+# Measures Stokes enum used in the POLARIZATION table.
+_CORR_NAMES = {1: 'I', 2: 'Q', 3: 'U', 4: 'V', 5: 'RR', 6: 'RL', 7: 'LR', 8: 'LL',
+               9: 'XX', 10: 'XY', 11: 'YX', 12: 'YY'}
+
+
+def qa_table_filename(output_folder, field_name, product, scan, outtype='txt'):
+    '''
+    Name of a per-scan QA table. Matches the `plotms` exports from `make_qa_tables`.
+    '''
+    return os.path.join(output_folder,
+                        'field_{0}_{1}.scan_{2}.{3}'.format(field_name, product, scan, outtype))
+
+
+def _group_sum(values, group_idx, ngroups):
+    '''
+    Sum `values` over the last (row) axis within each group.
+    '''
+
+    # Rows are usually already in scan and time order. Only sort (a copy of
+    # `values`) when they are not.
+    if np.any(np.diff(group_idx) < 0):
+        order = np.argsort(group_idx, kind='stable')
+        values = values[..., order]
+        group_idx = group_idx[order]
+
+    starts = np.searchsorted(group_idx, np.arange(ngroups))
+
+    return np.add.reduceat(values, starts, axis=-1)
+
+
+def _bin_channels(values, chanavg):
+    '''
+    Sum `values` with shape (ncorr, nchan, nrow) in bins of `chanavg` channels.
+    '''
+
+    return np.add.reduceat(values, np.arange(0, values.shape[1], chanavg), axis=1)
+
+
+def _add_to(acc, key, sums):
+    '''
+    Add a dictionary of summed arrays to the accumulator entry for `key`.
+    '''
+
+    if key not in acc:
+        acc[key] = {name: val.copy() for name, val in sums.items()}
+        return
+
+    for name, val in sums.items():
+        acc[key][name] += val
+
+
+def new_qa_accumulator():
+    '''
+    Empty accumulator for `accumulate_qa_chunk`.
+    '''
+    return {'time': {}, 'chan': {}, 'baseline': {}}
+
+
+def accumulate_qa_chunk(acc, chunk, chanavg=4096, baseline_products=True):
+    '''
+    Add the weighted visibility sums for a chunk of rows from a single SPW.
+
+    Averages are vector (complex) averages weighted by WEIGHT, excluding flagged
+    data, as in `plotms`.
+
+    Parameters
+    ----------
+    acc : dict
+        From `new_qa_accumulator`. Updated in place.
+    chunk : dict
+        Rows from one field and SPW with keys 'data' (ncorr, nchan, nrow),
+        'flag' (ncorr, nchan, nrow), 'weight' (ncorr, nrow), 'time', 'scan',
+        'antenna1', 'antenna2', 'uvw' (3, nrow), 'field', 'spw', and optionally
+        'model' (ncorr, nchan, nrow).
+    chanavg : int, optional
+        Number of channels to average for the time and baseline products.
+    baseline_products : bool, optional
+        Accumulate the per-baseline (time-averaged) products.
+    '''
+
+    weights = np.where(chunk['flag'], 0., chunk['weight'][:, np.newaxis, :])
+
+    if not weights.any():
+        return
+
+    # Flagged samples can hold NaN or inf, and 0 * NaN is still NaN. Zero them
+    # before weighting so they are dropped as in `plotms`.
+    # The full-resolution arrays keep the precision of the MS columns (complex64
+    # and float32) and are reduced by integration before any other products.
+    valid = weights > 0
+    wvis = np.where(valid, chunk['data'], 0.)
+    wvis *= weights
+
+    field = int(chunk['field'])
+    spw = int(chunk['spw'])
+
+    scans = np.asarray(chunk['scan'])
+    times = np.asarray(chunk['time'])
+
+    wvis_bin = _bin_channels(wvis, chanavg)
+    weights_bin = _bin_channels(weights, chanavg)
+
+    # Baseline-averaged sums per integration at full resolution.
+    scan_times, time_idx = np.unique(np.stack([scans, times], axis=1), axis=0,
+                                     return_inverse=True)
+    time_idx = time_idx.ravel()
+
+    int_wvis = _group_sum(wvis, time_idx, len(scan_times))
+    int_w = _group_sum(weights, time_idx, len(scan_times))
+
+    del wvis
+
+    # Channel-averaged, baseline-averaged per integration.
+    time_wvis = _bin_channels(int_wvis, chanavg)
+    time_w = _bin_channels(int_w, chanavg)
+
+    for ii, (scan, time) in enumerate(scan_times):
+        _add_to(acc['time'], (field, int(scan), spw, time),
+                {'wvis': time_wvis[..., ii], 'w': time_w[..., ii]})
+
+    # Time-averaged, baseline-averaged per channel.
+    unique_scans, scan_idx = np.unique(scan_times[:, 0], return_inverse=True)
+    scan_idx = scan_idx.ravel()
+
+    chan_wvis = _group_sum(int_wvis, scan_idx, len(unique_scans))
+    chan_w = _group_sum(int_w, scan_idx, len(unique_scans))
+    chan_wtime = _group_sum(int_w * scan_times[:, 1], scan_idx, len(unique_scans))
+
+    for ii, scan in enumerate(unique_scans):
+        _add_to(acc['chan'], (field, int(scan), spw),
+                {'wvis': chan_wvis[..., ii], 'w': chan_w[..., ii], 'wtime': chan_wtime[..., ii]})
+
+    if not baseline_products:
+        return
+
+    # Channel-averaged, time-averaged per baseline.
+    baselines, bl_idx = np.unique(np.stack([scans, chunk['antenna1'], chunk['antenna2']], axis=1),
+                                  axis=0, return_inverse=True)
+    bl_idx = bl_idx.ravel()
+
+    uvdist = np.sqrt(chunk['uvw'][0]**2 + chunk['uvw'][1]**2)
+
+    bl_sums = {'wvis': _group_sum(wvis_bin, bl_idx, len(baselines)),
+               'w': _group_sum(weights_bin, bl_idx, len(baselines)),
+               'wuvdist': _group_sum(weights_bin * uvdist, bl_idx, len(baselines)),
+               'wtime': _group_sum(weights_bin * times, bl_idx, len(baselines))}
+
+    if chunk.get('model') is not None:
+        wmodel = np.where(valid, chunk['model'], 0.)
+        wmodel *= weights
+        bl_sums['wmodel'] = _group_sum(_bin_channels(wmodel, chanavg), bl_idx, len(baselines))
+
+    for ii, (scan, ant1, ant2) in enumerate(baselines):
+        _add_to(acc['baseline'], (field, int(scan), spw, int(ant1), int(ant2)),
+                {name: val[..., ii] for name, val in bl_sums.items()})
+
+
+def _yvalue(wvis, w, yaxis, wmodel=None):
+    '''
+    Amplitude, phase (deg) or scalar amplitude residual of the averaged visibilities.
+    '''
+
+    vis = wvis / w
+
+    if yaxis == 'amp':
+        return np.abs(vis)
+    elif yaxis == 'phase':
+        return np.rad2deg(np.angle(vis))
+    elif yaxis == 'ampresid':
+        # corrected-model_scalar: difference of the amplitudes.
+        return np.abs(vis) - np.abs(wmodel / w)
+
+    raise ValueError("Unknown yaxis {}".format(yaxis))
+
+
+def qa_table_rows(acc, product, field, scan, spw_info, antenna_names, obs=0):
+    '''
+    Rows for one product, field and scan from the accumulated sums.
+
+    Parameters
+    ----------
+    acc : dict
+        Accumulator from `accumulate_qa_chunk`.
+    product : str
+        Key in `QA_TABLE_PRODUCTS`.
+    field : int
+        Field ID.
+    scan : int
+        Scan number.
+    spw_info : dict
+        Keyed by SPW ID with the 'chan_freqs' (Hz), 'corr_names' and 'chanavg'.
+    antenna_names : list
+        Antenna names indexed by antenna ID.
+
+    Returns
+    -------
+    rows : np.ndarray
+        Structured array with the `QA_TABLE_COLUMNS`.
+    '''
+
+    xaxis, yaxis, avg_type, _ = QA_TABLE_PRODUCTS[product]
+
+    dtype = [('x', float), ('y', float), ('chan', int), ('scan', int), ('field', int),
+             ('ant1', int), ('ant2', int), ('ant1name', 'U16'), ('ant2name', 'U16'),
+             ('time', float), ('freq', float), ('spw', int), ('corr', 'U4'), ('obs', int)]
+
+    all_rows = []
+
+    for key in sorted(acc[avg_type]):
+
+        if key[0] != field or key[1] != scan:
+            continue
+
+        spw = key[2]
+        sums = acc[avg_type][key]
+
+        if yaxis == 'ampresid' and 'wmodel' not in sums:
+            continue
+
+        chan_freqs = spw_info[spw]['chan_freqs']
+        corr_names = spw_info[spw]['corr_names']
+        chanavg = spw_info[spw]['chanavg']
+
+        nchan = chan_freqs.size
+
+        if avg_type == 'chan':
+            chans = np.arange(nchan)
+            freqs = chan_freqs
+        else:
+            # Mean channel and frequency of each channel bin.
+            bin_starts = np.arange(0, nchan, chanavg)
+            chans = np.array([int(np.mean(np.arange(start, min(start + chanavg, nchan))))
+                              for start in bin_starts])
+            freqs = np.add.reduceat(chan_freqs, bin_starts) / np.diff(np.append(bin_starts, nchan))
+
+        w = sums['w']
+        valid = w > 0
+
+        if not valid.any():
+            continue
+
+        # Shapes are (ncorr, nchan or nbin)
+        corr_idx, chan_idx = np.nonzero(valid)
+
+        yvals = _yvalue(sums['wvis'][valid], w[valid], yaxis,
+                        wmodel=sums['wmodel'][valid] if yaxis == 'ampresid' else None)
+
+        rows = np.zeros(yvals.size, dtype=dtype)
+
+        rows['y'] = yvals
+        rows['chan'] = chans[chan_idx]
+        rows['scan'] = scan
+        rows['field'] = field
+        rows['freq'] = freqs[chan_idx] / 1.e9  # GHz
+        rows['spw'] = spw
+        rows['corr'] = np.asarray(corr_names)[corr_idx]
+        rows['obs'] = obs
+
+        if avg_type == 'time':
+            rows['time'] = key[3]
+        else:
+            rows['time'] = sums['wtime'][valid] / w[valid]
+
+        if avg_type == 'baseline':
+            rows['ant1'] = key[3]
+            rows['ant2'] = key[4]
+            rows['ant1name'] = antenna_names[key[3]]
+            rows['ant2name'] = antenna_names[key[4]]
+        else:
+            # Baseline averaged.
+            rows['ant1'] = -1
+            rows['ant2'] = -1
+            rows['ant1name'] = 'all'
+            rows['ant2name'] = 'all'
+
+        if xaxis == 'time':
+            rows['x'] = rows['time']
+        elif xaxis == 'chan':
+            rows['x'] = rows['chan']
+        elif xaxis == 'uvdist':
+            rows['x'] = sums['wuvdist'][valid] / w[valid]
+        elif xaxis == 'uvwave':
+            rows['x'] = sums['wuvdist'][valid] / w[valid] * freqs[chan_idx] / _SPEED_OF_LIGHT
+        elif xaxis == 'amp':
+            rows['x'] = _yvalue(sums['wvis'][valid], w[valid], 'amp')
+        elif xaxis == 'antenna1':
+            rows['x'] = rows['ant1']
+
+        all_rows.append(rows)
+
+    if len(all_rows) == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.concatenate(all_rows)
+
+
+def write_qa_table(filename, rows, product, ms_name, field_name, scan, chanavg,
+                   outtype='txt', field_names=None):
+    '''
+    Write the rows for one QA table. The text tables have the layout of the `plotms`
+    text exports: six comment lines, then the column names. The binary formats
+    (see `qa_table_io`) also store the field names for the field IDs.
+    '''
+
+    xaxis, yaxis, avg_type, _ = QA_TABLE_PRODUCTS[product]
+
+    ydatacolumn = 'corrected-model_scalar' if yaxis == 'ampresid' else 'corrected'
+
+    header = "\n".join(["From plot 0",
+                        "vis: {}".format(ms_name),
+                        "field: {0} scan: {1}".format(field_name, scan),
+                        "x: {0} y: {1}".format(xaxis, yaxis),
+                        "Averaging: {0} (chanavg={1})".format(avg_type, chanavg),
+                        "ydatacolumn: {}".format(ydatacolumn),
+                        " ".join(QA_TABLE_COLUMNS)])
+
+    metadata = {'ms_name': ms_name, 'field': field_name, 'scan': int(scan),
+                'product': product, 'xaxis': xaxis, 'yaxis': yaxis,
+                'averaging': avg_type, 'chanavg': chanavg, 'ydatacolumn': ydatacolumn}
+
+    if field_names is not None:
+        metadata['field_names'] = [str(name) for name in field_names]
+
+    write_qa_table_data(os.path.splitext(filename)[0], rows, outtype=outtype,
+                        metadata=metadata,
+                        txt_kwargs={'fmt': QA_TABLE_FMT, 'header': header, 'comments': '# '})
+
+
+def _ms_setup(ms_name):
+    '''
+    Antenna names, and the SPW and polarization of each DATA_DESC_ID.
+    '''
+
+    from casatools import table
+
+    tb = table()
+
+    tb.open(os.path.join(ms_name, "ANTENNA"))
+    antenna_names = list(tb.getcol("NAME"))
+    tb.close()
+
+    tb.open(os.path.join(ms_name, "DATA_DESCRIPTION"))
+    ddid_spw = tb.getcol("SPECTRAL_WINDOW_ID")
+    ddid_pol = tb.getcol("POLARIZATION_ID")
+    tb.close()
+
+    tb.open(os.path.join(ms_name, "POLARIZATION"))
+    corr_types = [tb.getcell("CORR_TYPE", int(pol)) for pol in range(tb.nrows())]
+    tb.close()
+
+    tb.open(os.path.join(ms_name, "SPECTRAL_WINDOW"))
+    chan_freqs = {int(spw): tb.getcell("CHAN_FREQ", int(spw)) for spw in np.unique(ddid_spw)}
+    tb.close()
+
+    ddid_info = {}
+    for ddid, (spw, pol) in enumerate(zip(ddid_spw, ddid_pol)):
+        ddid_info[ddid] = {'spw': int(spw),
+                           'chan_freqs': chan_freqs[int(spw)],
+                           'corr_names': [_CORR_NAMES.get(int(corr), str(corr))
+                                          for corr in corr_types[pol]]}
+
+    return antenna_names, ddid_info
+
+
+def export_qa_tables(ms_name, field_names, is_calibrator, scans_to_write,
+                     output_folder='scan_plots_txt', outtype='txt',
+                     chanavg=4096, chunk_elements=_QA_CHUNK_ELEMENTS):
+    '''
+    Compute and write the per-scan QA tables in one pass over the MS.
+
+    Parameters
+    ----------
+    ms_name : str
+        MS name.
+    field_names : list
+        Field names indexed by field ID.
+    is_calibrator : np.ndarray
+        Boolean array of calibrator fields. The phase, amp vs. phase, residual
+        and antenna products are only made for calibrators.
+    scans_to_write : dict
+        Products to write keyed by (field ID, scan).
+    outtype : str or list, optional
+        Output format(s). See `qa_table_io.QA_TABLE_FORMATS`.
+    chunk_elements : int, optional
+        Number of visibilities read at once. The rows per chunk are set from the
+        number of correlations and channels of each SPW.
+    '''
+
+    from casatools import table
+
+    outtypes = qa_table_formats(outtype)
+
+    if len(scans_to_write) == 0:
+        return
+
+    antenna_names, ddid_info = _ms_setup(ms_name)
+
+    field_ids = sorted(set([key[0] for key in scans_to_write]))
+    cal_ids = [field_id for field_id in field_ids if is_calibrator[field_id]]
+
+    acc = new_qa_accumulator()
+
+    tb = table()
+    tb.open(ms_name)
+
+    has_model = "MODEL_DATA" in tb.colnames()
+
+    if len(cal_ids) > 0 and not has_model:
+        casalog.post(message="No MODEL_DATA column in {}. Skipping the residual tables."
+                     .format(ms_name), origin='export_qa_tables')
+
+    try:
+        for ddid in ddid_info:
+
+            ncorr = len(ddid_info[ddid]['corr_names'])
+            nchan = len(ddid_info[ddid]['chan_freqs'])
+            chunk_rows = max(1, int(chunk_elements // (ncorr * nchan)))
+
+            for field_id in field_ids:
+
+                # Rows are read once. MODEL_DATA is only read for calibrators.
+                read_model = has_model and is_calibrator[field_id]
+
+                sub_tb = tb.query("FIELD_ID == {0} && DATA_DESC_ID == {1}".format(field_id, ddid))
+
+                try:
+                    nrows = sub_tb.nrows()
+
+                    for startrow in range(0, nrows, chunk_rows):
+
+                        nrow = min(chunk_rows, nrows - startrow)
+
+                        def getcol(colname):
+                            return sub_tb.getcol(colname, startrow=startrow, nrow=nrow)
+
+                        chunk = {'data': getcol("CORRECTED_DATA"),
+                                 'flag': getcol("FLAG"),
+                                 'weight': getcol("WEIGHT"),
+                                 'time': getcol("TIME"),
+                                 'scan': getcol("SCAN_NUMBER"),
+                                 'antenna1': getcol("ANTENNA1"),
+                                 'antenna2': getcol("ANTENNA2"),
+                                 'uvw': getcol("UVW"),
+                                 'field': field_id,
+                                 'spw': ddid_info[ddid]['spw'],
+                                 'model': getcol("MODEL_DATA") if read_model else None}
+
+                        accumulate_qa_chunk(acc, chunk, chanavg=chanavg,
+                                            baseline_products=True)
+                finally:
+                    sub_tb.close()
+
+    finally:
+        tb.close()
+
+    spw_info = {}
+    for ddid in ddid_info:
+        spw_info[ddid_info[ddid]['spw']] = {'chan_freqs': ddid_info[ddid]['chan_freqs'],
+                                            'corr_names': ddid_info[ddid]['corr_names'],
+                                            'chanavg': chanavg}
+
+    for (field_id, scan), products in scans_to_write.items():
+
+        for product in products:
+
+            filename = qa_table_filename(output_folder, field_names[field_id], product, scan,
+                                         outtype=outtypes[0])
+
+            rows = qa_table_rows(acc, product, field_id, scan, spw_info, antenna_names)
+
+            if rows.size == 0:
+                casalog.post(message="No unflagged data for {}. Skipping".format(filename),
+                             origin='export_qa_tables')
+                continue
+
+            write_qa_table(filename, rows, product, ms_name, field_names[field_id], scan,
+                           chanavg, outtype=outtypes, field_names=field_names)
@@ -0,0 +1,398 @@
+'''
+Writers and readers for the QA tables in text and columnar binary formats.
+
+Formats:
+
+* 'txt': whitespace-delimited text (np.savetxt). The original QA output.
+* 'npz': compressed NumPy archive with one array per column.
+* 'npy': a directory with one uncompressed .npy file per column. Memory mapped on read.
+* 'hdf5': one gzip-compressed dataset per column. Requires h5py.
+* 'parquet': zstd-compressed Parquet. Memory mapped on read. Requires pyarrow.
+
+The binary formats store the schema (column names and dtypes) and a metadata
+dictionary, e.g. the field names matching the field IDs in the table.
+
+New formats can be added with `register_qa_table_format`.
+
+'''
+
+import os
+import json
+import shutil
+import numpy as np
+
+
+_METADATA_KEY = 'qa_metadata'
+
+
+def _as_columns(table):
+    '''
+    Dictionary of column arrays from a structured array or dictionary.
+    '''
+
+    if isinstance(table, np.ndarray) and table.dtype.names is not None:
+        return {name: table[name] for name in table.dtype.names}
+
+    return {name: np.asarray(val) for name, val in table.items()}
+
+
+def _full_metadata(columns, metadata):
+
+    full_metadata = {'columns': list(columns.keys()),
+                     'dtypes': [np.asarray(val).dtype.str for val in columns.values()]}
+
+    if metadata is not None:
+        full_metadata.update(metadata)
+
+    return full_metadata
+
+
+def _txt_column_fmt(dtype):
+
+    if dtype.kind in 'US':
+        return '%s'
+    if dtype.kind in 'iub':
+        return '%d'
+    return '%.18e'
+
+
+def _write_txt(filename, columns, metadata, fmt=None, header=None, comments='# '):
+
+    table = np.zeros(len(next(iter(columns.values()))),
+                     dtype=[(name, val.dtype) for name, val in columns.items()])
+    for name, val in columns.items():
+        table[name] = val
+
+    if fmt is None:
+        fmt = " ".join([_txt_column_fmt(val.dtype) for val in columns.values()])
+
+    if header is None:
+        header = " ".join(columns.keys())
+
+    np.savetxt(filename, table, fmt=fmt, header=header, comments=comments)
+
+
+# dtypes of the columns in the plotms text exports. Other columns are read as floats.
+PLOTMS_COLUMN_DTYPES = {'x': float, 'y': float, 'time': float, 'freq': float,
+                        'chan': int, 'scan': int, 'field': int, 'ant1': int, 'ant2': int,
+                        'spw': int, 'obs': int, 'ant': int,
+                        'ant1name': 'U32', 'ant2name': 'U32', 'corr': 'U8'}
+
+
+def plotms_txt_columns(filename, skip_header=6):
+    '''
+    Column names from the header line of a plotms text export, which follows
+    `skip_header` comment lines.
+    '''
+
+    with open(filename, 'r') as f:
+        for ii, line in enumerate(f):
+            if ii == skip_header:
+                return line.lstrip("#").split()
+
+    raise ValueError("No column header found in {}".format(filename))
+
+
+def read_plotms_txt(filename, columns=None, skip_header=6):
+    '''
+    Read a plotms text export (or a QA table with the same layout) into a structured array.
+
+    The dtype is set from the column names in the header (see `PLOTMS_COLUMN_DTYPES`)
+    so the body is parsed by `np.loadtxt` without the type inference in `np.genfromtxt`.
+    Falls back to `np.genfromtxt` when a column does not parse with the expected type.
+
+    Parameters
+    ----------
+    filename : str
+        Text file name.
+    columns : list, optional
+        Only read these columns.
+    skip_header : int, optional
+        Number of comment lines before the column names. Six for plotms exports.
+
+    Returns
+    -------
+    dat : np.ndarray
+        Structured array with the columns as fields.
+    '''
+
+    all_names = plotms_txt_columns(filename, skip_header=skip_header)
+
+    names = all_names if columns is None else list(columns)
+
+    usecols = [all_names.index(name) for name in names]
+
+    dtype = [(name, PLOTMS_COLUMN_DTYPES.get(name, float)) for name in names]
+
+    try:
+        dat = np.loadtxt(filename, dtype=dtype, skiprows=skip_header + 1, usecols=usecols,
+                         comments='#', ndmin=1)
+    except ValueError:
+        dat = np.genfromtxt(filename, names=True, dtype=None, skip_header=skip_header,
+                            encoding=None)
+        dat = dat[names] if columns is not None else dat
+
+    return dat
+
+
+def _read_txt(filename, columns=None, mmap=True, skip_header=6):
+
+    dat = read_plotms_txt(filename, columns=columns, skip_header=skip_header)
+
+    return {name: dat[name] for name in dat.dtype.names}, {}
+
+
+def _write_npz(filename, columns, metadata):
+
+    # Pass an open file so numpy does not append another .npz extension.
+    with open(filename, 'wb') as f:
+        np.savez_compressed(f, **columns,
+                            **{_METADATA_KEY: np.array(json.dumps(metadata))})
+
+
+def _read_npz(filename, columns=None, mmap=True):
+
+    # Columns of an npz file are read lazily but cannot be memory mapped.
+    with np.load(filename, allow_pickle=False) as npz:
+        metadata = json.loads(str(npz[_METADATA_KEY]))
+
+        names = metadata['columns'] if columns is None else columns
+
+        return {name: npz[name] for name in names}, metadata
+
+
+def _write_npy(filename, columns, metadata):
+
+    # Write to a temporary directory first so a partial table is never read.
+    tmp_dirname = "{}.tmp".format(filename)
+    if os.path.exists(tmp_dirname):
+        shutil.rmtree(tmp_dirname)
+    os.mkdir(tmp_dirname)
+
+    for name, val in columns.items():
+        np.save(os.path.join(tmp_dirname, "{}.npy".format(name)), val, allow_pickle=False)
+
+    with open(os.path.join(tmp_dirname, "metadata.json"), 'w') as f:
+        json.dump(metadata, f, indent=1)
+
+    if os.path.exists(filename):
+        shutil.rmtree(filename)
+
+    os.rename(tmp_dirname, filename)
+
+
+def _read_npy(filename, columns=None, mmap=True):
+
+    with open(os.path.join(filename, "metadata.json"), 'r') as f:
+        metadata = json.load(f)
+
+    names = metadata['columns'] if columns is None else columns
+
+    return {name: np.load(os.path.join(filename, "{}.npy".format(name)),
+                          mmap_mode='r' if mmap else None,
+                          allow_pickle=False)
+            for name in names}, metadata
+
+
+def _write_hdf5(filename, columns, metadata):
+
+    import h5py
+
+    with h5py.File(filename, 'w') as f:
+        for name, val in columns.items():
+            # h5py does not support numpy unicode strings.
+            if val.dtype.kind == 'U':
+                val = np.char.encode(val, 'utf-8')
+
+            f.create_dataset(name, data=val, compression='gzip', shuffle=True)
+
+        f.attrs[_METADATA_KEY] = json.dumps(metadata)
+
+
+def _read_hdf5(filename, columns=None, mmap=True):
+
+    import h5py
+
+    with h5py.File(filename, 'r') as f:
+        metadata = json.loads(f.attrs[_METADATA_KEY])
+
+        names = metadata['columns'] if columns is None else columns
+
+        out = {}
+        for name in names:
+            val = f[name][...]
+            if val.dtype.kind == 'S':
+                val = np.char.decode(val, 'utf-8')
+            out[name] = val
+
+    return out, metadata
+
+
+def _write_parquet(filename, columns, metadata):
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({name: pa.array(val) for name, val in columns.items()})
+    table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(metadata)})
+
+    pq.write_table(table, filename, compression='zstd')
+
+
+def _read_parquet(filename, columns=None, mmap=True):
+
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(filename, columns=columns, memory_map=mmap)
+
+    metadata = json.loads(table.schema.metadata[_METADATA_KEY.encode()])
+
+    # Numeric columns without nulls are zero-copy views of the mapped file.
+    return {name: table.column(name).to_numpy() for name in table.column_names}, metadata
+
+
+QA_TABLE_FORMATS = {'txt': (_write_txt, _read_txt),
+                    'npz': (_write_npz, _read_npz),
+                    'npy': (_write_npy, _read_npy),
+                    'hdf5': (_write_hdf5, _read_hdf5),
+                    'parquet': (_write_parquet, _read_parquet)}
+
+
+def register_qa_table_format(name, writer, reader):
+    '''
+    Add a QA table format.
+
+    Parameters
+    ----------
+    name : str
+        Format name. Also used as the file extension.
+    writer : function
+        Called as `writer(filename, columns, metadata)` with a dictionary of
+        column arrays and the metadata dictionary.
+    reader : function
+        Called as `reader(filename, columns=None, mmap=True)` and returns the
+        dictionary of columns and the metadata.
+    '''
+
+    QA_TABLE_FORMATS[name] = (writer, reader)
+
+
+def qa_table_formats(outtype):
+    '''
+    List of formats from a single format name or a list of names.
+    '''
+
+    outtypes = [outtype] if isinstance(outtype, str) else list(outtype)
+
+    for this_outtype in outtypes:
+        if this_outtype not in QA_TABLE_FORMATS:
+            raise ValueError("Unknown QA table format {0}. Must be one of {1}"
+                             .format(this_outtype, list(QA_TABLE_FORMATS.keys())))
+
+    return outtypes
+
+
+def write_qa_table_data(basename, table, outtype='txt', metadata=None,
+                        txt_kwargs={}):
+    '''
+    Write a QA table in one or more formats.
+
+    Parameters
+    ----------
+    basename : str
+        Output name without the extension. Each format adds its name as the extension.
+    table : np.ndarray or dict
+        Structured array or dictionary of equal-length column arrays.
+    outtype : str or list, optional
+        Format(s) to write. See `QA_TABLE_FORMATS`.
+    metadata : dict, optional
+        JSON-serializable metadata stored with the binary formats, in addition to
+        the column names and dtypes.
+    txt_kwargs : dict, optional
+        Passed to the 'txt' writer (`fmt`, `header`, `comments`) to keep the text
+        layout of the existing tables.
+
+    Returns
+    -------
+    filenames : list
+        The files written.
+    '''
+
+    columns = _as_columns(table)
+    full_metadata = _full_metadata(columns, metadata)
+
+    filenames = []
+
+    for this_outtype in qa_table_formats(outtype):
+
+        filename = "{0}.{1}".format(basename, this_outtype)
+
+        writer = QA_TABLE_FORMATS[this_outtype][0]
+
+        if this_outtype == 'txt':
+            writer(filename, columns, full_metadata, **txt_kwargs)
+        else:
+            writer(filename, columns, full_metadata)
+
+        filenames.append(filename)
+
+    return filenames
+
+
+def read_qa_table(filename, columns=None, mmap=True, as_structured=False,
+                  **reader_kwargs):
+    '''
+    Read a QA table written by `write_qa_table_data`. The format is set by the
+    file extension.
+
+    Parameters
+    ----------
+    filename : str
+        QA table name.
+    columns : list, optional
+        Only read these columns.
+    mmap : bool, optional
+        Memory map the columns for the formats that support it ('npy' and 'parquet').
+    as_structured : bool, optional
+        Return a (copied) structured array instead of a dictionary of columns.
+
+    Returns
+    -------
+    table : dict or np.ndarray
+        Column arrays keyed by name, or a structured array.
+    metadata : dict
+        The stored metadata. Empty for 'txt' tables.
+    '''
+
+    this_outtype = os.path.splitext(filename.rstrip("/"))[1].lstrip(".")
+
+    if this_outtype not in QA_TABLE_FORMATS:
+        raise ValueError("Unknown QA table format for {}".format(filename))
+
+    reader = QA_TABLE_FORMATS[this_outtype][1]
+
+    table, metadata = reader(filename, columns=columns, mmap=mmap, **reader_kwargs)
+
+    if as_structured:
+        out = np.zeros(len(next(iter(table.values()))),
+                       dtype=[(name, val.dtype) for name, val in table.items()])
+        for name, val in table.items():
+            out[name] = val
+
+        table = out
+
+    return table, metadata
+
+
+def convert_txt_table(txt_filename, outtype, metadata=None, skip_header=6):
+    '''
+    Convert a text table (e.g., a `plotms` export) to other formats.
+    '''
+
+    table, _ = read_qa_table(txt_filename, skip_header=skip_header)
+
+    basename = os.path.splitext(txt_filename)[0]
+
+    return write_qa_table_data(basename, table,
+                               outtype=[fmt for fmt in qa_table_formats(outtype) if fmt != 'txt'],
+                               metadata=metadata)
@@ -1,69 +1,186 @@
 
 import os
 import numpy as np
-import matplotlib.pyplot as plt
 
-from casatools import logsink
+from lband_pipeline.casa_logging import casalog
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
+from .qa_table_io import read_qa_table, read_plotms_txt
 
-casalog = logsink()
 
+# Columns used for the uv residual statistics.
+UVDATA_COLUMNS = ['x', 'y', 'spw', 'ant1', 'ant2', 'scan']
 
-# read from plotms output file
+
+# read from plotms output file or a binary QA table (see qa_table_io)
 def get_uvdata(infile):
-    dat = np.genfromtxt(infile, names=True, dtype=None, skip_header=6, encoding=None)
-    spws = sorted(np.unique(dat['spw']))
-    median_flux = []
-    for spw in spws:
-        median_flux.append(np.median(dat[dat['spw'] == spw]['y']))
-        dat['y'][dat['spw'] == spw] = 100. * (dat['y'][dat['spw'] == spw] / np.median(dat[dat['spw'] == spw]['y']) - 1.)
-    x = dat['x']
-    y = dat['y']
-    xi = x.argsort()
-    x = x[xi]
-    y = y[xi]
+    '''
+    Read a plotms amplitude vs. uvwave export and convert the amplitudes to
+    the percentage difference from the per-SPW median.
+
+    Returns
+    -------
+    dat : np.ndarray
+        Structured array with the `UVDATA_COLUMNS`.
+    median_flux : float
+        The median of the per-SPW median amplitudes.
+    '''
+
+    if infile.rstrip("/").endswith(".txt"):
+        dat = read_plotms_txt(infile, columns=UVDATA_COLUMNS)
+    else:
+        dat = read_qa_table(infile, columns=UVDATA_COLUMNS, as_structured=True)[0]
+
+    if dat.size == 0:
+        return dat, np.median([])
+
+    # Per-SPW medians from one sort.
+    spws, spw_idx = np.unique(dat['spw'], return_inverse=True)
+
+    order = np.lexsort([dat['y'], spw_idx])
+    counts = np.bincount(spw_idx, minlength=spws.size)
+    starts = np.append(0, np.cumsum(counts)[:-1])
+
+    median_flux = _sorted_median(dat['y'][order], starts, counts)
+
+    # NaNs sort to the end of each block.
+    median_flux[np.isnan(dat['y'][order][starts + counts - 1])] = np.nan
+
+    dat['y'] = 100. * (dat['y'] / median_flux[spw_idx] - 1.)
+
     return dat, np.median(median_flux)
 
 
+def _sorted_lerp(sorted_vals, starts, counts, quantile):
+    '''
+    Linear-interpolation quantile (as in `np.percentile`) of groups stored as
+    contiguous, sorted blocks.
+    '''
+
+    virtual_idx = (counts - 1) * quantile
+    prev_idx = np.floor(virtual_idx)
+    gamma = virtual_idx - prev_idx
+
+    prev_idx = prev_idx.astype(np.intp)
+    next_idx = np.minimum(prev_idx + 1, counts - 1)
+
+    a = sorted_vals[starts + prev_idx]
+    b = sorted_vals[starts + next_idx]
+
+    # Same interpolation as numpy's _lerp
+    diff_b_a = b - a
+    out = a + diff_b_a * gamma
+    upper = gamma >= 0.5
+    out[upper] = (b - diff_b_a * (1 - gamma))[upper]
+
+    return out
+
+
+def _sorted_median(sorted_vals, starts, counts):
+    '''
+    `np.median` of groups stored as contiguous, sorted blocks.
+    '''
+
+    lower = sorted_vals[starts + (counts - 1) // 2]
+    upper = sorted_vals[starts + counts // 2]
+
+    return np.where(counts % 2 == 1, lower, (lower + upper) / 2.)
+
+
+def grouped_uv_stats(dat, keys=('ant1', 'ant2'), min_count=6):
+    '''
+    Median, IQR-based error, count and median x of `dat['y']` for every unique
+    combination of the `keys` columns.
+
+    The groups are found with a single `np.lexsort` and the statistics are
+    computed on the contiguous sorted blocks, instead of a boolean scan of the
+    data for every group. The values match `np.percentile` and `np.median`.
+
+    Parameters
+    ----------
+    dat : np.ndarray
+        Structured array from `get_uvdata`.
+    keys : tuple, optional
+        Columns to group by. The groups are ordered by the first key, then the second...
+    min_count : int, optional
+        Only return groups with at least this many points.
+
+    Returns
+    -------
+    stats : dict
+        'x', 'y', 'yerr' and 'count' arrays, and the group values for each key.
+    '''
+
+    key_cols = [np.asarray(dat[key]) for key in keys]
+
+    y = np.asarray(dat['y'])
+    x = np.asarray(dat['x'])
+
+    # Sort on the keys, then by value within each group. np.lexsort uses the
+    # last key as the primary one.
+    order_y = np.lexsort([y] + key_cols[::-1])
+    order_x = np.lexsort([x] + key_cols[::-1])
+
+    sorted_keys = [col[order_y] for col in key_cols]
+
+    if y.size == 0:
+        new_group = np.zeros(0, dtype=bool)
+    else:
+        new_group = np.zeros(y.size, dtype=bool)
+        new_group[0] = True
+        for col in sorted_keys:
+            new_group[1:] |= col[1:] != col[:-1]
+
+    starts = np.where(new_group)[0]
+    counts = np.diff(np.append(starts, y.size))
+
+    keep = counts >= min_count
+    starts = starts[keep]
+    counts = counts[keep]
+
+    sorted_y = y[order_y]
+    sorted_x = x[order_x]
+
+    q25 = _sorted_lerp(sorted_y, starts, counts, 0.25)
+    q50 = _sorted_lerp(sorted_y, starts, counts, 0.5)
+    q75 = _sorted_lerp(sorted_y, starts, counts, 0.75)
+
+    iqr = (1 / 1.35) * (q75 - q25)
+
+    stats = {'x': _sorted_median(sorted_x, starts, counts),
+             'y': q50,
+             'yerr': np.abs(iqr) / np.sqrt(counts),
+             'count': counts}
+
+    # NaNs sort to the end of each block. Match np.percentile/np.median and
+    # return NaN for those groups.
+    ends = starts + counts - 1
+    stats['y'][np.isnan(sorted_y[ends])] = np.nan
+    stats['yerr'][np.isnan(sorted_y[ends])] = np.nan
+    stats['x'][np.isnan(sorted_x[ends])] = np.nan
+
+    for key, col in zip(keys, sorted_keys):
+        stats[key] = col[starts]
+
+    return stats
+
+
 # put data in bins; may need to combine SPWs here
 # current alternative functions for VLASS use hard-coded SPW ranges
 def bin_uvdata(dat):
-    list_x, list_y, list_yerr = [], [], []
-    for ant1 in np.unique(dat['ant1']):
-        for ant2 in np.unique(dat['ant2']):
-            hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2))[0]
-            if len(hits) > 5:
-                q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
-                iqr = (1 / 1.35) * (q75 - q25)
-                bin_median = q50
-                bin_std = np.abs(iqr) / np.sqrt(len(hits))
-                bin_x = np.median(dat['x'][hits])
-                list_x.append(bin_x)
-                list_y.append(bin_median)
-                list_yerr.append(bin_std)
-    return np.array([list_x, list_y, list_yerr])
+    stats = grouped_uv_stats(dat, keys=('ant1', 'ant2'))
+    return np.array([stats['x'], stats['y'], stats['yerr']])
 
 
 def bin_uvdata_perscan(dat):
-    list_x, list_y, list_yerr = [], [], []
-    for ant1 in np.unique(dat['ant1']):
-        for ant2 in np.unique(dat['ant2']):
-            for scan in np.unique(dat['scan']):
-                hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2) & (dat['scan'] == scan))[0]
-                if len(hits) > 5:
-                    q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
-                    iqr = (1 / 1.35) * (q75 - q25)
-                    bin_median = q50
-                    bin_std = np.abs(iqr) / np.sqrt(len(hits))
-                    bin_x = np.median(dat['x'][hits])
-                    list_x.append(bin_x)
-                    list_y.append(bin_median)
-                    list_yerr.append(bin_std)
-    return np.array([list_x, list_y, list_yerr])
+    stats = grouped_uv_stats(dat, keys=('ant1', 'ant2', 'scan'))
+    return np.array([stats['x'], stats['y'], stats['yerr']])
 
 
 # make plots
 def plot_uvdata_perscan(binned_dat_perscan, binned_dat, infile, bin_type='combined'):
 
+    import matplotlib.pyplot as plt
+
     fig0 = plt.figure()
     ax1 = fig0.gca()
 
@@ -98,17 +215,239 @@ def plot_uvdata_perscan(binned_dat_perscan, binned_dat, infile, bin_type='combin
     plt.close()
 
 
+def disk_usage_bytes(path):
+    '''
+    Total size of the files in a directory tree (or a single file).
+    '''
+
+    if not os.path.exists(path):
+        return 0
+
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            this_file = os.path.join(root, filename)
+            if not os.path.islink(this_file):
+                total += os.path.getsize(this_file)
+
+    return total
+
+
+def estimate_split_bytes(myvis, field_ids):
+    '''
+    Estimate the size of a `split` of the given fields as the size of the MS
+    scaled by the fraction of rows in those fields. This is an upper limit as
+    `split` writes a single data column.
+    '''
+
+    from casatools import table
+
+    tb = table()
+
+    tb.open(myvis)
+    total_rows = tb.nrows()
+    sub_tb = tb.query("FIELD_ID IN [{}]".format(",".join([str(int(fid)) for fid in field_ids])))
+    field_rows = sub_tb.nrows()
+    sub_tb.close()
+    tb.close()
+
+    if total_rows == 0:
+        return 0
+
+    return int(disk_usage_bytes(myvis) * field_rows / total_rows)
+
+
+def _export_and_plot_uvstats(vis, field_name, datacolumn, plotms_outfile):
+    '''
+    Export amplitude vs. uvwave for one field with plotms, then bin and plot it.
+
+    Returns False when there are too few points to bin.
+    '''
+
+    from casaplotms import plotms
+
+    casalog.post(message='Exporting from plotms: {0}'.format(plotms_outfile), origin='run_all_uvstats')
+
+    if not os.path.exists(plotms_outfile):
+        plotms(vis=vis,
+            field=field_name, xaxis='UVwave', yaxis='Amp', ydatacolumn=datacolumn,
+            averagedata=True, scalar=False,
+            avgchannel='4096', avgtime='1000', avgscan=False,
+            correlation='RR,LL', plotfile=plotms_outfile, showgui=False, overwrite=True)
+    else:
+        casalog.post(message='File {0} already exists. Skipping'.format(plotms_outfile), origin='run_all_uvstats')
+
+    casalog.post(message='Analyzing UV stats for {0}'.format(plotms_outfile), origin='run_all_uvstats')
+
+    # Read in txt from plotms
+    dat, median_flux = get_uvdata(plotms_outfile)
+    # n_scans = len(np.unique(dat['scan']))
+    binned_dat = bin_uvdata(dat)
+    binned_dat_perscan = bin_uvdata_perscan(dat)
+    if binned_dat.shape[1] == 0:
+        return False
+    if binned_dat_perscan.shape[1] == 0:
+        return False
+    plot_uvdata_perscan(binned_dat_perscan, binned_dat, plotms_outfile, bin_type='combined')
+
+    return True
+
+
+def _uvstats_result(field_name, status='skipped', error=None):
+    '''
+    Default per-field result of `_uvstats_field`.
+    '''
+
+    return {'field': field_name, 'status': status, 'selfcal_status': 'skipped',
+            'gaincal_table': None, 'temp_bytes': 0, 'error': error}
+
+
+def _uvstats_field(job):
+    '''
+    uv residual analysis for one calibrator field. See `run_all_uvstats`.
+
+    The `job` dictionary sets the data access:
+
+    * 'field_split': 'shared' uses `job['shared_ms']` for everything; 'full' and
+      'averaged' split this field only from `job['vis']` at full resolution or
+      averaged to one channel per SPW.
+    * 'export_vis' and 'export_datacolumn': the data for the first plotms export.
+      None exports from the per-field split.
+
+    Returns
+    -------
+    result : dict
+        Status of the export ('status') and phase-only selfcal ('selfcal_status'),
+        the gaincal table, and the size of the per-field split.
+    '''
+
+    from casatasks import split, gaincal, applycal
+
+    field_name = job['field_name']
+    out_path = job['out_path']
+
+    result = _uvstats_result(field_name)
+
+    if job['field_split'] == 'shared':
+        field_ms = job['shared_ms']
+    else:
+        field_ms = out_path + '/cal_field_{0}.ms'.format(field_name)
+
+    try:
+        if job['field_split'] != 'shared':
+
+            if os.path.exists(field_ms):
+                os.system('rm -r {0}'.format(field_ms))
+
+            split_kwargs = {}
+            if job['field_split'] == 'averaged':
+                split_kwargs['spw'] = ','.join([str(spw) for spw in job['field_spws']])
+                split_kwargs['width'] = job['field_nchans']
+
+            # Only needed for the selfcal when exporting from the parent MS.
+            if job['export_vis'] is None or job['try_phase_selfcal']:
+                split(vis=job['vis'], field=field_name,
+                      keepflags=True, timebin='0s', outputvis=field_ms, **split_kwargs)
+
+                result['temp_bytes'] = disk_usage_bytes(field_ms)
+
+        if job['export_vis'] is None:
+            export_vis, export_datacolumn = field_ms, 'data'
+        else:
+            export_vis, export_datacolumn = job['export_vis'], job['export_datacolumn']
+
+        plotms_outfile = out_path + '/plotms_amp_uvwave_field_{0}.txt'.format(field_name)
+
+        if not _export_and_plot_uvstats(export_vis, field_name, export_datacolumn, plotms_outfile):
+            return result
+
+        result['status'] = 'done'
+
+        # try phase-only selfcal
+        if job['try_phase_selfcal']:
+
+            gaincal_table = out_path + '/cal_field_{0}.g'.format(field_name)
+
+            try:
+                gaincal(vis=field_ms,
+                        caltable=gaincal_table,
+                        field=field_name, solint='int', refant='', calmode='p')
+                applycal(vis=field_ms,
+                         gaintable=gaincal_table,
+                         field=field_name, calwt=False)
+
+                result['gaincal_table'] = gaincal_table
+
+                plotms_outfile = out_path + '/plotms_amp_uvwave_cal_field_{0}.txt'.format(field_name)
+
+                _export_and_plot_uvstats(field_ms, field_name, 'corrected', plotms_outfile)
+
+                result['selfcal_status'] = 'done'
+
+            except Exception as exc:
+                casalog.post(message='Problem calibrating field {0}: {1}'.format(field_name, exc),
+                             origin='run_all_uvstats')
+                result['selfcal_status'] = 'failed'
+
+    except Exception as exc:
+        casalog.post(message='UV stats failed for field {0}: {1}'.format(field_name, exc),
+                     origin='run_all_uvstats')
+        result['status'] = 'failed'
+        result['error'] = exc
+
+    finally:
+        # Delete the per-field split
+        if job['field_split'] != 'shared' and job['cleanup_calsplit']:
+            os.system("rm -r {}".format(field_ms))
+            os.system("rm -r {}.flagversions".format(field_ms))
+
+    return result
+
+
 def run_all_uvstats(myvis, out_path, uv_threshold=3, uv_nsigma=3,
                     try_phase_selfcal=True,
                     cleanup_calsplit=True,
                     cleanup_phaseselfcal=True,
-                    remake_split=True):
+                    remake_split=True,
+                    cal_ms_mode='split',
+                    nworkers=1):
+    '''
+    Export and plot the amplitude vs. uv-distance residuals for the calibrators.
+
+    `cal_ms_mode` sets how the calibrator data are accessed:
+
+    * 'split': `split` all calibrator fields into `cal_fields.ms`. Used for the
+      plotms exports and the phase-only self-calibration.
+    * 'select': export directly from `myvis` with a field selection on the CORRECTED
+      column, without copying the data. As `gaincal`/`applycal` cannot run on `myvis`
+      without replacing its CORRECTED column, the phase-only self-calibration uses a
+      per-field `split` averaged to one channel per SPW, which is removed after use
+      when `cleanup_calsplit=True`.
+
+    With `nworkers > 1`, the calibrator fields are processed concurrently in worker
+    processes. In 'split' mode, each worker then splits its own field instead of
+    sharing `cal_fields.ms`, as applycal cannot write to one MS from several processes.
+    A failure for one field does not stop the others; the failed fields are raised
+    together at the end.
+
+    Returns
+    -------
+    disk_usage : dict
+        Bytes written for the temporary calibrator MSs ('temp_bytes_written' and
+        'peak_temp_bytes') and the estimated size of the full calibrator split
+        ('split_estimate_bytes'). 'fields' has the per-field results.
+    '''
+
+    if cal_ms_mode not in ['split', 'select']:
+        raise ValueError("cal_ms_mode must be 'split' or 'select'. Given {}".format(cal_ms_mode))
 
     if not os.path.isdir(out_path):
         os.mkdir(out_path)
 
-    from casatasks import split, gaincal, applycal
-    from casaplotms import plotms
+    from casatasks import split
 
     # from taskinit import msmdtool, casalog
     # from taskinit import msmdtool, casalog
@@ -126,106 +465,131 @@ def run_all_uvstats(myvis, out_path, uv_threshold=3, uv_nsigma=3,
     # mymsmd.open(myvis)
     cal_fields = np.unique(mymsmd.fieldsforintent('CALIBRATE*'))
     field_names = mymsmd.namesforfields(cal_fields)
+
+    # Channels per SPW for the averaged per-field selfcal splits.
+    field_spw_nchan = {}
+    for field_id, field_name in zip(cal_fields, field_names):
+        field_spws = mymsmd.spwsforfield(field_id)
+        field_spw_nchan[field_name] = (list(field_spws),
+                                       [int(mymsmd.nchan(spw)) for spw in field_spws])
+
     myms.close()
 
-    # split calibrator visibilities
-    field_str = ','.join([str(f) for f in cal_fields])
+    disk_usage = {'mode': cal_ms_mode,
+                  'temp_bytes_written': 0,
+                  'peak_temp_bytes': 0,
+                  'split_estimate_bytes': estimate_split_bytes(myvis, cal_fields)}
 
     output_cal_ms = out_path + '/cal_fields.ms'
 
-    if os.path.exists(output_cal_ms) and remake_split:
-        os.system('rm -r {0}'.format(output_cal_ms))
+    use_shared_split = cal_ms_mode == 'split' and nworkers <= 1
+
+    if use_shared_split:
+        # split calibrator visibilities
+        field_str = ','.join([str(f) for f in cal_fields])
+
+        if os.path.exists(output_cal_ms) and remake_split:
+            os.system('rm -r {0}'.format(output_cal_ms))
 
-    if not os.path.exists(output_cal_ms):
-        split(vis=myvis, field=field_str,
-              keepflags=True, timebin='0s', outputvis=output_cal_ms)
+        if not os.path.exists(output_cal_ms):
+            split(vis=myvis, field=field_str,
+                  keepflags=True, timebin='0s', outputvis=output_cal_ms)
+
+        shared_bytes = disk_usage_bytes(output_cal_ms)
+        disk_usage['temp_bytes_written'] += shared_bytes
+
+    else:
+        shared_bytes = 0
 
     # There are the flux cals which have built in models in CASA.
     skip_fields = ['3C286', '3C48', '3C147', '3C138']
 
-    gaincal_tables = []
+    jobs = []
 
     for field_name in field_names:
 
         if np.any([field_name in skip1 for skip1 in skip_fields]):
             continue
 
-        plotms_outfile = out_path + '/plotms_amp_uvwave_field_{0}.txt'.format(field_name)
-        casalog.post(message='Exporting from plotms: {0}'.format(plotms_outfile), origin='run_all_uvstats')
-
-        if not os.path.exists(plotms_outfile):
-            plotms(vis=out_path + '/cal_fields.ms',
-                field=field_name, xaxis='UVwave', yaxis='Amp', ydatacolumn='data',
-                averagedata=True, scalar=False,
-                avgchannel='4096', avgtime='1000', avgscan=False,
-                correlation='RR,LL', plotfile=plotms_outfile, showgui=False, overwrite=True)
+        job = {'vis': myvis, 'out_path': out_path, 'field_name': field_name,
+               'try_phase_selfcal': try_phase_selfcal,
+               'cleanup_calsplit': cleanup_calsplit,
+               'shared_ms': output_cal_ms,
+               'field_spws': field_spw_nchan[field_name][0],
+               'field_nchans': field_spw_nchan[field_name][1]}
+
+        if use_shared_split:
+            # The split data are in the DATA column.
+            job.update({'field_split': 'shared',
+                        'export_vis': output_cal_ms, 'export_datacolumn': 'data'})
+        elif cal_ms_mode == 'split':
+            job.update({'field_split': 'full', 'export_vis': None, 'export_datacolumn': None})
         else:
-            casalog.post(message='File {0} already exists. Skipping'.format(plotms_outfile), origin='run_all_uvstats')
+            job.update({'field_split': 'averaged',
+                        'export_vis': myvis, 'export_datacolumn': 'corrected'})
 
-        infile = out_path + '/plotms_amp_uvwave_field_{0}.txt'.format(field_name)
-        casalog.post(message='Analyzing UV stats for {0}'.format(infile), origin='run_all_uvstats')
+        jobs.append(job)
 
-        # Read in txt from plotms
-        dat, median_flux = get_uvdata(infile)
-        # n_scans = len(np.unique(dat['scan']))
-        binned_dat = bin_uvdata(dat)
-        binned_dat_perscan = bin_uvdata_perscan(dat)
-        if binned_dat.shape[1] == 0:
-            continue
-        if binned_dat_perscan.shape[1] == 0:
-            continue
-        plot_uvdata_perscan(binned_dat_perscan, binned_dat, infile, bin_type='combined')
+    field_results = run_uvstats_jobs(jobs, nworkers=nworkers)
 
-        # try phase-only selfcal
-        if try_phase_selfcal:
+    # Delete calibrator split
+    if cleanup_calsplit and use_shared_split:
+        os.system("rm -r {}".format(output_cal_ms))
+        os.system("rm -r {}.flagversions".format(output_cal_ms))
 
-            gaincal_table = out_path + '/cal_field_{0}.g'.format(field_name)
+    # Delete gaincal tables
+    if cleanup_phaseselfcal:
+        for this_result in field_results:
+            if this_result['gaincal_table'] is not None:
+                os.system("rm -r {}".format(this_result['gaincal_table']))
 
-            try:
-                gaincal(vis=output_cal_ms,
-                        caltable=gaincal_table,
-                        field=field_name, solint='int', refant='', calmode='p')
-                applycal(vis=output_cal_ms,
-                         gaintable=gaincal_table,
-                         field=field_name, calwt=False)
+    # Per-field splits are removed after each field when cleaning up. Otherwise they
+    # all stay on disk.
+    field_bytes = [this_result['temp_bytes'] for this_result in field_results]
 
-                gaincal_tables.append(gaincal_table)
+    disk_usage['temp_bytes_written'] += sum(field_bytes)
 
-                plotms_outfile = out_path + '/plotms_amp_uvwave_cal_field_{0}.txt'.format(field_name)
-                casalog.post(message='Exporting from plotms: {0}'.format(plotms_outfile), origin='run_all_uvstats')
+    if len(field_bytes) == 0:
+        disk_usage['peak_temp_bytes'] = shared_bytes
+    elif cleanup_calsplit:
+        disk_usage['peak_temp_bytes'] = shared_bytes + \
+            sum(sorted(field_bytes)[::-1][:max(nworkers, 1)])
+    else:
+        disk_usage['peak_temp_bytes'] = shared_bytes + sum(field_bytes)
 
-                if not os.path.exists(plotms_outfile):
+    casalog.post(message="Calibrator MS mode '{0}': wrote {1:.2f} GB of temporary MSs "
+                 "(peak {2:.2f} GB). A full calibrator split is ~{3:.2f} GB."
+                 .format(cal_ms_mode, disk_usage['temp_bytes_written'] / 1e9,
+                         disk_usage['peak_temp_bytes'] / 1e9,
+                         disk_usage['split_estimate_bytes'] / 1e9),
+                 origin='run_all_uvstats')
 
-                    plotms(vis=output_cal_ms, field=field_name, xaxis='UVwave', yaxis='Amp',
-                        ydatacolumn='corrected', averagedata=True,
-                        scalar=False, avgchannel='4096', avgtime='1000', avgscan=False,
-                        correlation='RR,LL', plotfile=plotms_outfile, showgui=False, overwrite=True)
+    disk_usage['fields'] = [{key: val for key, val in this_result.items() if key != 'error'}
+                            for this_result in field_results]
 
-                else:
-                    casalog.post(message='File {0} already exists. Skipping'.format(plotms_outfile), origin='run_all_uvstats')
+    raise_job_failures({this_result['field']: this_result['error']
+                        for this_result in field_results
+                        if this_result['status'] == 'failed'},
+                       label="UV stats")
 
-                infile = out_path + '/plotms_amp_uvwave_cal_field_{0}.txt'.format(field_name)
-                casalog.post(message='Analyzing UV stats for {0}'.format(infile), origin='run_all_uvstats')
+    return disk_usage
 
-                dat, median_flux = get_uvdata(infile)
-                # n_scans = len(np.unique(dat['scan']))
-                binned_dat = bin_uvdata(dat)
-                binned_dat_perscan = bin_uvdata_perscan(dat)
-                if binned_dat.shape[1] == 0:
-                    continue
-                if binned_dat_perscan.shape[1] == 0:
-                    continue
-                plot_uvdata_perscan(binned_dat_perscan, binned_dat, infile, bin_type='combined')
 
-            except:
-                casalog.post(message='Problem calibrating field {0}'.format(field_name), origin='run_all_uvstats')
+def run_uvstats_jobs(jobs, nworkers=1):
+    '''
+    Run `_uvstats_field` for each calibrator field job, serially or in a pool of
+    worker processes. Errors are kept in the per-field results.
+    '''
 
-    # Delete calibrator split
-    if cleanup_calsplit:
-        os.system("rm -r {}".format(output_cal_ms))
-        os.system("rm -r {}.flagversions".format(output_cal_ms))
+    field_names = [job['field_name'] for job in jobs]
 
-    # Delete gaincal tables
-    if cleanup_phaseselfcal:
-        for gaincal_table in gaincal_tables:
-            os.system("rm -r {}".format(gaincal_table))
+    field_results, failures = run_process_pool(_uvstats_field, jobs, nworkers=nworkers,
+                                               label="UV stats", job_names=field_names)
+
+    # e.g. a worker process that died.
+    for ii, field_name in enumerate(field_names):
+        if field_results[ii] is None:
+            field_results[ii] = _uvstats_result(field_name, status='failed',
+                                                error=failures[field_name])
+
+    return field_results
@@ -1,19 +1,14 @@
 
 import os
+import json
+import glob
 import datetime
 import numpy as np
 
-from casatasks import (tclean, rmtables, exportfits, apparentsens)
+from lband_pipeline.casa_logging import casalog
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
 
-from casatools import logsink
-from casatools import ms
-from casatools import imager
-from casatools import synthesisutils
-from casatools import msmetadata
-
-casalog = logsink()
-
-from lband_pipeline.spw_setup import linerest_dict_GHz
+from lband_pipeline.spw_setup import linerest_dict_GHz, ms_fingerprint
 
 # from lband_pipeline.target_setup import (target_line_range_kms,
 #                                          target_vsys_kms)
@@ -27,6 +22,8 @@ def cleanup_misc_quicklook(filename, remove_residual=True,
     Reduce number of files that aren't needed for QA.
     '''
 
+    from casatasks import rmtables
+
     rmtables(f"{filename}.model")
     rmtables(f"{filename}.sumwt")
     rmtables(f"{filename}.pb")
@@ -42,6 +39,552 @@ def cleanup_misc_quicklook(filename, remove_residual=True,
         rmtables(f"{filename}.image")
 
 
+# Bump when the layout of the cached UV extents changes.
+UV_CACHE_VERSION = 1
+
+# m/s
+_SPEED_OF_LIGHT = 299792458.
+
+# FLAG elements read at once for the UV extents (~32 MB of FLAG per chunk).
+_UV_CHUNK_ELEMENTS = 2**25
+
+
+def uv_cache_filename(myvis):
+    '''
+    Name of the quicklook cell/image size cache stored next to the MS.
+    '''
+    return "{}.quicklook_uv.json".format(myvis.rstrip("/"))
+
+
+def uv_cache_fingerprint(myvis):
+    '''
+    `ms_fingerprint` plus the size and mtime of the main table storage files,
+    which change when the flags are modified.
+    '''
+
+    fingerprint = ms_fingerprint(myvis)
+
+    storage = []
+    for filename in sorted(glob.glob(os.path.join(myvis, "table.f*"))):
+        stat = os.stat(filename)
+        storage.append([os.path.basename(filename), stat.st_size, stat.st_mtime_ns])
+
+    fingerprint['storage'] = storage
+
+    return fingerprint
+
+
+def _empty_uv_cache(myvis):
+    return {'version': UV_CACHE_VERSION,
+            'ms_name': os.path.abspath(myvis),
+            'fingerprint': uv_cache_fingerprint(myvis),
+            'fields': {},
+            'optimum_sizes': {}}
+
+
+def read_uv_cache(myvis, cache_filename=None):
+    '''
+    Read the cached UV extents and image sizes. Returns an empty cache when the
+    file is missing, was made with a different version or MS, or the MS has changed.
+    '''
+
+    if cache_filename is None:
+        cache_filename = uv_cache_filename(myvis)
+
+    empty_cache = _empty_uv_cache(myvis)
+
+    if not os.path.exists(cache_filename):
+        return empty_cache
+
+    try:
+        with open(cache_filename, 'r') as f:
+            cache = json.load(f)
+    except ValueError:
+        return empty_cache
+
+    if cache.get('version') != UV_CACHE_VERSION:
+        return empty_cache
+
+    if cache.get('ms_name') != empty_cache['ms_name']:
+        return empty_cache
+
+    if cache.get('fingerprint') != json.loads(json.dumps(empty_cache['fingerprint'])):
+        return empty_cache
+
+    return cache
+
+
+def write_uv_cache(cache, cache_filename):
+    '''
+    Write the UV extent cache. Written to a temporary file first so a partial
+    cache is never read.
+    '''
+
+    tmp_filename = "{}.tmp".format(cache_filename)
+    with open(tmp_filename, 'w') as f:
+        json.dump(cache, f, indent=1)
+
+    os.replace(tmp_filename, cache_filename)
+
+
+def _chunk_uv_extent(uvw, flag, chan_freqs):
+    '''
+    Largest |u| or |v| in wavelengths of the unflagged channels in a chunk of rows.
+
+    Parameters
+    ----------
+    uvw : np.ndarray
+        UVW in m with shape (3, nrow).
+    flag : np.ndarray
+        FLAG with shape (ncorr, nchan, nrow).
+    chan_freqs : np.ndarray
+        Channel frequencies in Hz.
+
+    Returns
+    -------
+    uvmax : float
+        0 when all data are flagged.
+    '''
+
+    uv_abs = np.maximum(np.abs(uvw[0]), np.abs(uvw[1]))
+
+    if uv_abs.size == 0:
+        return 0.
+
+    chan_freqs = np.asarray(chan_freqs)
+
+    # A channel is usable when any correlation is unflagged.
+    unflagged = ~flag.all(axis=0)
+
+    # Channels from the highest to the lowest frequency. A view for the usual
+    # ascending frequencies.
+    if np.all(np.diff(chan_freqs) >= 0):
+        by_freq = slice(None, None, -1)
+    else:
+        by_freq = np.argsort(chan_freqs)[::-1]
+
+    unflagged = unflagged[by_freq]
+
+    # The highest unflagged frequency in each row sets the largest uv distance.
+    high_chan = unflagged.argmax(axis=0)
+    any_unflagged = unflagged[high_chan, np.arange(unflagged.shape[1])]
+
+    row_freq_max = np.where(any_unflagged, chan_freqs[by_freq][high_chan], 0.)
+
+    return float(np.max(uv_abs * row_freq_max) / _SPEED_OF_LIGHT)
+
+
+def compute_uv_extents(myvis, field_name, spws, chunk_elements=_UV_CHUNK_ELEMENTS):
+    '''
+    Max |u| or |v| extent in wavelengths per SPW for one field, from a single
+    streaming pass over the UVW and FLAG columns of the field.
+
+    Parameters
+    ----------
+    myvis : str
+        MS name.
+    field_name : str
+        Field name. All fields with this name are included.
+    spws : list
+        SPW numbers.
+    chunk_elements : int, optional
+        Number of FLAG elements read at once. The rows per chunk are set from
+        the number of correlations and channels of each SPW.
+
+    Returns
+    -------
+    uv_extents : dict
+        Max extent in wavelengths keyed by the SPW (as a string). 0 when all data
+        are flagged.
+    '''
+
+    from casatools import table
+
+    tb = table()
+
+    tb.open(os.path.join(myvis, "FIELD"))
+    field_ids = np.where(np.asarray(tb.getcol("NAME")) == field_name)[0]
+    tb.close()
+
+    tb.open(os.path.join(myvis, "DATA_DESCRIPTION"))
+    ddid_spws = tb.getcol("SPECTRAL_WINDOW_ID")
+    ddid_pols = tb.getcol("POLARIZATION_ID")
+    tb.close()
+
+    tb.open(os.path.join(myvis, "POLARIZATION"))
+    num_corrs = tb.getcol("NUM_CORR")
+    tb.close()
+
+    tb.open(os.path.join(myvis, "SPECTRAL_WINDOW"))
+    chan_freqs = {int(spw): tb.getcell("CHAN_FREQ", int(spw)) for spw in spws}
+    tb.close()
+
+    uv_extents = {str(spw): 0. for spw in spws}
+
+    if len(field_ids) == 0:
+        return uv_extents
+
+    field_sel = ",".join([str(field_id) for field_id in field_ids])
+
+    tb.open(myvis)
+
+    try:
+        for ddid, spw in enumerate(ddid_spws):
+
+            if str(spw) not in uv_extents:
+                continue
+
+            # FLAG shapes can differ between SPWs.
+            ncorr = int(num_corrs[ddid_pols[ddid]])
+            nchan = len(chan_freqs[int(spw)])
+            chunk_rows = max(1, int(chunk_elements // (ncorr * nchan)))
+
+            # Rows for the field and SPW.
+            sub_tb = tb.query(f"FIELD_ID IN [{field_sel}] && DATA_DESC_ID == {ddid}",
+                              columns="UVW,FLAG")
+
+            try:
+                nrows = sub_tb.nrows()
+
+                if nrows == 0:
+                    continue
+
+                for startrow in range(0, nrows, chunk_rows):
+
+                    nrow = min(chunk_rows, nrows - startrow)
+
+                    uvw = sub_tb.getcol("UVW", startrow=startrow, nrow=nrow)
+                    flag = sub_tb.getcol("FLAG", startrow=startrow, nrow=nrow)
+
+                    uv_extents[str(spw)] = max(uv_extents[str(spw)],
+                                               _chunk_uv_extent(uvw, flag, chan_freqs[int(spw)]))
+            finally:
+                sub_tb.close()
+
+    finally:
+        tb.close()
+
+    return uv_extents
+
+
+def quicklook_image_settings(myvis, field_name, spws,
+                             cache_filename=None,
+                             use_cache=True,
+                             chunk_elements=_UV_CHUNK_ELEMENTS):
+    '''
+    Cell and image sizes for the quicklook images of one field.
+
+    The cell size is the Nyquist sampling of the largest unflagged |u| or |v|
+    extent, as reported by `imager.advise`. The image size covers ~1.2x the
+    primary beam (theta_PB = 45 / nu arcmin) and is rounded up with
+    `synthesisutils.getOptimumSize`.
+
+    The UV extents are computed with `compute_uv_extents` for SPWs not already
+    in the cache next to the MS (see `uv_cache_filename`). The cache is shared by
+    the line and continuum quicklook imaging and is invalidated when the MS or its
+    flags change.
+
+    Returns
+    -------
+    field_settings : dict
+        Keyed by SPW (as a string) with the `uvmax` (wavelengths), `cell` (arcsec),
+        `mean_freq` (GHz) and `imsize`. The cell and image size are 0 when all data
+        are flagged.
+    '''
+
+    from casatools import synthesisutils
+
+    if cache_filename is None:
+        cache_filename = uv_cache_filename(myvis)
+
+    if use_cache:
+        cache = read_uv_cache(myvis, cache_filename=cache_filename)
+    else:
+        cache = _empty_uv_cache(myvis)
+
+    field_cache = cache['fields'].setdefault(field_name, {})
+
+    missing_spws = [spw for spw in spws if str(spw) not in field_cache]
+
+    if len(missing_spws) == 0:
+        return {str(spw): field_cache[str(spw)] for spw in spws}
+
+    casalog.post(f"Computing uv extents for field {field_name} SPWs {missing_spws}")
+
+    from casatools import table
+
+    uv_extents = compute_uv_extents(myvis, field_name, missing_spws,
+                                    chunk_elements=chunk_elements)
+
+    tb = table()
+    tb.open(os.path.join(myvis, "SPECTRAL_WINDOW"))
+    mean_freqs = {str(spw): tb.getcell("CHAN_FREQ", int(spw)).mean() / 1.e9  # Hz to GHz
+                  for spw in missing_spws}
+    tb.close()
+
+    synthutil = synthesisutils()
+
+    for spw in missing_spws:
+
+        uvmax = uv_extents[str(spw)]
+
+        if uvmax == 0.:
+            field_cache[str(spw)] = {'uvmax': 0., 'cell': 0.,
+                                     'mean_freq': mean_freqs[str(spw)], 'imsize': 0}
+            continue
+
+        cell = np.rad2deg(0.5 / uvmax) * 3600.  # arcsec
+
+        # For the image size, we will do an approx scaling was
+        # theta_PB = 45 / nu (arcmin)
+        approx_pbsize = 1.2 * (45. / mean_freqs[str(spw)]) * 60  # arcsec
+        approx_npix = str(int(approx_pbsize / cell))
+
+        if approx_npix not in cache['optimum_sizes']:
+            cache['optimum_sizes'][approx_npix] = int(synthutil.getOptimumSize(int(approx_npix)))
+
+        field_cache[str(spw)] = {'uvmax': uvmax, 'cell': float(cell),
+                                 'mean_freq': float(mean_freqs[str(spw)]),
+                                 'imsize': cache['optimum_sizes'][approx_npix]}
+
+    write_uv_cache(cache, cache_filename)
+
+    return {str(spw): field_cache[str(spw)] for spw in spws}
+
+
+def estimate_tclean_memory_gb(imsize, nchan=1, base_memory_gb=1.0, padding=1.2):
+    '''
+    Rough memory needed for a `tclean` run in GB. Used to schedule the quicklook
+    imaging jobs.
+
+    Counts ~7 float32 image products (image, psf, residual, model, pb, weight, mask)
+    and the two complex64 gridding planes per channel, plus a fixed overhead for the
+    CASA process.
+    '''
+
+    npix = float(imsize)**2 * nchan
+
+    image_bytes = 7 * 4 * npix
+    grid_bytes = 2 * 8 * padding**2 * npix
+
+    return base_memory_gb + (image_bytes + grid_bytes) / 1024.**3
+
+
+def _available_memory_gb(meminfo_file="/proc/meminfo"):
+    '''
+    Available physical memory in GB, or None if it cannot be determined.
+
+    Uses `MemAvailable` from /proc/meminfo, which includes the reclaimable page
+    cache. The free pages from `sysconf` exclude the page cache and are only used
+    when /proc/meminfo is missing.
+    '''
+
+    try:
+        with open(meminfo_file, 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    # Given in kB
+                    return float(line.split()[1]) / 1024.**2
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024.**3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _check_quicklook_exists(this_imagename, export_fits=True):
+    '''
+    Check for an existing quicklook image or a `.empty` marker of a fully flagged SPW.
+    '''
+
+    if export_fits:
+        check_exists = os.path.exists(f"{this_imagename}.image.fits")
+    else:
+        check_exists = os.path.exists(f"{this_imagename}.image")
+
+    return check_exists or os.path.exists(f"{this_imagename}.empty")
+
+
+def _run_quicklook_job(job):
+    '''
+    Run `tclean` for one field and SPW, export to FITS and remove the extra products.
+    Used directly for serial imaging and as the worker for the process pool.
+
+    Parameters
+    ----------
+    job : dict
+        Quicklook imaging job from `quicklook_line_imaging` or
+        `quicklook_continuum_imaging`.
+
+    Returns
+    -------
+    job_timing : dict
+        Start time, wall time and process of the job.
+    '''
+
+    import time
+
+    from casatasks import tclean, rmtables, exportfits
+
+    this_imagename = job['imagename']
+
+    start_time = datetime.datetime.now()
+    t0 = time.perf_counter()
+
+    # Clean up any possible imaging remnants first
+    rmtables(f"{this_imagename}*")
+
+    tclean(**job['tclean_kwargs'])
+
+    if job['export_fits']:
+        exportfits(imagename=f"{this_imagename}.image",
+                   fitsimage=f"{this_imagename}.image.fits",
+                   history=False,
+                   overwrite=True)
+
+    # Clean-up extra imaging products if they are not needed.
+    cleanup_misc_quicklook(this_imagename, remove_psf=True,
+                           remove_residual=job['tclean_kwargs']['niter'] == 0,
+                           remove_image=True if job['export_fits'] else False)
+
+    return {'start': start_time.isoformat(timespec='seconds'),
+            'wall_time_s': time.perf_counter() - t0,
+            'pid': os.getpid()}
+
+
+def write_quicklook_timing_report(job_results, filename):
+    '''
+    Write the per-job timing of the quicklook imaging as a text table.
+    '''
+
+    columns = ['field', 'spw', 'label', 'imsize', 'memory_gb', 'start',
+               'wall_time_s', 'pid', 'status']
+
+    with open(filename, 'w') as out:
+        out.write(" ".join(columns) + "\n")
+
+        for result in job_results:
+            row = []
+            for col in columns:
+                value = result.get(col, 'none')
+                if isinstance(value, float):
+                    value = f"{value:.2f}"
+                row.append(str(value))
+
+            out.write(" ".join(row) + "\n")
+
+
+def run_quicklook_jobs(jobs, nworkers=1, memory_limit_gb=None,
+                       timing_report=None):
+    '''
+    Run quicklook imaging jobs serially or in a bounded pool of worker processes.
+
+    Jobs are started in order while both the number of running jobs is below
+    `nworkers` and the sum of their memory estimates is below `memory_limit_gb`.
+    A job larger than the memory limit is run on its own.
+
+    A failed job is recorded with the status 'failed' and the other jobs still run,
+    in both the serial and parallel modes. A RuntimeError naming the failed jobs is
+    raised once all jobs are finished and the timing report is written.
+
+    Parameters
+    ----------
+    jobs : list
+        Imaging jobs. Each is a dictionary with the `tclean` keywords and
+        a `memory_gb` estimate.
+    nworkers : int, optional
+        Maximum number of concurrent `tclean` processes. Runs serially in the current
+        process when 1.
+    memory_limit_gb : float, optional
+        Memory budget for the running jobs. Defaults to 80% of the available memory.
+    timing_report : str, optional
+        Write a text table of the per-job timing to this file.
+
+    Returns
+    -------
+    job_results : list
+        Job information and timing for each job.
+    '''
+
+    if memory_limit_gb is None and nworkers > 1 and len(jobs) > 1:
+        avail_memory_gb = _available_memory_gb()
+        if avail_memory_gb is not None:
+            memory_limit_gb = 0.8 * avail_memory_gb
+
+        casalog.post(f"Quicklook imaging memory limit is {memory_limit_gb} GB")
+
+    timings, failures = run_process_pool(_run_quicklook_job, jobs,
+                                         nworkers=nworkers,
+                                         label="Quicklook imaging",
+                                         job_names=[job['imagename'] for job in jobs],
+                                         job_memory_gb=[job['memory_gb'] for job in jobs],
+                                         memory_limit_gb=memory_limit_gb)
+
+    job_results = []
+
+    for job, timing in zip(jobs, timings):
+        this_result = {key: job[key] for key in ['field', 'spw', 'label', 'imsize', 'memory_gb']}
+
+        if timing is None:
+            this_result['status'] = 'failed'
+        else:
+            this_result.update(timing)
+            this_result['status'] = 'done'
+
+        job_results.append(this_result)
+
+    if timing_report is not None:
+        write_quicklook_timing_report(job_results, timing_report)
+
+    raise_job_failures(failures, label="Quicklook imaging")
+
+    return job_results
+
+
+def quicklook_apparentsens(tclean_kwargs):
+    '''
+    Expected MFS sensitivity for the field, SPW and image settings of a quicklook job.
+    '''
+
+    from casatasks import rmtables, apparentsens
+
+    out = apparentsens(tclean_kwargs['vis'],
+                       field=tclean_kwargs['field'],
+                       spw=tclean_kwargs['spw'],
+                       cell=tclean_kwargs['cell'],
+                       imsize=tclean_kwargs['imsize'],
+                       specmode='mfs',
+                       weighting='briggs',
+                       robust=0.0)
+
+    # Remove any "apparentsens" image products
+    rmtables(f"{tclean_kwargs['vis']}*.apparentsens.*")
+
+    return out['effSens']
+
+
+def select_target_velrange(velrange, vsys, thisgal=None):
+    '''
+    Pick the velocity range that contains the systemic velocity. `velrange` is
+    one [start, stop] pair or a list of pairs, as lists or tuples (the config
+    registry returns tuples).
+    '''
+
+    # We have a MW foreground window on some targets. Skip this for the galaxy range.
+    if not isinstance(velrange[0], (list, tuple)):
+        return velrange
+
+    for this_range in velrange:
+        if min(this_range) < vsys < max(this_range):
+            return this_range
+
+    # The search for the right velocity range failed
+    raise ValueError(f"Unable to find range with target vsys ({vsys}) from {velrange}."
+                     f" Check the velocity ranges defined in target_setup.py for {thisgal}")
+
+
 def quicklook_line_imaging(myvis, thisgal, linespw_dict,
                            nchan_vel=5,
                            # channel_width_kms=20.,
@@ -51,7 +594,20 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
                            export_fits=True,
                            target_vsys_kms=None,
                            target_line_range_kms=None,
-                           calc_apparentsens=False):
+                           calc_apparentsens=False,
+                           nworkers=1,
+                           memory_limit_gb=None):
+    '''
+    Dirty (or lightly cleaned) cubes of the line SPWs for each target field.
+
+    The field x SPW imaging jobs are run with `run_quicklook_jobs`. Set `nworkers` > 1
+    to run the `tclean` calls in parallel, limited by `memory_limit_gb`. Existing images
+    and `.empty` markers for fully flagged SPWs are skipped unless `overwrite_imaging`
+    is enabled. The timing of each job is written to `quicklook_imaging`.
+    '''
+
+    from casatasks import rmtables
+    from casatools import ms
 
     if target_vsys_kms is None:
         # Will read from config file defined in `config_files/master_config.cfg`
@@ -67,18 +623,8 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
     this_vsys = target_vsys_kms[thisgal]
 
     # Pick our line range based on the HI for all lines.
-    this_velrange = target_line_range_kms[thisgal]['HI']
-    # We have a MW foreground window on some targets. Skip this for the galaxy range.
-    if isinstance(this_velrange[0], list):
-        for this_range in this_velrange:
-            if min(this_range) < this_vsys < max(this_range):
-                this_velrange = this_range
-                break
-
-    # Check that the search for the right velocity range didn't fail
-    if isinstance(this_velrange[0], list):
-        raise ValueError(f"Unable to find range with target vsys ({this_vsys}) from {this_velrange}."
-                         f" Check the velocity ranges defined in target_setup.py for {thisgal}")
+    this_velrange = select_target_velrange(target_line_range_kms[thisgal]['HI'], this_vsys,
+                                           thisgal=thisgal)
 
     # width_vel = channel_width_kms
     # width_vel_str = f"{width_vel}km/s"
@@ -103,8 +649,6 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
     # Select our target fields. We will loop through
     # to avoid the time + memory needed for mosaics.
 
-    synthutil = synthesisutils()
-
     myms = ms()
 
     # if no fields are provided use observe_target intent
@@ -122,6 +666,9 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
     # record expected sensitivity
     exp_sens = {}
 
+    # Imaging jobs for all fields and SPWs
+    jobs = []
+
     t0 = datetime.datetime.now()
 
     # Loop through targets and line SPWs
@@ -137,59 +684,37 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
         cell_size = {}
         imsizes = []
 
-        for thisspw_info in line_spws:
-
-            thisspw, line_name = thisspw_info
+        target_field_label = target_field.replace('-', '_')
 
-            target_field_label = target_field.replace('-', '_')
+        # SPWs still to be imaged.
+        image_spws = []
+        for thisspw, line_name in line_spws:
 
             this_imagename = f"quicklook_imaging/quicklook-{target_field_label}-spw{thisspw}-{line_name}-{myvis}"
 
-            if export_fits:
-                check_exists = os.path.exists(f"{this_imagename}.image.fits")
-            else:
-                check_exists = os.path.exists(f"{this_imagename}.image")
-
-            check_exists = check_exists or os.path.exists(f"{this_imagename}.empty")
-
-            if check_exists and not overwrite_imaging:
+            if _check_quicklook_exists(this_imagename, export_fits=export_fits) and not overwrite_imaging:
                 continue
 
+            image_spws.append([thisspw, this_imagename])
 
-            # Ask for cellsize
-            this_im = imager()
-            this_im.selectvis(vis=myvis, field=target_field, spw=str(thisspw))
-
-            image_settings = this_im.advise()
-            this_im.close()
+        # One pass over the field's UVW and FLAG columns, or the cached values.
+        field_settings = quicklook_image_settings(myvis, target_field,
+                                                  sorted(set([spw for spw, _ in image_spws])))
 
-            # When all data is flagged, uvmax = 0 so cellsize = 0.
-            # Check for that case to avoid tclean failures
-            # if image_settings[2]['value'] == 0.:
-            #     casalog.post(f"All data flagged for {this_imagename}. Skipping")
-            #     continue
+        for thisspw, this_imagename in image_spws:
 
             # NOTE: Rounding will only be reasonable for arcsec units with our L-band setup.
             # Could easily fail on ~<0.1 arcsec cell sizes.
-            cell_size[thisspw] = [image_settings[2]['value'], image_settings[2]['unit']]
+            cell_size[thisspw] = [field_settings[thisspw]['cell'], 'arcsec']
 
             # No point in estimating image size for an empty SPW.
-            if image_settings[2]['value'] == 0.:
+            if field_settings[thisspw]['cell'] == 0.:
                 casalog.post(f"All data flagged for {this_imagename}. Skipping")
                 # Write out an empty file so we skip this one from additional uv checks
                 os.system(f"touch {this_imagename}.empty")
                 continue
 
-            # For the image size, we will do an approx scaling was
-            # theta_PB = 45 / nu (arcmin)
-            this_msmd = msmetadata()
-            this_msmd.open(myvis)
-            mean_freq = this_msmd.chanfreqs(int(thisspw)).mean() / 1.e9 # Hz to GHz
-            this_msmd.close()
-
-            approx_pbsize = 1.2 * (45. / mean_freq) * 60 # arcsec
-            approx_imsize = synthutil.getOptimumSize(int(approx_pbsize / image_settings[2]['value']))
-            imsizes.append(approx_imsize)
+            imsizes.append(field_settings[thisspw]['imsize'])
 
         if len(imsizes) == 0:
             casalog.post(f"{target_field} is fully flagged. Skipping.")
@@ -201,23 +726,15 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
 
             thisspw, line_name = thisspw_info
 
-            casalog.post(f"Quick look imaging of field {target_field} SPW {thisspw}")
-
             target_field_label = target_field.replace('-', '_')
 
             this_imagename = f"quicklook_imaging/quicklook-{target_field_label}-spw{thisspw}-{line_name}-{myvis}"
 
-            if export_fits:
-                check_exists = os.path.exists(f"{this_imagename}.image.fits")
-            else:
-                check_exists = os.path.exists(f"{this_imagename}.image")
-
-            check_exists = check_exists or os.path.exists(f"{this_imagename}.empty")
-
-            if check_exists:
+            if _check_quicklook_exists(this_imagename, export_fits=export_fits):
                 if overwrite_imaging:
                     rmtables(f"{this_imagename}*")
-                    os.remove(f"{this_imagename}.image.fits")
+                    if os.path.exists(f"{this_imagename}.image.fits"):
+                        os.remove(f"{this_imagename}.image.fits")
                 else:
                     casalog.post(f"Found {this_imagename}. Skipping imaging.")
                     continue
@@ -233,60 +750,50 @@ def quicklook_line_imaging(myvis, thisgal, linespw_dict,
             this_nsigma = nsigma
             this_niter = niter
 
-            # Clean up any possible imaging remnants first
-            rmtables(f"{this_imagename}*")
-
-            tclean(vis=myvis,
-                   field=target_field,
-                   spw=str(thisspw),
-                   cell=this_cellsize,
-                   imsize=this_imsize,
-                   specmode='cube',
-                   weighting='briggs',
-                   robust=0.0,
-                   start=start_vel,
-                   width=width_vel_str,
-                   nchan=nchan_vel,
-                   niter=this_niter,
-                   nsigma=this_nsigma,
-                   imagename=this_imagename,
-                   restfreq=f"{linerest_dict_GHz[line_name]}GHz",
-                   pblimit=this_pblim)
-
-            # Estimate the expected sensitivity
-            if calc_apparentsens:
-                out = apparentsens(myvis,
-                                field=target_field,
-                                spw=str(thisspw),
-                                cell=this_cellsize,
-                                imsize=this_imsize,
-                                specmode='mfs',
-                                weighting='briggs',
-                                robust=0.0)
-
-                # Can only do mfs mode here so approx scale to the channel
-                # width used.
-                bandwidth = linespw_dict[int(thisspw)]['bandwidth'] / 1.e9
-                # v / c in km/s
-                width_freq = (width_vel / 3.e5) * linerest_dict_GHz[line_name]
-                chan_to_bandwidth_ratio = width_freq / bandwidth
-
-                exp_sens[f"{target_field_label}-spw{thisspw}"] = \
-                        out['effSens'] * np.sqrt(chan_to_bandwidth_ratio)
-
-                # Remove any "apparentsens" image products
-                rmtables(f"{myvis}*.apparentsens.*")
-
-            if export_fits:
-                exportfits(imagename=f"{this_imagename}.image",
-                           fitsimage=f"{this_imagename}.image.fits",
-                           history=False,
-                           overwrite=True)
-
-            # Clean-up extra imaging products if they are not needed.
-            cleanup_misc_quicklook(this_imagename, remove_psf=True,
-                                    remove_residual=this_niter == 0,
-                                    remove_image=True if export_fits else False)
+            tclean_kwargs = dict(vis=myvis,
+                                 field=target_field,
+                                 spw=str(thisspw),
+                                 cell=this_cellsize,
+                                 imsize=this_imsize,
+                                 specmode='cube',
+                                 weighting='briggs',
+                                 robust=0.0,
+                                 start=start_vel,
+                                 width=width_vel_str,
+                                 nchan=nchan_vel,
+                                 niter=this_niter,
+                                 nsigma=this_nsigma,
+                                 imagename=this_imagename,
+                                 restfreq=f"{linerest_dict_GHz[line_name]}GHz",
+                                 pblimit=this_pblim)
+
+            # Can only do mfs mode in apparentsens so approx scale to the channel
+            # width used.
+            bandwidth = linespw_dict[int(thisspw)]['bandwidth'] / 1.e9
+            # v / c in km/s
+            width_freq = (width_vel / 3.e5) * linerest_dict_GHz[line_name]
+            chan_to_bandwidth_ratio = width_freq / bandwidth
+
+            jobs.append({'field': target_field,
+                         'spw': thisspw,
+                         'label': line_name,
+                         'imagename': this_imagename,
+                         'imsize': this_imsize,
+                         'memory_gb': estimate_tclean_memory_gb(this_imsize, nchan=nchan_vel),
+                         'export_fits': export_fits,
+                         'tclean_kwargs': tclean_kwargs,
+                         'sens_key': f"{target_field_label}-spw{thisspw}",
+                         'sens_scale': np.sqrt(chan_to_bandwidth_ratio)})
+
+    run_quicklook_jobs(jobs, nworkers=nworkers, memory_limit_gb=memory_limit_gb,
+                       timing_report=f"quicklook_imaging/quicklook_line_timing-{myvis}.txt")
+
+    # Estimate the expected sensitivity. apparentsens products are named after the MS,
+    # so these are run one at a time after the imaging.
+    if calc_apparentsens:
+        for job in jobs:
+            exp_sens[job['sens_key']] = \
+                quicklook_apparentsens(job['tclean_kwargs']) * job['sens_scale']
 
     # Save the dictionary of expected sensitivity
     if calc_apparentsens:
@@ -304,11 +811,19 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
                                 overwrite_imaging=False,
                                 export_fits=True,
                                 calc_apparentsens=False,
-                                only_continuum_spws=True):
+                                only_continuum_spws=True,
+                                nworkers=1,
+                                memory_limit_gb=None):
     '''
     Per-SPW MFS, nterm=1, dirty images of the targets
+
+    The field x SPW imaging jobs are run with `run_quicklook_jobs`. Set `nworkers` > 1
+    to run the `tclean` calls in parallel, limited by `memory_limit_gb`.
     '''
 
+    from casatasks import rmtables
+    from casatools import ms
+
     if not os.path.exists("quicklook_imaging"):
         os.mkdir("quicklook_imaging")
 
@@ -327,8 +842,6 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
     # Select our target fields. We will loop through
     # to avoid the time + memory needed for mosaics.
 
-    synthutil = synthesisutils()
-
     myms = ms()
 
     # if no fields are provided use observe_target intent
@@ -346,6 +859,9 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
     # record expected sensitivity
     exp_sens = {}
 
+    # Imaging jobs for all fields and SPWs
+    jobs = []
+
     t0 = datetime.datetime.now()
 
     casalog.post(f"Quicklook imaging of {len(target_fields)} fields: {target_fields}")
@@ -358,59 +874,37 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
         cell_size = {}
         imsizes = []
 
-        for thisspw in continuum_spws:
-
-            casalog.post(f"Quick look imaging of field {target_field} SPW {thisspw}")
+        target_field_label = target_field.replace('-', '_')
 
-            # First check if its already imaged
-            target_field_label = target_field.replace('-', '_')
+        # SPWs still to be imaged.
+        image_spws = []
+        for thisspw in continuum_spws:
 
             this_imagename = f"quicklook_imaging/quicklook-{target_field_label}-spw{thisspw}-continuum-{myvis}"
 
-            if export_fits:
-                check_exists = os.path.exists(f"{this_imagename}.image.fits")
-            else:
-                check_exists = os.path.exists(f"{this_imagename}.image")
-
-            check_exists = check_exists or os.path.exists(f"{this_imagename}.empty")
-
-            if check_exists and not overwrite_imaging:
+            if _check_quicklook_exists(this_imagename, export_fits=export_fits) and not overwrite_imaging:
                 continue
 
-            # Ask for cellsize
-            this_im = imager()
-            this_im.selectvis(vis=myvis, field=target_field, spw=str(thisspw))
+            image_spws.append([thisspw, this_imagename])
 
-            image_settings = this_im.advise()
-            this_im.close()
+        # One pass over the field's UVW and FLAG columns, or the cached values.
+        field_settings = quicklook_image_settings(myvis, target_field,
+                                                  [spw for spw, _ in image_spws])
 
-            # When all data is flagged, uvmax = 0 so cellsize = 0.
-            # Check for that case to avoid tclean failures
-            # if image_settings[2]['value'] == 0.:
-            #     casalog.post(f"All data flagged for {this_imagename}. Skipping")
-            #     continue
+        for thisspw, this_imagename in image_spws:
 
             # NOTE: Rounding will only be reasonable for arcsec units with our L-band setup.
             # Could easily fail on ~<0.1 arcsec cell sizes.
-            cell_size[thisspw] = [image_settings[2]['value'], image_settings[2]['unit']]
+            cell_size[thisspw] = [field_settings[thisspw]['cell'], 'arcsec']
 
             # No point in estimating image size for an empty SPW.
-            if image_settings[2]['value'] == 0.:
+            if field_settings[thisspw]['cell'] == 0.:
                 casalog.post(f"All data flagged for {this_imagename}. Skipping")
                 # Write out an empty file so we skip this one from additional uv checks
                 os.system(f"touch {this_imagename}.empty")
                 continue
 
-            # For the image size, we will do an approx scaling was
-            # theta_PB = 45 / nu (arcmin)
-            this_msmd = msmetadata()
-            this_msmd.open(myvis)
-            mean_freq = this_msmd.chanfreqs(int(thisspw)).mean() / 1.e9 # Hz to GHz
-            this_msmd.close()
-
-            approx_pbsize = 1.2 * (45. / mean_freq) * 60 # arcsec
-            approx_imsize = synthutil.getOptimumSize(int(approx_pbsize / image_settings[2]['value']))
-            imsizes.append(approx_imsize)
+            imsizes.append(field_settings[thisspw]['imsize'])
 
         if len(imsizes) == 0:
             casalog.post(f"{target_field} is fully flagged. Skipping.")
@@ -420,23 +914,15 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
 
         for thisspw in continuum_spws:
 
-            casalog.post(f"Quick look imaging of field {target_field} SPW {thisspw}")
-
             target_field_label = target_field.replace('-', '_')
 
             this_imagename = f"quicklook_imaging/quicklook-{target_field_label}-spw{thisspw}-continuum-{myvis}"
 
-            if export_fits:
-                check_exists = os.path.exists(f"{this_imagename}.image.fits")
-            else:
-                check_exists = os.path.exists(f"{this_imagename}.image")
-
-            check_exists = check_exists or os.path.exists(f"{this_imagename}.empty")
-
-            if check_exists:
+            if _check_quicklook_exists(this_imagename, export_fits=export_fits):
                 if overwrite_imaging:
                     rmtables(f"{this_imagename}*")
-                    os.remove(f"{this_imagename}.image.fits")
+                    if os.path.exists(f"{this_imagename}.image.fits"):
+                        os.remove(f"{this_imagename}.image.fits")
                 else:
                     casalog.post(f"Found {this_imagename}. Skipping imaging.")
                     continue
@@ -452,50 +938,41 @@ def quicklook_continuum_imaging(myvis, contspw_dict,
             this_nsigma = nsigma
             this_niter = niter
 
-            # Clean up any possible imaging remnants first
-            rmtables(f"{this_imagename}*")
-
-            tclean(vis=myvis,
-                   field=target_field,
-                   spw=str(thisspw),
-                   cell=this_cellsize,
-                   imsize=this_imsize,
-                   specmode='mfs',
-                   nterms=1,
-                   weighting='briggs',
-                   robust=0.0,
-                   niter=this_niter,
-                   nsigma=this_nsigma,
-                   fastnoise=True,
-                   imagename=this_imagename,
-                   pblimit=this_pblim)
-
-            # Estimate the expected sensitivity
-            if calc_apparentsens:
-                out = apparentsens(myvis,
-                                field=target_field,
-                                spw=str(thisspw),
-                                cell=this_cellsize,
-                                imsize=this_imsize,
-                                specmode='mfs',
-                                weighting='briggs',
-                                robust=0.0)
-                exp_sens[f"{target_field_label}-spw{thisspw}"] = out['effSens']
-
-                # Remove any "apparentsens" image products
-                rmtables(f"{myvis}*.apparentsens.*")
-
-
-            if export_fits:
-                exportfits(imagename=f"{this_imagename}.image",
-                           fitsimage=f"{this_imagename}.image.fits",
-                           history=False,
-                           overwrite=True)
-
-            # Clean-up extra imaging products if they are not needed.
-            cleanup_misc_quicklook(this_imagename, remove_psf=True,
-                                    remove_residual=this_niter == 0,
-                                    remove_image=True if export_fits else False)
+            tclean_kwargs = dict(vis=myvis,
+                                 field=target_field,
+                                 spw=str(thisspw),
+                                 cell=this_cellsize,
+                                 imsize=this_imsize,
+                                 specmode='mfs',
+                                 nterms=1,
+                                 weighting='briggs',
+                                 robust=0.0,
+                                 niter=this_niter,
+                                 nsigma=this_nsigma,
+                                 fastnoise=True,
+                                 imagename=this_imagename,
+                                 pblimit=this_pblim)
+
+            jobs.append({'field': target_field,
+                         'spw': thisspw,
+                         'label': 'continuum',
+                         'imagename': this_imagename,
+                         'imsize': this_imsize,
+                         'memory_gb': estimate_tclean_memory_gb(this_imsize, nchan=1),
+                         'export_fits': export_fits,
+                         'tclean_kwargs': tclean_kwargs,
+                         'sens_key': f"{target_field_label}-spw{thisspw}",
+                         'sens_scale': 1.})
+
+    run_quicklook_jobs(jobs, nworkers=nworkers, memory_limit_gb=memory_limit_gb,
+                       timing_report=f"quicklook_imaging/quicklook_continuum_timing-{myvis}.txt")
+
+    # Estimate the expected sensitivity. apparentsens products are named after the MS,
+    # so these are run one at a time after the imaging.
+    if calc_apparentsens:
+        for job in jobs:
+            exp_sens[job['sens_key']] = \
+                quicklook_apparentsens(job['tclean_kwargs']) * job['sens_scale']
 
     # Save the dictionary of expected sensitivity
     if calc_apparentsens:
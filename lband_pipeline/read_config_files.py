@@ -1,19 +1,58 @@
-
 '''
 Read the the master_config.cfg to identify the other config filenames.
+
+Each config file is parsed once per process and kept in a registry keyed by the
+file path and its modification time, so the `read_*_cfg` functions only re-read a
+file after it changes. The registry returns read-only views (mappings and tuples).
+Use `thaw_config` for a mutable copy.
 '''
 
 import configparser
-from doctest import master
 import os
+import threading
+from types import MappingProxyType
 
-def get_master_config():
 
-    # Try finding the filename defined in the master_config file.
-    filename = os.path.join(os.path.dirname(__file__), "..", "config_files", "master_config.cfg")
+# Parsed configs keyed by (config kind, absolute path)
+_CONFIG_REGISTRY = {}
+_CONFIG_LOCK = threading.RLock()
+
+
+def freeze_config(value):
+    '''
+    Read-only view of a parsed config: dicts become mappings and lists become tuples.
+    '''
+
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_config(val) for key, val in value.items()})
+
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_config(val) for val in value)
+
+    return value
 
-    if not os.path.exists(filename):
-        raise OSError(f"Unable to find filename: {filename}")
+
+def thaw_config(value):
+    '''
+    Mutable copy of a config from the registry, with dicts and lists. Can be
+    pickled or written to JSON.
+    '''
+
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw_config(val) for key, val in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [thaw_config(val) for val in value]
+
+    return value
+
+
+def _file_signature(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_config_sections(filename):
 
     config = configparser.RawConfigParser()
     # This keeps the case of the line names (e.g. HI vs hi)
@@ -21,134 +60,175 @@ def get_master_config():
 
     config.read(filename)
 
-    return config
+    return {section: dict(config.items(section)) for section in config.sections()}
 
 
-def read_calibrator_absorption_cfg(filename=None):
+def load_config(kind, filename, parse_func):
     '''
-    Read in the config file with absorption velocity ranges defined for calibrator sources.
-
+    Return the parsed config from the registry, parsing the file with
+    `parse_func` only when it is new or has changed since it was last parsed.
 
     Parameters
     ----------
-    filename : str, None
-        Override the filename defined by `calibrators_filename` in the master configuration file.
+    kind : str
+        Name of the config type (e.g. 'calibrator_absorption'). The same file can
+        be parsed differently for each kind.
+    filename : str
+        Config filename.
+    parse_func : function
+        Takes the dictionary of sections and returns the parsed config.
+
+    Returns
+    -------
+    config : `~types.MappingProxyType`
+        Read-only parsed config.
     '''
 
-    master_config = get_master_config()
-
-    if filename is None:
-        filename = os.path.join(os.path.dirname(__file__), "..", "config_files",
-                                master_config['source_configs']['calibrators_filename'])
-
     if not os.path.exists(filename):
         raise OSError(f"Unable to find filename: {filename}")
 
-    config = configparser.RawConfigParser()
-    # This keeps the case of the line names (e.g. HI vs hi)
-    config.optionxform = str
+    key = (kind, os.path.abspath(filename))
 
-    config.read(filename)
+    with _CONFIG_LOCK:
 
-    def get_config_section():
-        if not hasattr(get_config_section, 'section_dict'):
-            get_config_section.section_dict = {}
+        signature = _file_signature(filename)
 
-            for section in config.sections():
-                get_config_section.section_dict[section] = dict(config.items(section))
+        if key in _CONFIG_REGISTRY and _CONFIG_REGISTRY[key][0] == signature:
+            return _CONFIG_REGISTRY[key][1]
 
-        return get_config_section.section_dict
+        out = freeze_config(parse_func(_read_config_sections(filename)))
 
-    out_dict = get_config_section()
+        _CONFIG_REGISTRY[key] = (signature, out)
 
-    # Check expected format
-    for source in out_dict:
-        for line in out_dict[source]:
-            vrange = [float(val) for val in out_dict[source][line].replace(" ", "").split(",")]
-            out_dict[source][line] = vrange
+    return out
 
-    return out_dict
 
+def clear_config_registry():
+    '''
+    Drop all parsed configs.
+    '''
 
+    with _CONFIG_LOCK:
+        _CONFIG_REGISTRY.clear()
 
-def read_target_vsys_cfg(filename=None):
+
+def config_registry_state():
+    '''
+    Picklable copy of the registry to pass to worker processes with `preload_configs`.
     '''
-    Read in the config file with the target Vsys values.
 
+    with _CONFIG_LOCK:
+        return {key: (signature, thaw_config(out))
+                for key, (signature, out) in _CONFIG_REGISTRY.items()}
+
+
+def preload_configs(state=None):
+    '''
+    Fill the registry.
 
     Parameters
     ----------
-    filename : str, None
-        Override the filename defined by `calibrators_filename` in the master configuration file.
+    state : dict, optional
+        Output from `config_registry_state` in another process. The entries are
+        still re-parsed if the file has changed since. When not given, the
+        default source configs from the master configuration file are parsed.
     '''
 
-    master_config = get_master_config()
+    if state is None:
+        read_calibrator_absorption_cfg()
+        read_target_vsys_cfg()
+        read_targets_vrange_cfg()
+        return
 
-    if filename is None:
-        filename = os.path.join(os.path.dirname(__file__), "..", "config_files",
-                                master_config['source_configs']['targets_vsys_filename'])
+    with _CONFIG_LOCK:
+        for key, (signature, out) in state.items():
+            _CONFIG_REGISTRY[key] = (tuple(signature), freeze_config(out))
 
-    if not os.path.exists(filename):
-        raise OSError(f"Unable to find filename: {filename}")
 
-    config = configparser.RawConfigParser()
-    # This keeps the case of the line names (e.g. HI vs hi)
-    config.optionxform = str
+def get_master_config():
 
-    config.read(filename)
+    # Try finding the filename defined in the master_config file.
+    filename = os.path.join(os.path.dirname(__file__), "..", "config_files", "master_config.cfg")
 
-    def get_config_section():
-        if not hasattr(get_config_section, 'section_dict'):
-            get_config_section.section_dict = {}
+    return load_config('master', filename, lambda sections: sections)
 
-            for section in config.sections():
-                get_config_section.section_dict[section] = dict(config.items(section))
 
-        return get_config_section.section_dict
+def _source_config_filename(master_key):
+    '''
+    Config filename given by `master_key` in the master configuration file.
+    '''
+
+    master_config = get_master_config()
 
-    out_dict = get_config_section()
+    return os.path.join(os.path.dirname(__file__), "..", "config_files",
+                        master_config['source_configs'][master_key])
 
-    assert "target_vsys_kms" in out_dict
+
+def _parse_calibrator_absorption(sections):
+
+    out_dict = {}
 
     # Check expected format
-    for source in out_dict['target_vsys_kms']:
-        out_dict['target_vsys_kms'][source] = float(out_dict['target_vsys_kms'][source])
+    for source in sections:
+        out_dict[source] = {}
+        for line in sections[source]:
+            vrange = [float(val) for val in sections[source][line].replace(" ", "").split(",")]
+            out_dict[source][line] = vrange
 
-    return out_dict['target_vsys_kms']
+    return out_dict
 
 
-def read_targets_vrange_cfg(filename=None):
+def read_calibrator_absorption_cfg(filename=None):
+    '''
+    Read in the config file with absorption velocity ranges defined for calibrator sources.
 
-    master_config = get_master_config()
+
+    Parameters
+    ----------
+    filename : str, None
+        Override the filename defined by `calibrators_filename` in the master configuration file.
+    '''
 
     if filename is None:
-        filename = os.path.join(os.path.dirname(__file__), "..", "config_files",
-                                master_config['source_configs']['targets_vrange_filename'])
+        filename = _source_config_filename('calibrators_filename')
 
-    if not os.path.exists(filename):
-        raise OSError(f"Unable to find filename: {filename}")
+    return load_config('calibrator_absorption', filename, _parse_calibrator_absorption)
 
-    config = configparser.RawConfigParser()
-    # Keep case sensitive when reading
-    config.optionxform = str
 
-    config.read(filename)
+def _parse_target_vsys(sections):
 
-    def get_config_section():
-        if not hasattr(get_config_section, 'section_dict'):
-            get_config_section.section_dict = {}
+    assert "target_vsys_kms" in sections
+
+    # Check expected format
+    return {source: float(vsys) for source, vsys in sections['target_vsys_kms'].items()}
 
-            for section in config.sections():
-                get_config_section.section_dict[section] = dict(config.items(section))
 
-        return get_config_section.section_dict
+def read_target_vsys_cfg(filename=None):
+    '''
+    Read in the config file with the target Vsys values.
 
-    out_dict = get_config_section()
+
+    Parameters
+    ----------
+    filename : str, None
+        Override the filename defined by `calibrators_filename` in the master configuration file.
+    '''
+
+    if filename is None:
+        filename = _source_config_filename('targets_vsys_filename')
+
+    return load_config('target_vsys', filename, _parse_target_vsys)
+
+
+def _parse_targets_vrange(sections):
+
+    out_dict = {}
 
     # Check expected format
-    for source in out_dict:
-        for line in out_dict[source]:
-            vrange = [float(val) for val in out_dict[source][line].replace(" ", "").split(",")]
+    for source in sections:
+        out_dict[source] = {}
+        for line in sections[source]:
+            vrange = [float(val) for val in sections[source][line].replace(" ", "").split(",")]
 
             # Make a nested loop in groups of 2. This supportws specifying multiple protected
             # ranges.
@@ -165,3 +245,11 @@ def read_targets_vrange_cfg(filename=None):
             out_dict[source][line] = vrange_pairs
 
     return out_dict
+
+
+def read_targets_vrange_cfg(filename=None):
+
+    if filename is None:
+        filename = _source_config_filename('targets_vrange_filename')
+
+    return load_config('targets_vrange', filename, _parse_targets_vrange)
@@ -0,0 +1,79 @@
+'''
+Make the antenna position correction tables for many MSs from the pre-downloaded
+correction files.
+
+Run as:
+python -m lband_pipeline.run_offline_antpos --data-folder VLA_antcorr_tables \
+    --nworkers 4 --report antpos_report.txt track1.ms track2.ms
+
+or with a file listing one MS per line:
+python -m lband_pipeline.run_offline_antpos --vis-list tracks.txt
+'''
+
+import argparse
+import sys
+
+from lband_pipeline.offline_antposn_corrections import make_offline_antpos_tables
+
+
+def read_report(filename):
+    '''
+    Read the per-MS results back from the report of `make_offline_antpos_tables`.
+    '''
+
+    results = []
+
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith("#") or len(line.strip()) == 0:
+                continue
+
+            vis, status, _, antennas, _ = line.split()
+
+            results.append({'vis': vis, 'status': status,
+                            'antennas': antennas if antennas != "-" else ""})
+
+    return results
+
+
+def print_summary(results):
+    for result in results:
+        print("{0}: {1} {2}".format(result['vis'], result['status'], result['antennas']))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("vis", nargs="*", help="MS names")
+    parser.add_argument("--vis-list", type=str, default=None,
+                        help="Text file with one MS name per line")
+    parser.add_argument("--data-folder", type=str, default="VLA_antcorr_tables")
+    parser.add_argument("--skip-existing", action="store_true")
+    parser.add_argument("--nworkers", type=int, default=1)
+    parser.add_argument("--report", type=str, default="antpos_report.txt")
+    args = parser.parse_args()
+
+    vis_names = list(args.vis)
+
+    if args.vis_list is not None:
+        with open(args.vis_list, 'r') as f:
+            vis_names.extend([line.strip() for line in f
+                              if len(line.strip()) > 0 and not line.startswith("#")])
+
+    if len(vis_names) == 0:
+        parser.error("No MSs given.")
+
+    try:
+        results = make_offline_antpos_tables(vis_names,
+                                             data_folder=args.data_folder,
+                                             skip_existing=args.skip_existing,
+                                             nworkers=args.nworkers,
+                                             report_file=args.report)
+    except RuntimeError as exc:
+        # The report is written before the failed MSs are raised.
+        print_summary(read_report(args.report))
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+
+    print_summary(results)
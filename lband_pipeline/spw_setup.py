@@ -12,11 +12,13 @@ Currently only tested for 20A-346, 13A-213 (NGC6822 track).
 
 '''
 
+import json
 import numpy as np
 import os
 
+from lband_pipeline.casa_logging import casalog
 from lband_pipeline.line_tools.line_flagging import lines_rest2obs
-from lband_pipeline.read_config_files import read_target_vsys_cfg
+from lband_pipeline.read_config_files import read_target_vsys_cfg, thaw_config
 
 # This is all lines in L-band that we care about
 # Most of the RRLs aren't observed, this is just complete
@@ -66,23 +68,229 @@ linerest_dict_GHz = {"HI": 1.420405752,
                      "H149a": 1.96813408,
                      }
 
+# Bump when the layout of the saved SPW dictionary or metadata index changes.
+SPW_INDEX_VERSION = 1
+
+# Subtables that define the SPW/field/scan metadata. A change to any of these
+# invalidates the cached index.
+_FINGERPRINT_TABLES = ["", "SPECTRAL_WINDOW", "FIELD", "STATE",
+                       "DATA_DESCRIPTION", "OBSERVATION"]
+
+
+def spw_index_filename(myvis):
+    '''
+    Name of the metadata index stored next to the MS.
+    '''
+    return "{}.spw_index.json".format(myvis.rstrip("/"))
+
+
+def ms_fingerprint(myvis):
+    '''
+    Modification fingerprint of the MS metadata: the size and mtime of the
+    main table and metadata subtable descriptors.
+    '''
+
+    fingerprint = {}
+
+    for subtable in _FINGERPRINT_TABLES:
+        filename = os.path.join(myvis, subtable, "table.dat")
+
+        if not os.path.exists(filename):
+            fingerprint[subtable] = None
+            continue
+
+        stat = os.stat(filename)
+        fingerprint[subtable] = [stat.st_size, stat.st_mtime_ns]
+
+    return fingerprint
+
+
+def _to_builtin(value):
+    '''
+    Convert numpy scalars to python types for JSON.
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def spw_dict_to_json(spw_dict):
+    '''
+    Convert an SPW dictionary to a JSON-serializable form.
+    '''
+    return {str(int(spwid)): {key: _to_builtin(val) for key, val in spw_dict[spwid].items()}
+            for spwid in spw_dict}
+
+
+def spw_dict_from_json(json_dict):
+    '''
+    Inverse of `spw_dict_to_json`. Restores the integer SPW keys.
+    '''
+    return {int(spwid): dict(json_dict[spwid]) for spwid in json_dict}
+
+
+def save_spw_dict(spw_dict, spwdict_filename="spw_definitions.json"):
+    '''
+    Save the SPW dictionary as versioned JSON.
+    '''
+
+    # Remove existing saved file
+    if os.path.exists(spwdict_filename):
+        os.remove(spwdict_filename)
+
+    with open(spwdict_filename, 'w') as f:
+        json.dump({'version': SPW_INDEX_VERSION,
+                   'spw_dict': spw_dict_to_json(spw_dict)},
+                  f, indent=1)
+
+
+def load_spw_dict(spwdict_filename="spw_definitions.json"):
+    '''
+    Load an SPW dictionary saved with `save_spw_dict`. Older pickled npy files
+    from previous pipeline runs are also supported.
+    '''
+
+    if spwdict_filename.endswith(".npy"):
+        return np.load(spwdict_filename, allow_pickle=True).item()
+
+    with open(spwdict_filename, 'r') as f:
+        saved = json.load(f)
+
+    if saved.get('version') != SPW_INDEX_VERSION:
+        raise ValueError("SPW dictionary {0} has version {1}. Expected {2}."
+                         .format(spwdict_filename, saved.get('version'), SPW_INDEX_VERSION))
+
+    return spw_dict_from_json(saved['spw_dict'])
+
+
+def write_spw_index(myvis, spw_dict, field_metadata, settings,
+                    index_filename=None):
+    '''
+    Write the SPW/field/scan metadata index for `myvis`.
+
+    Parameters
+    ----------
+    myvis : str
+        MS name.
+    spw_dict : dict
+        Output from `create_spw_dict`.
+    field_metadata : dict
+        Field names, target fields and science scans.
+    settings : dict
+        `create_spw_dict` arguments and the rest frequency line list that change
+        the SPW dictionary.
+    index_filename : str, optional
+        Defaults to `spw_index_filename(myvis)`.
+    '''
+
+    if index_filename is None:
+        index_filename = spw_index_filename(myvis)
+
+    index = {'version': SPW_INDEX_VERSION,
+             'ms_name': os.path.abspath(myvis),
+             'fingerprint': ms_fingerprint(myvis),
+             'settings': settings,
+             'fields': field_metadata,
+             'spw_dict': spw_dict_to_json(spw_dict)}
+
+    # Serialize before writing so a TypeError or ValueError from settings that
+    # cannot be stored as JSON leaves no file behind.
+    index_json = json.dumps(index, indent=1)
+
+    # Write to a temporary file first so a partial index is never read.
+    tmp_filename = "{}.tmp".format(index_filename)
+    with open(tmp_filename, 'w') as f:
+        f.write(index_json)
+
+    os.replace(tmp_filename, index_filename)
+
+
+def read_spw_index(myvis, settings=None, index_filename=None):
+    '''
+    Read the metadata index for `myvis`.
+
+    Returns None when the index is missing, was made with a different version,
+    MS or settings, or the MS metadata has changed since it was written.
+    `settings=None` skips the settings check (e.g. to only read field metadata).
+    '''
+
+    if index_filename is None:
+        index_filename = spw_index_filename(myvis)
+
+    if not os.path.exists(index_filename):
+        return None
+
+    try:
+        with open(index_filename, 'r') as f:
+            index = json.load(f)
+    except ValueError:
+        return None
+
+    if index.get('version') != SPW_INDEX_VERSION:
+        return None
+
+    if index.get('ms_name') != os.path.abspath(myvis):
+        return None
+
+    if index.get('fingerprint') != json.loads(json.dumps(ms_fingerprint(myvis))):
+        return None
+
+    if settings is not None:
+        try:
+            settings = json.loads(json.dumps(settings))
+        except (TypeError, ValueError):
+            # Settings that cannot be stored are never cached.
+            return None
+
+        if index.get('settings') != settings:
+            return None
+
+    index['spw_dict'] = spw_dict_from_json(index['spw_dict'])
+
+    return index
+
 
 def create_spw_dict(myvis,
                     continuum_only=False,
                     target_vsys_kms=None,
                     min_continuum_chanwidth_kHz=50,
                     save_spwdict=False,
-                    spwdict_filename="spw_definitions.npy",
-                    allow_failed_line_identification=True):
+                    spwdict_filename="spw_definitions.json",
+                    allow_failed_line_identification=True,
+                    use_cache=True):
     '''
     Create the SPW dict from MS metadata. Split based on continuum and
     use the line dictionary to match line identifications.
+
+    When `use_cache` is enabled, the result is loaded from the metadata index
+    next to the MS (see `spw_index_filename`) if the MS metadata and settings
+    are unchanged. Otherwise the MS is queried and the index is rewritten.
     '''
 
     if target_vsys_kms is None and not continuum_only:
         # Will read from config file defined in `config_files/master_config.cfg`
         target_vsys_kms = read_target_vsys_cfg(filename=None)
 
+    settings = {'continuum_only': continuum_only,
+                'target_vsys_kms': thaw_config(target_vsys_kms),
+                'min_continuum_chanwidth_kHz': min_continuum_chanwidth_kHz,
+                'allow_failed_line_identification': allow_failed_line_identification,
+                'linerest_dict_GHz': dict(linerest_dict_GHz)}
+
+    if use_cache:
+        index = read_spw_index(myvis, settings=settings)
+
+        if index is not None:
+            casalog.post(message="Loading SPW setup from {}".format(spw_index_filename(myvis)),
+                         origin='create_spw_dict')
+
+            spw_dict = index['spw_dict']
+
+            if save_spwdict:
+                save_spw_dict(spw_dict, spwdict_filename)
+
+            return spw_dict
+
     from casatools import ms
 
     myms = ms()
@@ -99,6 +307,11 @@ def create_spw_dict(myvis,
     science_scans = metadata.scansforintent("*TARGET*")
     science_field0 = metadata.fieldsforscan(science_scans[0])[0]
 
+    field_metadata = {'names': [str(name) for name in metadata.fieldnames()],
+                      'target_fields': [str(name) for name in
+                                        metadata.fieldsforintent("*TARGET*", True)],
+                      'science_scans': [int(scan) for scan in science_scans]}
+
     # Our SPW setup is the same for all fields.
     spw_ids = metadata.spwsforfield(science_field0)
 
@@ -222,13 +435,15 @@ def create_spw_dict(myvis,
 
     myms.close()
 
-    if save_spwdict:
-        # Remove existing saved file
-        if os.path.exists(spwdict_filename):
-            os.remove(spwdict_filename)
+    if use_cache:
+        try:
+            write_spw_index(myvis, spw_dict, field_metadata, settings)
+        except (OSError, TypeError, ValueError) as exc:
+            casalog.post(message="Unable to write SPW index for {0}: {1}".format(myvis, exc),
+                         origin='create_spw_dict', priority='WARN')
 
-        # Save a pickled version of the dictionary as a npy file
-        np.save(spwdict_filename, spw_dict)
+    if save_spwdict:
+        save_spw_dict(spw_dict, spwdict_filename)
 
     return spw_dict
 
@@ -12,37 +12,38 @@ smaller range to be flagged instead of the whole galaxy range (e.g., M31).
 '''
 
 from lband_pipeline.read_config_files import read_target_vsys_cfg
+from lband_pipeline.spw_setup import read_spw_index
+from lband_pipeline.ms_metadata import read_ms_metadata, fieldsforintent
 
-from casatools import logsink
-
-casalog = logsink()
+from lband_pipeline.casa_logging import casalog
 
 # Function to identify the target from field names in the MS
 
-def identify_target(vis, fields=None, raise_missing_target=True):
+def identify_target(vis, fields=None, raise_missing_target=True, metadata_backend=None):
     '''
     Identify the target in the MS that matches target_line_range_kms keys.
+
+    The target fields are read with `metadata_backend` (see `read_ms_metadata`)
+    when they are not given or in the metadata index.
     '''
 
     if fields is None:
         fields = []
 
-    from casatools import ms
-
-    myms = ms()
+    # Use the target fields from the metadata index when it is up-to-date.
+    if len(fields) < 1:
+        index = read_spw_index(vis)
+        if index is not None:
+            fields = index['fields']['target_fields']
 
     # if no fields are provided use observe_target intent
     # I saw once a calibrator also has this intent so check carefully
     # mymsmd.open(vis)
-    myms.open(vis)
-
-    mymsmd = myms.metadata()
-
     if len(fields) < 1:
-        fields = mymsmd.fieldsforintent("*TARGET*", True)
+        # Read from the MS tables directly so this does not need the CASA ms tool.
+        ms_metadata = read_ms_metadata(vis, backend=metadata_backend)
 
-    mymsmd.close()
-    myms.close()
+        fields = fieldsforintent(ms_metadata, "*TARGET*", asnames=True)
 
     if len(fields) < 1:
         casalog.post("ERROR: no fields given to identify.")
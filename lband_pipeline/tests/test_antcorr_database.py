@@ -0,0 +1,235 @@
+'''
+Tests for the indexed antenna position correction database.
+'''
+
+import os
+import numpy as np
+import pytest
+
+from lband_pipeline.antcorr_database import (load_antcorr_database,
+                                             clear_antcorr_cache,
+                                             read_antcorr_tables,
+                                             lookup_antenna_offsets,
+                                             antcorr_offsets)
+
+
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN',
+          'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+
+def correct_ant_posns_loop(data_folder, last_year, ant_num_stas, obs_time):
+    '''
+    The original text search and correction loop in `correct_ant_posns`.
+    '''
+
+    ant_num_stas = [list(ant_num_sta) + [0.0, 0.0, 0.0, False] for ant_num_sta in ant_num_stas]
+
+    correction_lines = []
+    for year in range(2010, last_year + 1):
+        with open(data_folder + "/" + str(year) + ".txt", 'r') as f:
+            lines = f.read()
+
+        for correction_line in lines.split('\n'):
+            if len(correction_line) and correction_line[0] != '<' and correction_line[0] != ';':
+                for month in MONTHS:
+                    if month in correction_line:
+                        correction_lines.append(str(year) + ' ' + correction_line)
+                        break
+
+    corrections_list = []
+    for correction_line in correction_lines:
+        correction_line_fields = correction_line.split()
+        if (len(correction_line_fields) > 9):
+            [c_year, moved_date, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
+            i_month = 1
+            for month in MONTHS:
+                if (moved_date.find(month) >= 0):
+                    break
+                i_month = i_month + 1
+            moved_time = 10000 * int(c_year) + 100 * i_month + int(moved_date[3:])
+        else:
+            [c_year, obs_date, put_date, put_time_str, ant, pad, Bx, By, Bz] = correction_line_fields
+            moved_time = 0
+        s_put = put_date[:3]
+        i_month = 1
+        for month in MONTHS:
+            if (s_put.find(month) >= 0):
+                break
+            i_month = i_month + 1
+        put_time = 10000 * int(c_year) + 100 * i_month + int(put_date[3:])
+        [put_hr, put_min] = put_time_str.split(':')
+        put_time += (int(put_hr) / 24.0 + int(put_min) / 1440.0)
+        corrections_list.append([moved_time, put_time, int(ant), pad,
+                                 float(Bx), float(By), float(Bz)])
+
+    for [moved_time, put_time, ant, pad, Bx, By, Bz] in corrections_list:
+        ant_ind = -1
+        for ii in range(len(ant_num_stas)):
+            ant_num_sta = ant_num_stas[ii]
+            if (ant == ant_num_sta[0]):
+                ant_ind = ii
+                break
+        ant_num_sta = ant_num_stas[ant_ind]
+        if (moved_time):
+            if (moved_time > obs_time):
+                ant_num_sta[6] = True
+            else:
+                ant_num_sta[3] = 0.0
+                ant_num_sta[4] = 0.0
+                ant_num_sta[5] = 0.0
+        if ((put_time > obs_time) and (not ant_num_sta[6]) and (pad == ant_num_sta[2])):
+            ant_num_sta[3] += Bx
+            ant_num_sta[4] += By
+            ant_num_sta[5] += Bz
+
+    return [ant_num_sta[3:6] for ant_num_sta in ant_num_stas]
+
+
+PADS = ['W08', 'E16', 'N24', 'W72', 'MAS']
+
+
+def write_antcorr_tables(data_folder, first_year=2010, last_year=2013, nant=8,
+                         nline=40, seed=0):
+    '''
+    Yearly files in the format of the VLA baseline corrections page.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(data_folder, exist_ok=True)
+
+    for year in range(first_year, last_year + 1):
+        lines = ["<html><pre>",
+                 ";MOVED  OBSERVED  Put_In_ MC(IAT) ANT PAD  Bx  By  Bz",
+                 ""]
+
+        for month in sorted(rng.choice(12, nline)):
+            day = rng.integers(1, 29)
+            obs_date = "{0}{1:02d}".format(MONTHS[month], day)
+            put_date = "{0}{1:02d}".format(MONTHS[min(month + 1, 11)], rng.integers(1, 29))
+            put_time = "{0:02d}:{1:02d}".format(rng.integers(0, 24), rng.integers(0, 60))
+            ant = rng.integers(1, nant + 1)
+            pad = PADS[rng.integers(0, len(PADS))]
+            offsets = " ".join(["{:.4f}".format(val) for val in rng.normal(0, 0.01, 3)])
+
+            if rng.random() < 0.2:
+                moved_date = "{0}{1:02d}".format(MONTHS[month], max(day - 2, 1))
+                lines.append("{0} {1} {2} {3} {4} {5} {6}".format(moved_date, obs_date, put_date,
+                                                                  put_time, ant, pad, offsets))
+            else:
+                lines.append("{0} {1} {2} {3} {4} {5}".format(obs_date, put_date, put_time,
+                                                              ant, pad, offsets))
+
+        lines.append("</pre></html>")
+
+        with open(os.path.join(data_folder, "{}.txt".format(year)), 'w') as f:
+            f.write("\n".join(lines))
+
+
+def obs_times(first_year=2010, last_year=2013):
+    times = [10000 * year + 100 * month + day + frac
+             for year in range(first_year, last_year + 1)
+             for month in range(1, 13) for day in [1, 15, 28]
+             for frac in [0., 0.5]]
+    # Before and after all corrections
+    return [20090101.] + times + [20991231.]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_offsets_match_loop(tmp_path, seed):
+
+    data_folder = str(tmp_path / "VLA_antcorr_tables")
+    write_antcorr_tables(data_folder, seed=seed)
+
+    clear_antcorr_cache()
+    database = load_antcorr_database(data_folder, last_year=2013)
+
+    rng = np.random.default_rng(seed)
+
+    # Antenna 8 is missing and 3 is repeated, so corrections fall through to the last antenna.
+    ant_num_stas = [[ant, "ea{:02d}".format(ant), PADS[rng.integers(0, len(PADS))]]
+                    for ant in [1, 2, 3, 4, 5, 6, 3, 7]]
+
+    for obs_time in obs_times():
+        out = antcorr_offsets(database, ant_num_stas, obs_time)
+        out_loop = correct_ant_posns_loop(data_folder, 2013, ant_num_stas, obs_time)
+
+        # Exact, including the summation order.
+        assert out == out_loop
+
+    # All antennas present
+    ant_num_stas = [[ant, "ea{:02d}".format(ant), PADS[ant % len(PADS)]] for ant in range(1, 9)]
+    for obs_time in obs_times():
+        assert antcorr_offsets(database, ant_num_stas, obs_time) == \
+            correct_ant_posns_loop(data_folder, 2013, ant_num_stas, obs_time)
+
+
+def test_unmatched_antennas_skipped(tmp_path):
+
+    data_folder = str(tmp_path / "VLA_antcorr_tables")
+    write_antcorr_tables(data_folder, last_year=2011)
+
+    database = load_antcorr_database(data_folder, last_year=2011)
+
+    ant_num_stas = [[ant, "ea{:02d}".format(ant), 'W08'] for ant in [1, 2]]
+
+    for obs_time in obs_times(last_year=2011):
+        out = antcorr_offsets(database, ant_num_stas, obs_time, legacy_unmatched=False)
+
+        assert out == [lookup_antenna_offsets(database, ant, 'W08', obs_time)
+                       for ant in [1, 2]]
+        assert out[0] == correct_ant_posns_loop(data_folder, 2011, ant_num_stas, obs_time)[0]
+
+
+def test_moves_and_resets(tmp_path):
+
+    data_folder = str(tmp_path / "VLA_antcorr_tables")
+    os.makedirs(data_folder)
+
+    with open(os.path.join(data_folder, "2010.txt"), 'w') as f:
+        f.write("\n".join([";header with JAN in it",
+                           "<pre>",
+                           "FEB01 FEB10 12:00 1 W08 0.1 0.2 0.3",
+                           "MAR05 MAR01 MAR20 06:00 1 W08 0.01 0.02 0.03",
+                           "APR01 APR10 00:00 1 W08 1.0 1.0 1.0",
+                           "APR01 APR10 00:00 1 E16 5.0 5.0 5.0"]))
+
+    database = load_antcorr_database(data_folder, last_year=2010)
+
+    assert len(database['corrections']) == 4
+    assert database['corrections'][1][0] == 20100305
+
+    ant_num_stas = [[1, 'ea01', 'W08']]
+
+    # Before all corrections, the move is after the observation so the later ones are skipped.
+    assert antcorr_offsets(database, ant_num_stas, 20100101.)[0] == [0.1, 0.2, 0.3]
+    # After the move, the offsets are reset
+    assert antcorr_offsets(database, ant_num_stas, 20100306.)[0] == [0.01 + 1.0, 0.02 + 1.0, 0.03 + 1.0]
+    # After the put time of the last correction
+    assert antcorr_offsets(database, ant_num_stas, 20100411.)[0] == [0.0, 0.0, 0.0]
+
+
+def test_cache_invalidated_on_change(tmp_path):
+
+    data_folder = str(tmp_path / "VLA_antcorr_tables")
+    write_antcorr_tables(data_folder, last_year=2011)
+
+    clear_antcorr_cache()
+
+    database = load_antcorr_database(data_folder, last_year=2011)
+    assert load_antcorr_database(data_folder, last_year=2011) is database
+
+    filename = os.path.join(data_folder, "2011.txt")
+    with open(filename, 'a') as f:
+        f.write("\nDEC01 DEC20 00:00 1 W08 0.5 0.5 0.5")
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    new_database = load_antcorr_database(data_folder, last_year=2011)
+
+    assert new_database is not database
+    assert new_database['corrections'] == read_antcorr_tables(data_folder, last_year=2011)
+    assert len(new_database['corrections']) == len(database['corrections']) + 1
+
+    with pytest.raises(FileNotFoundError):
+        load_antcorr_database(data_folder, last_year=2012)
@@ -0,0 +1,354 @@
+'''
+Tests for the vectorized flagging summary statistics.
+'''
+
+import os
+import sys
+import tracemalloc
+import types
+
+import numpy as np
+import pytest
+
+from lband_pipeline.qa_plotting import flagging_summary_plots
+from lband_pipeline.qa_plotting.flagging_summary_plots import (create_baseline_dict,
+                                                               baseline_uvdist_modes,
+                                                               match_flags_to_uvdist,
+                                                               match_counts_to_uvdist,
+                                                               accumulate_baseline_flags,
+                                                               accumulate_channel_flags,
+                                                               channel_flag_fractions,
+                                                               flagdata_channel_fractions,
+                                                               sum_field_channel_counts,
+                                                               flag_match_baseline,
+                                                               bin_statistics)
+
+
+def create_baseline_dict_loop(antenna_names, antdata):
+    '''
+    The original row-by-row `create_baseline_dict`.
+    '''
+
+    baseline_pairs = {}
+    i = 0
+    while i <= antdata['antenna1'].max():
+        j = i + 1
+        while j <= antdata['antenna2'].max():
+            temp_dict_key = str(antenna_names[i]) + '&&' + str(antenna_names[j])
+            baseline_pairs[temp_dict_key] = []
+            j += 1
+        i += 1
+    i = 0
+    while i < len(antdata['antenna1']):
+        temp_dict_key = str(antenna_names[antdata['antenna1'][i]]) + '&&' + str(antenna_names[antdata['antenna2'][i]])
+        baseline_pairs[temp_dict_key].append(antdata['uvdist'][i])
+        i += 1
+
+    return baseline_pairs
+
+
+def bin_statistics_loop(dpoints, nbins):
+    '''
+    The original nested loop `bin_statistics`.
+    '''
+
+    binned = [[], []]
+    i = 0
+    width = int(1.05 * max(dpoints[0]) / nbins)
+
+    while i < nbins:
+        j = 0
+        temp_flg, temp_total = 0., 0.
+        while j < len(dpoints[0]):
+            if dpoints[0][j] >= (i * width) and dpoints[0][j] <= ((i + 1) * width):
+                temp_flg += dpoints[1][j][0]
+                temp_total += dpoints[1][j][1]
+            j += 1
+        binned[0].append(i * width)
+        if temp_total == 0:
+            binned[1].append(0)
+        else:
+            binned[1].append(temp_flg / temp_total)
+        i += 1
+
+    return np.array(binned), width
+
+
+def make_antdata(seed=0, nant=10, nrow=4000):
+
+    rng = np.random.default_rng(seed)
+
+    ant1 = rng.integers(0, nant - 1, nrow)
+    ant2 = ant1 + 1 + (rng.integers(0, nant, nrow) % (nant - 1 - ant1))
+
+    # Remove one baseline entirely and keep a single row for another.
+    missing = (ant1 == 0) & (ant2 == 1)
+    single = np.where((ant1 == 1) & (ant2 == 2))[0][1:]
+    keep = ~missing
+    keep[single] = False
+    ant1, ant2 = ant1[keep], ant2[keep]
+
+    base_length = 100. * (ant2 - ant1) + 10. * ant1
+    uvdist = base_length * rng.uniform(0.5, 1.0, ant1.size)
+
+    antenna_names = np.array(["ea{:02d}".format(ant + 1) for ant in range(nant)])
+
+    antdata = {'antenna1': ant1, 'antenna2': ant2, 'uvdist': uvdist}
+
+    flgdata = {}
+    for ii in range(nant - 1):
+        for jj in range(ii + 1, nant):
+            total = int(rng.integers(100, 1000))
+            flgdata["{0}&&{1}".format(antenna_names[ii], antenna_names[jj])] = \
+                {'flagged': int(rng.integers(0, total)), 'total': total}
+
+    return antenna_names, antdata, flgdata
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_baseline_dict_matches_loop(seed):
+
+    antenna_names, antdata, flgdata = make_antdata(seed)
+
+    base_dict = create_baseline_dict(antenna_names, antdata)
+    base_dict_loop = create_baseline_dict_loop(antenna_names, antdata)
+
+    assert list(base_dict.keys()) == list(base_dict_loop.keys())
+    for key in base_dict_loop:
+        assert base_dict[key] == base_dict_loop[key]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_uvdist_modes_match_histogram(seed):
+
+    antenna_names, antdata, flgdata = make_antdata(seed)
+
+    datamatch = flag_match_baseline(flgdata,
+                                    create_baseline_dict_loop(antenna_names, antdata))
+
+    uvdist_modes = baseline_uvdist_modes(antdata, len(antenna_names))
+    uvdists, flag_counts = match_flags_to_uvdist(flgdata, antenna_names, uvdist_modes)
+
+    np.testing.assert_array_equal(uvdists, np.array(datamatch[0]))
+    np.testing.assert_array_equal(flag_counts, np.array(datamatch[1]))
+
+    # The missing baseline is the empty histogram in [0, 1]
+    assert uvdists[0] == 0.025
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bin_statistics_matches_loop(seed):
+
+    antenna_names, antdata, flgdata = make_antdata(seed)
+
+    datamatch = flag_match_baseline(flgdata,
+                                    create_baseline_dict_loop(antenna_names, antdata))
+
+    for nbins in [5, 25]:
+        binned, width = bin_statistics(datamatch, nbins)
+        binned_loop, width_loop = bin_statistics_loop(datamatch, nbins)
+
+        assert width == width_loop
+        np.testing.assert_array_equal(binned, binned_loop)
+
+
+def test_bin_statistics_edges():
+
+    # Points on the inner edges count in both bins. Those past the last bin are dropped.
+    uvdists = [0., 10., 20., 25., 40., 100., 105.]
+    counts = [[1, 2], [3, 4], [5, 6], [7, 8], [0, 10], [2, 2], [1, 1]]
+
+    for nbins in [5, 10, 20, 200]:
+        binned, width = bin_statistics([uvdists, counts], nbins)
+        binned_loop, width_loop = bin_statistics_loop([uvdists, counts], nbins)
+
+        assert width == width_loop
+        np.testing.assert_array_equal(binned, binned_loop)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_flag_column_counts_match_summary(seed):
+
+    antenna_names, antdata, _ = make_antdata(seed)
+    nant = len(antenna_names)
+
+    rng = np.random.default_rng(seed)
+
+    ncorr, nchan = 2, 8
+    ant1, ant2 = antdata['antenna1'], antdata['antenna2']
+    flag = rng.random((ncorr, nchan, ant1.size)) > 0.6
+
+    # The flagdata 'baseline' summary for the baselines with data.
+    flgdata = {}
+    for a1, a2 in sorted(set(zip(ant1, ant2))):
+        rows = (ant1 == a1) & (ant2 == a2)
+        flgdata["{0}&&{1}".format(antenna_names[a1], antenna_names[a2])] = \
+            {'flagged': int(flag[..., rows].sum()), 'total': int(flag[..., rows].size)}
+
+    # Accumulate in uneven chunks
+    counts = {'flagged': np.zeros(nant * nant), 'total': np.zeros(nant * nant)}
+    for rows in np.array_split(np.arange(ant1.size), [7, 1000, 1001]):
+        accumulate_baseline_flags(counts, ant1[rows], ant2[rows], flag[..., rows], nant)
+
+    uvdist_modes = baseline_uvdist_modes(antdata, nant)
+
+    uvdists, flag_counts = match_counts_to_uvdist(counts, uvdist_modes)
+    uvdists_summ, flag_counts_summ = match_flags_to_uvdist(flgdata, antenna_names, uvdist_modes)
+
+    np.testing.assert_array_equal(uvdists, uvdists_summ)
+    np.testing.assert_array_equal(flag_counts, flag_counts_summ)
+
+    np.testing.assert_array_equal(bin_statistics([uvdists, flag_counts], 25)[0],
+                                  bin_statistics([uvdists_summ, flag_counts_summ], 25)[0])
+
+
+def test_channel_flag_counts_match_summary():
+
+    rng = np.random.default_rng(4)
+
+    ncorr, nchan, nrow = 2, 32, 3000
+
+    spw_flags = {0: rng.random((ncorr, nchan, nrow)) > 0.7,
+                 3: rng.random((ncorr, nchan, nrow)) > 0.2}
+    spw_fields = {0: rng.integers(0, 3, nrow),
+                  3: rng.choice([0, 2], nrow)}
+
+    counts = {}
+    for spw in spw_flags:
+        for rows in np.array_split(np.arange(nrow), [11, 2000]):
+            accumulate_channel_flags(counts, spw_fields[spw][rows], spw_flags[spw][..., rows], spw)
+
+    assert sorted(counts.keys()) == [0, 1, 2]
+    assert sorted(counts[1].keys()) == [0]
+
+    for field_id in counts:
+
+        # The flagdata 'spw:channel' summary for this field.
+        flag_dict = {'spw:channel': {}}
+        for spw in counts[field_id]:
+            rows = spw_fields[spw] == field_id
+            for chan in range(nchan):
+                this_flags = spw_flags[spw][:, chan, rows]
+                flag_dict['spw:channel'][f"{spw}:{chan}"] = {'flagged': int(this_flags.sum()),
+                                                             'total': int(this_flags.size)}
+
+            np.testing.assert_array_equal(channel_flag_fractions(counts[field_id][spw], nchan),
+                                          flagdata_channel_fractions(flag_dict, spw, nchan))
+
+    spw_counts = sum_field_channel_counts(counts)
+
+    np.testing.assert_array_equal(spw_counts[0]['flagged'], spw_flags[0].sum(axis=(0, 2)))
+    np.testing.assert_array_equal(spw_counts[3]['total'], np.full(nchan, ncorr * nrow))
+
+    # No data for the SPW
+    assert np.isnan(channel_flag_fractions(None, nchan)).all()
+
+
+def test_channel_flag_counts_contiguous_fields():
+
+    rng = np.random.default_rng(5)
+
+    ncorr, nchan, nrow = 4, 512, 600
+
+    flag = rng.random((ncorr, nchan, nrow)) > 0.6
+    field_ids = np.repeat([2, 0, 5], nrow // 3)
+
+    tracemalloc.start()
+    counts = accumulate_channel_flags({}, field_ids, flag, 1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Contiguous fields are summed from views of the FLAG chunk.
+    assert peak < 0.1 * flag.nbytes
+
+    # Same counts as with the fields interleaved.
+    order = rng.permutation(nrow)
+    counts_shuffled = accumulate_channel_flags({}, field_ids[order], flag[..., order], 1)
+
+    assert sorted(counts.keys()) == [0, 2, 5]
+    for field_id in counts:
+        rows = field_ids == field_id
+        np.testing.assert_array_equal(counts[field_id][1]['flagged'],
+                                      flag[..., rows].sum(axis=(0, 2)))
+        np.testing.assert_array_equal(counts[field_id][1]['total'], np.full(nchan, ncorr * 200))
+        np.testing.assert_array_equal(counts_shuffled[field_id][1]['flagged'],
+                                      counts[field_id][1]['flagged'])
+
+
+class FakeMetadata:
+
+    def __init__(self, field_spws):
+        self.field_spws = field_spws
+
+    def antennanames(self):
+        return ['ea01', 'ea02', 'ea03']
+
+    def fieldsforintent(self, intent):
+        return np.arange(len(self.field_spws))
+
+    def fieldnames(self):
+        return ['J0137+3309', 'J0542+4951']
+
+    def spwsforfield(self, field_id):
+        return np.array(self.field_spws[field_id])
+
+    def close(self):
+        pass
+
+
+class FakeMS:
+
+    field_spws = {}
+
+    def open(self, vis):
+        pass
+
+    def metadata(self):
+        return FakeMetadata(self.field_spws)
+
+    def selectinit(self):
+        pass
+
+    def selectchannel(self, *args):
+        pass
+
+    def getdata(self, items):
+        return {'antenna1': np.array([0, 0, 1]), 'antenna2': np.array([1, 2, 2]),
+                'uvdist': np.array([100., 200., 150.])}
+
+    def close(self):
+        pass
+
+
+def test_uvdist_data_fields_with_different_spws(tmp_path, monkeypatch):
+
+    # The second field has no data in SPW 1 and a third SPW.
+    FakeMS.field_spws = {0: [0, 1], 1: [0, 2]}
+
+    fake_casatools = types.ModuleType('casatools')
+    fake_casatools.ms = FakeMS
+    fake_casatasks = types.ModuleType('casatasks')
+    fake_casatasks.flagdata = None
+
+    monkeypatch.setitem(sys.modules, 'casatools', fake_casatools)
+    monkeypatch.setitem(sys.modules, 'casatasks', fake_casatasks)
+
+    nant = 3
+
+    def fake_counts(myvis, field_ids, nant, nworkers=1, chunk_elements=None):
+        counts = {}
+        for field_id in field_ids:
+            counts[field_id] = {spw: {'flagged': np.full(nant * nant, 1.),
+                                      'total': np.full(nant * nant, 4.)}
+                                for spw in FakeMS.field_spws[field_id]}
+        return counts
+
+    monkeypatch.setattr(flagging_summary_plots, 'all_field_baseline_flag_counts', fake_counts)
+
+    flagging_summary_plots.make_flagsummary_uvdist_data("track.ms", nbin=5,
+                                                        output_folder=str(tmp_path))
+
+    for field, spws in [('J0137+3309', [0, 1]), ('J0542+4951', [0, 2])]:
+        out = np.loadtxt(os.path.join(tmp_path, f"field_{field}_flagfrac_uvdist.txt"),
+                         dtype=str)
+        assert sorted(set(out[:, 1].astype(int))) == spws
@@ -0,0 +1,66 @@
+'''
+Check that importing the pipeline modules does not import CASA, matplotlib or
+scipy. These are imported when first used.
+'''
+
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY_MODULES = ['casatools', 'casatasks', 'casaplotms', 'matplotlib', 'scipy', 'pipeline']
+
+LIGHT_MODULES = ['lband_pipeline.spw_setup',
+                 'lband_pipeline.line_tools',
+                 'lband_pipeline.qa_plotting',
+                 'lband_pipeline.quicklook_imaging',
+                 'lband_pipeline.target_setup',
+                 'lband_pipeline.flagging_tools',
+                 'lband_pipeline.ms_split_tools',
+                 'lband_pipeline.read_config_files',
+                 'lband_pipeline.ms_metadata',
+                 'lband_pipeline.process_pool']
+
+
+def import_times(module_name):
+    '''
+    Per-module import times in microseconds from `python -X importtime`.
+    '''
+
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                          "import {}".format(module_name)],
+                         capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+
+@pytest.mark.parametrize('module_name', LIGHT_MODULES)
+def test_no_heavy_imports(module_name):
+
+    times = import_times(module_name)
+
+    assert module_name in times
+
+    heavy = [name for name in times if name.split(".")[0] in HEAVY_MODULES]
+
+    assert heavy == []
+
+
+def test_pure_helpers_import_time():
+
+    times = import_times('lband_pipeline.spw_setup')
+
+    # numpy dominates. Without CASA this is well under a second.
+    numpy_us = times['numpy'][1]
+    total_us = times['lband_pipeline.spw_setup'][1]
+
+    assert total_us - numpy_us < 1e6
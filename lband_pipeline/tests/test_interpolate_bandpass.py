@@ -0,0 +1,176 @@
+'''
+Compare the batched bandpass gap interpolation to the per-channel polyfit loop.
+'''
+
+import tracemalloc
+
+import numpy as np
+import numpy.testing as npt
+
+from lband_pipeline.line_tools.line_tools import (interpolate_bandpass_gaps,
+                                                  interpolate_bandpass_spws,
+                                                  masked_savgol_fit,
+                                                  rolling_window)
+
+
+def make_bandpass_cube(npol=2, nchan=256, nant=4, gap=(100, 120), nedge=5, seed=0):
+    '''
+    Synthetic CPARAM/FLAG cube with flagged SPW edges and a central gap.
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    chans = np.linspace(-1, 1, nchan)
+    shape = (npol, nchan, nant)
+
+    amp = 1 + 0.1 * chans[np.newaxis, :, np.newaxis] + 0.01 * rng.standard_normal(shape)
+    phase = 0.2 * chans[np.newaxis, :, np.newaxis]**2 + 0.01 * rng.standard_normal(shape)
+
+    dat = np.ma.array(amp * np.exp(1j * phase), mask=np.zeros(shape, dtype=bool))
+
+    dat.mask[:, :nedge] = True
+    dat.mask[:, -nedge:] = True
+    dat.mask[:, gap[0]:gap[1]] = True
+
+    return dat
+
+
+def materialized_rolling_window(x, k):
+    '''
+    The original copy-based version of `rolling_window`.
+    '''
+    y = np.ma.zeros((len(x), k), dtype='complex128')
+    k2 = (k - 1) // 2
+    y[:, k2] = x
+    for i in range(k2):
+        j = k2 - i
+        y[j:, i] = x[:-j]
+        y[:j, i] = x[0]
+        y[:-j, -(i + 1)] = x[j:]
+        y[-j:, -(i + 1)] = x[-1]
+    return y
+
+
+def peak_memory(func, *args):
+
+    tracemalloc.start()
+    out = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return out, peak
+
+
+def test_rolling_window_matches_copy():
+
+    spec = make_bandpass_cube(npol=1, nant=1)[0, :, 0]
+
+    for window_size in [1, 3, 51, 301]:
+
+        rolled = rolling_window(spec, window_size)
+        expected = materialized_rolling_window(spec, window_size)
+
+        npt.assert_array_equal(rolled.mask, expected.mask)
+        npt.assert_array_equal(rolled.data[~rolled.mask], expected.data[~expected.mask])
+
+
+def test_rolling_window_memory_peak():
+
+    spec = make_bandpass_cube(npol=1, nchan=4096, nant=1, gap=(1800, 2000))[0, :, 0]
+
+    window_size = 501
+
+    _, peak_copy = peak_memory(materialized_rolling_window, spec, window_size)
+    rolled, peak_view = peak_memory(rolling_window, spec, window_size)
+
+    # The copy holds (nchan, window) complex values and the mask.
+    assert peak_copy > spec.size * window_size * 16
+
+    # The view only allocates the padded data and mask.
+    assert peak_view < 4 * (spec.size + window_size) * (16 + 1)
+    assert peak_view < peak_copy / 100.
+
+    assert not rolled.data.flags.writeable
+
+
+def test_masked_savgol_fit_matches_polyfit():
+
+    dat = make_bandpass_cube(npol=1, nant=1)
+    spec = dat[0, :, 0]
+
+    window_size = 51
+    poly_order = 2
+
+    smoothed = masked_savgol_fit(spec.data, spec.mask, window_size, poly_order)[0]
+
+    x_polyfit = np.arange(window_size) - np.floor(window_size / 2.)
+    rolled_array = rolling_window(spec, window_size)
+
+    expected = np.empty(spec.size, dtype=complex)
+    for i in range(spec.size):
+        if (~rolled_array[i].mask).sum() < poly_order + 1:
+            expected[i] = np.nan
+            continue
+        expected[i] = np.ma.polyfit(x_polyfit, rolled_array[i], poly_order)[-1]
+
+    npt.assert_allclose(smoothed, expected, rtol=1e-10, atol=1e-12)
+
+
+def test_masked_savgol_fit_too_few_points():
+
+    data = np.ones((1, 20), dtype=complex)
+    mask = np.ones((1, 20), dtype=bool)
+    mask[0, 10] = False
+
+    smoothed = masked_savgol_fit(data, mask, 5, 2)
+
+    assert np.isnan(smoothed).all()
+
+
+def test_interpolate_bandpass_gaps_methods_match():
+
+    dat = make_bandpass_cube()
+    # One fully flagged antenna is skipped.
+    dat.mask[:, :, -1] = True
+
+    out_polyfit = interpolate_bandpass_gaps(dat.copy(), add_residuals=False,
+                                            method='polyfit')
+    out_batched = interpolate_bandpass_gaps(dat.copy(), add_residuals=False,
+                                            method='batched')
+
+    npt.assert_array_equal(out_batched.mask, out_polyfit.mask)
+    npt.assert_allclose(out_batched.data, out_polyfit.data, rtol=1e-10, atol=1e-12)
+
+    # Gap is filled on the unflagged antennas only.
+    assert not out_batched.mask[:, 100:120, :-1].any()
+    assert out_batched.mask[:, :, -1].all()
+
+
+def test_interpolate_bandpass_gaps_residuals_seeded():
+
+    dat = make_bandpass_cube()
+
+    np.random.seed(42)
+    out_polyfit = interpolate_bandpass_gaps(dat.copy(), add_residuals=True,
+                                            method='polyfit')
+    np.random.seed(42)
+    out_batched = interpolate_bandpass_gaps(dat.copy(), add_residuals=True,
+                                            method='batched')
+
+    npt.assert_allclose(out_batched.data, out_polyfit.data, rtol=1e-10, atol=1e-12)
+
+
+def test_interpolate_bandpass_spws_parallel_deterministic():
+
+    spw_data = {spw: make_bandpass_cube(seed=spw) for spw in [0, 3, 5]}
+
+    out_serial = interpolate_bandpass_spws({spw: spw_data[spw].copy() for spw in spw_data},
+                                           add_residuals=True, nworkers=1, seed=1234)
+    out_parallel = interpolate_bandpass_spws({spw: spw_data[spw].copy() for spw in spw_data},
+                                             add_residuals=True, nworkers=3, seed=1234)
+
+    assert list(out_parallel.keys()) == [0, 3, 5]
+
+    for spw in spw_data:
+        npt.assert_array_equal(out_parallel[spw].data, out_serial[spw].data)
+        npt.assert_array_equal(out_parallel[spw].mask, out_serial[spw].mask)
@@ -0,0 +1,384 @@
+'''
+Tests for the line flagging and continuum range tools.
+'''
+
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from lband_pipeline.line_tools import line_flagging
+from lband_pipeline.line_tools.line_flagging import (angular_separation,
+                                                     build_cont_dat,
+                                                     get_freq_grid,
+                                                     hi_foreground_flag_commands,
+                                                     lines_freq2vels,
+                                                     lsrk_direction_tolerance,
+                                                     merge_line_ranges,
+                                                     nearest_channel,
+                                                     partition_cont_range,
+                                                     partition_cont_ranges)
+
+
+def partition_cont_range_loop(line_freqs, spw_start, spw_end):
+    '''
+    The original chunk-editing loop of `partition_cont_range`, kept as a reference.
+    '''
+
+    line_freqs = np.array(line_freqs)
+
+    line_starts = line_freqs[:, 0]
+    line_ends = line_freqs[:, 1]
+
+    cont_chunks = [dict(start=spw_start, end=spw_end)]
+
+    for i in range(len(line_starts)):
+        j = 0
+        while j < len(cont_chunks):
+            if line_ends[i] < cont_chunks[j]["start"] or line_starts[i] > cont_chunks[j]["end"]:
+                pass
+
+            elif line_starts[i] <= cont_chunks[j]["start"] and line_ends[i] >= cont_chunks[j]["end"]:
+                cont_chunks.pop(j)
+                j = j - 1
+
+            elif line_starts[i] < cont_chunks[j]["start"] and line_ends[i] >= cont_chunks[j]["start"]:
+                cont_chunks[j]["start"] = line_ends[i]
+
+            elif line_starts[i] <= cont_chunks[j]["end"] and line_ends[i] > cont_chunks[j]["end"]:
+                cont_chunks[j]["end"] = line_starts[i]
+
+            elif line_starts[i] > cont_chunks[j]["start"] and line_ends[i] < cont_chunks[j]["end"]:
+                cont_chunks.insert(j + 1, dict(start=line_ends[i], end=cont_chunks[j]["end"]))
+                cont_chunks[j]["end"] = line_starts[i]
+                j = j + 1
+
+            j = j + 1
+
+    return cont_chunks
+
+
+def random_line_freqs(rng, nlines, spw_start=1.0, spw_end=1.128):
+    '''
+    Random line ranges in and around the SPW, including wide and nested lines.
+    '''
+
+    spw_width = spw_end - spw_start
+
+    centres = rng.uniform(spw_start - 0.2 * spw_width, spw_end + 0.2 * spw_width,
+                          size=nlines)
+    widths = spw_width * rng.choice([1e-3, 1e-2, 0.1, 0.5, 1.5], size=nlines)
+    widths *= rng.uniform(0.5, 1.0, size=nlines)
+
+    return np.stack([centres - 0.5 * widths, centres + 0.5 * widths], axis=1).tolist()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_partition_cont_range_matches_loop(seed):
+
+    rng = np.random.default_rng(seed)
+
+    for nlines in [1, 2, 5, 20, 100]:
+
+        line_freqs = random_line_freqs(rng, nlines)
+
+        out = partition_cont_range(line_freqs, 1.0, 1.128)
+        expected = partition_cont_range_loop(line_freqs, 1.0, 1.128)
+
+        assert len(out) == len(expected)
+
+        for chunk, exp_chunk in zip(out, expected):
+            assert chunk['start'] == exp_chunk['start']
+            assert chunk['end'] == exp_chunk['end']
+
+        # The chunks are ordered, disjoint and do not overlap any line.
+        starts = np.array([chunk['start'] for chunk in out])
+        ends = np.array([chunk['end'] for chunk in out])
+
+        assert np.all(ends > starts)
+        assert np.all(starts[1:] >= ends[:-1])
+
+        for line_start, line_end in line_freqs:
+            assert not np.any((starts < line_end) & (ends > line_start))
+
+
+def test_partition_cont_range_touching_lines():
+
+    # Lines sharing an edge are merged, including a line ending on the SPW edge.
+    out = partition_cont_range([[1.2, 1.3], [1.3, 1.4], [1.8, 2.0]], 1.0, 2.0)
+
+    assert out == [dict(start=1.0, end=1.2), dict(start=1.4, end=1.8)]
+
+    assert partition_cont_range([], 1.0, 2.0) == [dict(start=1.0, end=2.0)]
+
+
+def test_partition_cont_ranges_per_spw():
+
+    rng = np.random.default_rng(42)
+
+    spw_starts = 1.0 + 0.128 * np.arange(8)
+    spw_ends = spw_starts + 0.128
+
+    line_freqs = random_line_freqs(rng, 50, spw_start=spw_starts[0], spw_end=spw_ends[-1])
+
+    all_chunks = partition_cont_ranges(line_freqs, spw_starts, spw_ends)
+
+    assert len(all_chunks) == spw_starts.size
+
+    for spw_start, spw_end, chunks in zip(spw_starts, spw_ends, all_chunks):
+        assert chunks == partition_cont_range(line_freqs, spw_start, spw_end)
+
+
+def test_merge_line_ranges():
+
+    starts, ends = merge_line_ranges([[5., 6.], [1., 2.], [1.5, 3.], [2.5, 2.7], [6., 7.]])
+
+    np.testing.assert_equal(starts, [1., 5.])
+    np.testing.assert_equal(ends, [3., 7.])
+
+
+def test_hi_foreground_flag_commands():
+
+    hi_restfreq = 1.420405752e9
+
+    # 1 kHz channels centred on the HI rest frequency.
+    freqs = hi_restfreq + 1e3 * np.arange(-500, 500)
+    vels_lsrk_dict = {5: lines_freq2vels(freqs, hi_restfreq),
+                      8: lines_freq2vels(freqs[::4], hi_restfreq)}
+
+    calibrator_line_range_kms = {'3C48': {'HI': [-50., 50.]},
+                                 'J0119+3210': {'HI': [20., -20.]}}
+
+    cmds = hi_foreground_flag_commands(['3C48', 'J0119+3210', 'J0000+0000'],
+                                       vels_lsrk_dict,
+                                       calibrator_line_range_kms)
+
+    # The unknown field is skipped and each field covers both SPWs.
+    assert len(cmds) == 2
+
+    assert cmds[0].startswith("mode='manual' field='3C48' spw='5:")
+    assert ",8:" in cmds[0]
+
+    spw_sel = cmds[1].split("spw='")[1].rstrip("'").split(",")
+    chan_range = [int(val) for val in spw_sel[0].split(":")[1].split("~")]
+
+    # +20 km/s is at the lower frequency (channel) end.
+    expected_start = np.abs(vels_lsrk_dict[5] - 20.).argmin()
+    expected_stop = np.abs(vels_lsrk_dict[5] + 20.).argmin()
+
+    assert chan_range == [expected_start, expected_stop]
+    assert chan_range[0] < chan_range[1]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_nearest_channel_matches_argmin(descending):
+
+    rng = np.random.default_rng(7)
+
+    freqs = 1.4e9 + 1e3 * np.arange(512)
+    if descending:
+        freqs = freqs[::-1]
+
+    # Include values outside the grid and exactly between two channels.
+    test_freqs = np.concatenate([rng.uniform(freqs.min() - 1e4, freqs.max() + 1e4, size=200),
+                                 freqs[:10] + 500., freqs[-5:]])
+
+    for freq in test_freqs:
+        assert nearest_channel(freq, freqs) == np.abs(freqs - freq).argmin()
+
+
+class CountingMS(object):
+    '''
+    Stand-in for the ms tool that counts the frame conversions.
+    '''
+
+    def __init__(self, chan_width=1e3):
+        self.ncalls = 0
+        self.chan_width = chan_width
+
+    def cvelfreqs(self, spwids=[], fieldids=[], outframe='LSRK'):
+        self.ncalls += 1
+        offset = 0. if outframe == 'TOPO' else 1e4 * (1 + fieldids[0])
+        return 1.4e9 + self.chan_width * np.arange(16) + offset
+
+
+def test_get_freq_grid_cache():
+
+    myms = CountingMS()
+    cache = {}
+
+    # Pointings 0.5' and 0.8' from the first, one 3' away and one far away.
+    ra0, dec0 = np.deg2rad(23.46), np.deg2rad(30.66)
+    directions = [(ra0, dec0),
+                  (ra0, dec0 + np.deg2rad(0.5 / 60.)),
+                  (ra0 + np.deg2rad(0.8 / 60.) / np.cos(dec0), dec0),
+                  (ra0, dec0 + np.deg2rad(3. / 60.)),
+                  (np.deg2rad(10.68), np.deg2rad(41.27))]
+
+    grids = [get_freq_grid(myms, 0, 'LSRK', field_id=ii, direction=direction,
+                           freq_grid_cache=cache, tolerance_arcmin=1.0)
+             for ii, direction in enumerate(directions)]
+
+    assert myms.ncalls == 3
+    assert grids[1] is grids[0]
+    assert grids[2] is grids[0]
+    assert grids[3] is not grids[0]
+    assert grids[4] is not grids[0]
+
+    for ii in range(len(directions)):
+        get_freq_grid(myms, 0, 'TOPO', field_id=ii, freq_grid_cache=cache)
+
+    assert myms.ncalls == 4
+
+    # A smaller tolerance separates the nearby pointings.
+    cache = {}
+    for ii, direction in enumerate(directions[:3]):
+        get_freq_grid(myms, 0, 'LSRK', field_id=ii, direction=direction,
+                      freq_grid_cache=cache, tolerance_arcmin=0.1)
+
+    assert myms.ncalls == 7
+
+
+def test_get_freq_grid_channel_width_tolerance():
+
+    ra0, dec0 = np.deg2rad(23.46), np.deg2rad(30.66)
+
+    # Mosaic pointings 15' apart
+    directions = [(ra0, dec0 + np.deg2rad(15. * ii / 60.)) for ii in range(4)]
+
+    # ~0.2 km/s HI channels: each pointing has its own grid.
+    assert np.rad2deg(lsrk_direction_tolerance(1.4e9 + 1e3 * np.arange(16))) * 60. < 2.
+
+    myms = CountingMS(chan_width=1e3)
+    cache = {}
+    for ii, direction in enumerate(directions):
+        get_freq_grid(myms, 0, 'LSRK', field_id=ii, direction=direction, freq_grid_cache=cache)
+
+    # One TOPO grid for the channel width and one LSRK grid per pointing.
+    assert myms.ncalls == 5
+
+    # 1 MHz continuum channels: all pointings share one grid.
+    myms = CountingMS(chan_width=1e6)
+    cache = {}
+    grids = [get_freq_grid(myms, 0, 'LSRK', field_id=ii, direction=direction,
+                           freq_grid_cache=cache)
+             for ii, direction in enumerate(directions)]
+
+    assert myms.ncalls == 2
+    assert all([grid is grids[0] for grid in grids])
+
+    # A smaller allowed shift separates the pointings again.
+    myms = CountingMS(chan_width=1e6)
+    cache = {}
+    for ii, direction in enumerate(directions):
+        get_freq_grid(myms, 0, 'LSRK', field_id=ii, direction=direction, freq_grid_cache=cache,
+                      max_shift_chan=1e-3)
+
+    assert myms.ncalls == 5
+
+    assert lsrk_direction_tolerance([1.4e9]) == 0.
+
+
+def test_angular_separation():
+
+    assert angular_separation(0.1, 0.2, 0.1, 0.2) == 0.
+
+    # RA wraps around 360 deg.
+    assert angular_separation(2 * np.pi - 0.001, 0., 0.001, 0.) == pytest.approx(0.002)
+
+    # Along RA the separation shrinks with cos(Dec).
+    dec = np.deg2rad(60.)
+    assert angular_separation(0., dec, 1e-4, dec) == pytest.approx(0.5e-4, rel=1e-6)
+
+
+class ContDatMetadata(object):
+
+    def fieldsforintent(self, intent, asnames=False):
+        return np.array(['M33_1', 'M33_2'])
+
+    def spwsforfield(self, field):
+        return np.array([0, 1, 2])
+
+    def fieldsforname(self, field):
+        return [int(field[-1]) - 1]
+
+    def phasecenter(self, field_id):
+        return {'m0': {'value': 0.41 + 0.01 * field_id}, 'm1': {'value': 0.53}}
+
+    def close(self):
+        pass
+
+
+class ContDatMS(object):
+    '''
+    Stand-in for the ms tool with an HI, an OH and a line-free SPW. The LSRK and
+    TOPO grids are the same.
+    '''
+
+    spw_grids = {0: 1.4195e9 + 15.625e3 * np.arange(256),
+                 1: 1.664e9 + 15.625e3 * np.arange(320),
+                 2: 1.0e9 + 1e6 * np.arange(128)}
+
+    def open(self, vis):
+        pass
+
+    def metadata(self):
+        return ContDatMetadata()
+
+    def cvelfreqs(self, spwids=[], fieldids=[], outframe='LSRK'):
+        return self.spw_grids[spwids[0]]
+
+    def close(self):
+        pass
+
+
+def test_build_cont_dat_partitions_once_per_field(tmp_path, monkeypatch):
+
+    fake_casatools = types.ModuleType('casatools')
+    fake_casatools.ms = ContDatMS
+    monkeypatch.setitem(sys.modules, 'casatools', fake_casatools)
+
+    calls = []
+
+    def counting_partition(line_freqs, spw_starts, spw_ends):
+        calls.append(list(spw_starts))
+        return partition_cont_ranges(line_freqs, spw_starts, spw_ends)
+
+    monkeypatch.setattr(line_flagging, 'partition_cont_ranges', counting_partition)
+
+    line_freqs = {'HI': 1.420405752, 'OH1665': 1.665402}
+    target_line_range_kms = {'M33': {'HI': ((-100., -350.),), 'OH': ((-100., -350.),)}}
+
+    outfile = str(tmp_path / "cont.dat")
+
+    build_cont_dat("track.ms", target_line_range_kms, line_freqs=line_freqs,
+                   outfile=outfile)
+
+    # One partition per field covering both line SPWs.
+    assert len(calls) == 2
+    assert all([len(spw_starts) == 2 for spw_starts in calls])
+
+    # Same chunks as partitioning each SPW with its own line range.
+    expected = {}
+    for spw, line in [(0, 'HI'), (1, 'OH1665')]:
+        grid = ContDatMS.spw_grids[spw]
+        line_range = [grid[nearest_channel(freq, grid)] * 1e-9
+                      for freq in line_flagging.lines_rest2obs(line_freqs[line] * 1e9,
+                                                               np.array([-100., -350.]))]
+        expected[spw] = partition_cont_range([line_range], grid.min() * 1e-9, grid.max() * 1e-9)
+
+    with open(outfile) as f:
+        out = f.read()
+
+    for field in ['M33_1', 'M33_2']:
+        field_text = out.split("Field: " + field)[1].split("Field:")[0]
+
+        for spw in [0, 1]:
+            spw_text = field_text.split("SpectralWindow: {}\n".format(spw))[1].split("\n\n")[0]
+            chunks = [line.replace("GHz TOPO", "").split("~") for line in spw_text.splitlines()]
+            assert [dict(start=float(start), end=float(end)) for start, end in chunks] == \
+                expected[spw]
+
+        # No lines in the continuum SPW.
+        assert "SpectralWindow: 2" not in field_text
@@ -0,0 +1,184 @@
+'''
+Tests for the MS metadata reader on small synthetic tables.
+'''
+
+import numpy as np
+import pytest
+
+from lband_pipeline import ms_metadata
+from lband_pipeline.ms_metadata import (read_ms_metadata,
+                                        ms_metadata_from_tables,
+                                        fieldnames,
+                                        fieldsforname,
+                                        fieldsforintent,
+                                        fieldsforscan,
+                                        scansforintent,
+                                        scansforfield,
+                                        spwsforfield,
+                                        spwsforscan,
+                                        namesforspws,
+                                        nchan,
+                                        chanfreqs,
+                                        chanwidths,
+                                        bandwidths,
+                                        phasecenter)
+
+
+def make_ms_columns():
+    '''
+    3 fields (flux calibrator, phase calibrator, target), 2 SPWs with different
+    numbers of channels and 5 scans. SPW 1 is only observed on the target.
+    '''
+
+    nchans = [4, 8]
+    chan_freqs = [1.4e9 + 1e6 * np.arange(nchan) + 1e8 * ii for ii, nchan in enumerate(nchans)]
+
+    subtables = {'FIELD': {'NAME': np.array(['3C286', 'J1331+3030', 'M33_1']),
+                           'PHASE_DIR': [np.array([[0.1 * ii, 0.5]]) for ii in range(3)]},
+                 'STATE': {'OBS_MODE': np.array(['CALIBRATE_FLUX#ON_SOURCE,CALIBRATE_BANDPASS#ON_SOURCE',
+                                                 'CALIBRATE_PHASE#ON_SOURCE',
+                                                 'OBSERVE_TARGET#ON_SOURCE',
+                                                 'SYSTEM_CONFIGURATION#UNSPECIFIED'])},
+                 'SPECTRAL_WINDOW': {'NAME': np.array(['EVLA_L#A0C0#0', 'EVLA_L#B0D0#1']),
+                                     'NUM_CHAN': np.array(nchans),
+                                     'TOTAL_BANDWIDTH': np.array([4e6, 8e6]),
+                                     'REF_FREQUENCY': np.array([freqs[0] for freqs in chan_freqs]),
+                                     'CHAN_FREQ': chan_freqs,
+                                     'CHAN_WIDTH': [np.full(nchan, 1e6) for nchan in nchans]},
+                 'DATA_DESCRIPTION': {'SPECTRAL_WINDOW_ID': np.array([0, 1]),
+                                      'POLARIZATION_ID': np.array([0, 0])},
+                 'POLARIZATION': {'NUM_CORR': np.array([4])}}
+
+    # (field, scan, state, DDID) for each integration
+    rows = [(0, 1, 3, 0), (0, 2, 0, 0), (0, 2, 0, 0), (1, 3, 1, 0), (2, 4, 2, 0),
+            (2, 4, 2, 1), (1, 5, 1, 0), (2, 6, 2, 1), (2, 6, -1, 1)]
+    main = {colname: np.array([row[ii] for row in rows])
+            for ii, colname in enumerate(ms_metadata.MAIN_COLUMNS)}
+
+    return subtables, main
+
+
+def check_metadata(metadata):
+
+    assert fieldnames(metadata) == ['3C286', 'J1331+3030', 'M33_1']
+    assert fieldsforname(metadata, 'J1331+3030') == [1]
+
+    assert fieldsforintent(metadata, "*TARGET*") == [2]
+    assert fieldsforintent(metadata, "*TARGET*", asnames=True) == ['M33_1']
+    assert fieldsforintent(metadata, "CALIBRATE_*") == [0, 1]
+    assert fieldsforintent(metadata, "*BANDPASS*", True) == ['3C286']
+
+    assert scansforintent(metadata, "*TARGET*") == [4, 6]
+    assert scansforintent(metadata, "*PHASE*") == [3, 5]
+    assert scansforfield(metadata, '3C286') == [1, 2]
+    assert fieldsforscan(metadata, 6) == [2]
+
+    assert spwsforfield(metadata, 0) == [0]
+    assert spwsforfield(metadata, 'M33_1') == [0, 1]
+    assert spwsforscan(metadata, 6) == [1]
+
+    assert namesforspws(metadata, 1) == ['EVLA_L#B0D0#1']
+    assert nchan(metadata, 1) == 8
+    np.testing.assert_array_equal(chanfreqs(metadata, 0), 1.4e9 + 1e6 * np.arange(4))
+    assert chanwidths(metadata, 1).shape == (8,)
+    assert bandwidths(metadata, 1) == 8e6
+
+    assert phasecenter(metadata, 2)['m0']['value'] == pytest.approx(0.2)
+    assert phasecenter(metadata, 'M33_1')['m1']['value'] == 0.5
+
+    np.testing.assert_array_equal(metadata['ddid_ncorr'], [4, 4])
+
+
+def test_metadata_from_tables():
+
+    subtables, main = make_ms_columns()
+
+    tables = dict(subtables)
+    tables['MAIN'] = np.unique(np.stack([main[colname] for colname in ms_metadata.MAIN_COLUMNS],
+                                        axis=1), axis=0)
+
+    check_metadata(ms_metadata_from_tables(tables))
+
+
+def table_reader(tables):
+    '''
+    In-memory tables with the `getcol`/`getcell`/`nrows`/`close` methods used from
+    the casacore and CASA table tools.
+    '''
+
+    def open_table(tablename, backend):
+
+        columns = tables[tablename]
+
+        def nrows():
+            return len(next(iter(columns.values())))
+
+        def getcol(colname, startrow=0, nrow=-1):
+            if isinstance(columns[colname], list):
+                raise RuntimeError("Column {} has a varying shape".format(colname))
+            stop = None if nrow < 0 else startrow + nrow
+            return columns[colname][startrow:stop]
+
+        def getcell(colname, row):
+            return columns[colname][row]
+
+        return type('table', (), {'nrows': staticmethod(nrows), 'getcol': staticmethod(getcol),
+                                  'getcell': staticmethod(getcell),
+                                  'close': staticmethod(lambda: None)})
+
+    return open_table
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 4, 100])
+def test_read_ms_metadata_chunks(monkeypatch, chunk_rows):
+
+    subtables, main = make_ms_columns()
+
+    tables = {"test.ms/{}".format(name): columns for name, columns in subtables.items()}
+    tables["test.ms"] = main
+
+    monkeypatch.setattr(ms_metadata, '_open_table', table_reader(tables))
+
+    metadata = read_ms_metadata("test.ms", backend='casa', chunk_rows=chunk_rows)
+
+    check_metadata(metadata)
+
+    # Repeated rows are only kept once
+    assert metadata['rows'].size == 8
+
+
+def test_unknown_backend():
+
+    with pytest.raises(ValueError):
+        ms_metadata._open_table("test.ms", backend='msmd')
+
+
+def test_casacore_tables(tmp_path):
+
+    casacore_tables = pytest.importorskip("casacore.tables")
+
+    subtables, main = make_ms_columns()
+
+    myvis = str(tmp_path / "test.ms")
+
+    nrow = main['FIELD_ID'].size
+    ms = casacore_tables.default_ms(myvis)
+    ms.addrows(nrow)
+    for colname in main:
+        ms.putcol(colname, main[colname])
+
+    for name, columns in subtables.items():
+        subtable = casacore_tables.default_ms_subtable(name, "{0}/{1}".format(myvis, name))
+        subtable.addrows(len(columns[list(columns.keys())[0]]))
+        for colname, values in columns.items():
+            if isinstance(values, list):
+                for row, value in enumerate(values):
+                    subtable.putcell(colname, row, value)
+            else:
+                subtable.putcol(colname, values)
+        subtable.close()
+        ms.putkeyword(name, "Table: {0}/{1}".format(myvis, name))
+
+    ms.close()
+
+    check_metadata(read_ms_metadata(myvis, backend='casacore'))
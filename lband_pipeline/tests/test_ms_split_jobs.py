@@ -0,0 +1,163 @@
+'''
+Tests for the serial and concurrent `mstransform` split jobs.
+
+`mstransform` is replaced by a stand-in `casatasks` module on the path, so the
+spawned worker processes use it too.
+'''
+
+import os
+import sys
+import importlib.util
+
+import pytest
+
+from lband_pipeline.ms_split_tools import (_run_mstransform, _run_mstransform_jobs,
+                                           split_ms_final_all)
+
+
+FAKE_CASATASKS = '''
+import os
+
+
+def mstransform(vis, outputvis, **kwargs):
+
+    fail_intent = os.environ.get("FAKE_MSTRANSFORM_FAIL_INTENT")
+
+    if 'fail' in os.path.basename(outputvis) or \
+            (fail_intent is not None and kwargs.get('intent') == fail_intent):
+        raise ValueError("mstransform failed for " + outputvis)
+
+    # Log an error and return without an output, like a failed CASA task.
+    if 'nooutput' in os.path.basename(outputvis):
+        return
+
+    os.mkdir(outputvis)
+
+    with open(os.path.join(outputvis, "split.txt"), 'w') as f:
+        f.write("{0} {1} {2}".format(vis, kwargs.get('intent', ''), os.getpid()))
+'''
+
+
+@pytest.fixture
+def fake_mstransform(tmp_path, monkeypatch):
+
+    module_path = tmp_path / "fake_casatasks"
+    module_path.mkdir()
+
+    with open(module_path / "casatasks.py", 'w') as f:
+        f.write(FAKE_CASATASKS)
+
+    # On the path for the spawned workers and in sys.modules for this process.
+    # Any casatasks module already imported is restored after the test.
+    monkeypatch.syspath_prepend(str(module_path))
+
+    spec = importlib.util.spec_from_file_location('casatasks', module_path / "casatasks.py")
+    fake_casatasks = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fake_casatasks)
+
+    monkeypatch.setitem(sys.modules, 'casatasks', fake_casatasks)
+
+    return tmp_path
+
+
+def split_info(outputvis):
+    with open(os.path.join(outputvis, "split.txt")) as f:
+        vis, intent, pid = f.read().split(" ")
+    return vis, intent, int(pid)
+
+
+def make_jobs(path, names):
+    return {name: dict(vis=str(path / "track.ms"),
+                       outputvis=str(path / "track.{}.ms".format(name)),
+                       spw="", datacolumn='DATA')
+            for name in names}
+
+
+def test_run_mstransform_serial(fake_mstransform):
+
+    split_jobs = make_jobs(fake_mstransform, ['continuum', 'speclines'])
+
+    _run_mstransform_jobs(split_jobs, concurrent=False)
+
+    for job in split_jobs.values():
+        vis, _, pid = split_info(job['outputvis'])
+        assert vis == job['vis']
+        assert pid == os.getpid()
+
+
+def test_run_mstransform_concurrent(fake_mstransform):
+
+    split_jobs = make_jobs(fake_mstransform, ['continuum', 'speclines'])
+
+    _run_mstransform_jobs(split_jobs, concurrent=True, stagger_start=0.1)
+
+    pids = []
+    for job in split_jobs.values():
+        vis, _, pid = split_info(job['outputvis'])
+        assert vis == job['vis']
+        pids.append(pid)
+
+    assert os.getpid() not in pids
+
+
+def test_run_mstransform_concurrent_failure(fake_mstransform):
+
+    split_jobs = make_jobs(fake_mstransform, ['continuum', 'speclines_fail'])
+
+    with pytest.raises(RuntimeError, match='speclines_fail') as excinfo:
+        _run_mstransform_jobs(split_jobs, concurrent=True)
+
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+    # The other split still finishes.
+    assert os.path.exists(split_jobs['continuum']['outputvis'])
+
+
+def test_run_mstransform_serial_failure(fake_mstransform):
+
+    split_jobs = make_jobs(fake_mstransform, ['continuum_fail', 'speclines'])
+
+    with pytest.raises(RuntimeError, match='continuum_fail') as excinfo:
+        _run_mstransform_jobs(split_jobs, concurrent=False)
+
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+    # The other split still runs, as in the concurrent mode.
+    assert os.path.exists(split_jobs['speclines']['outputvis'])
+
+
+def test_run_mstransform_missing_output(fake_mstransform):
+
+    split_job = make_jobs(fake_mstransform, ['nooutput'])['nooutput']
+
+    with pytest.raises(RuntimeError, match='did not create'):
+        _run_mstransform(split_job)
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_split_ms_final_all(fake_mstransform, concurrent):
+
+    ms_name = str(fake_mstransform / "track.continuum.ms")
+    output_path = str(fake_mstransform)
+
+    split_ms_final_all(ms_name, {}, output_path=output_path, concurrent=concurrent)
+
+    assert split_info(ms_name + ".split")[:2] == (ms_name, '*TARGET*')
+    assert split_info(ms_name + ".split_calibrators")[:2] == (ms_name, '*CALIBRATE*')
+
+
+@pytest.mark.parametrize(('concurrent', 'fail_intent'),
+                         [(False, '*TARGET*'), (False, '*CALIBRATE*'),
+                          (True, '*TARGET*'), (True, '*CALIBRATE*')])
+def test_split_ms_final_all_failure(fake_mstransform, monkeypatch, concurrent, fail_intent):
+
+    monkeypatch.setenv("FAKE_MSTRANSFORM_FAIL_INTENT", fail_intent)
+
+    ms_name = str(fake_mstransform / "track.speclines.ms")
+
+    with pytest.raises(RuntimeError):
+        split_ms_final_all(ms_name, {0: {'label': 'HI'}}, output_path=str(fake_mstransform),
+                           concurrent=concurrent)
+
+    other_split = ".split_calibrators" if fail_intent == '*TARGET*' else ".split"
+    assert os.path.exists(ms_name + other_split)
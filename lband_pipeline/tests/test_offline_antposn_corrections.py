@@ -0,0 +1,141 @@
+'''
+Tests for the batch antenna position tables. Needs the VLA pipeline.
+'''
+
+import os
+import runpy
+import sys
+
+import pytest
+
+pytest.importorskip("pipeline")
+
+from lband_pipeline import offline_antposn_corrections
+from lband_pipeline.offline_antposn_corrections import (make_offline_antpos_tables,
+                                                        antpos_table_name,
+                                                        write_antpos_report)
+
+
+def test_batch_antpos_tables(tmp_path, monkeypatch):
+
+    casatasks = pytest.importorskip("casatasks")
+
+    data_folder = tmp_path / "VLA_antcorr_tables"
+    data_folder.mkdir()
+
+    monkeypatch.setattr(offline_antposn_corrections.datetime, 'datetime',
+                        type('fixed', (), {'now': staticmethod(lambda: type('now', (), {'year': 2010}))}))
+
+    with open(data_folder / "2010.txt", 'w') as f:
+        f.write("FEB01 FEB10 12:00 1 W08 0.1 0.2 0.3\n")
+
+    metadata = {}
+    for ii, (obs_year, obs_time) in enumerate([(2010, 20100101.), (2010, 20100301.), (2009, 20090101.)]):
+        vis = str(tmp_path / "track{}.ms".format(ii))
+        (tmp_path / "track{}.ms.hifv_priorcals.s5_3.gc.tbl".format(ii)).mkdir()
+        metadata[vis] = {'vis': vis, 'obs_year': obs_year, 'obs_time': obs_time,
+                         'ant_num_stas': [[1, 'ea01', 'W08'], [2, 'ea02', 'E16']]}
+
+    monkeypatch.setattr(offline_antposn_corrections, 'read_antpos_metadata',
+                        lambda vis: metadata[vis])
+
+    calls = []
+
+    def fake_gencal(vis, caltable, caltype, antenna, parameter):
+        calls.append((vis, caltable, antenna, parameter))
+
+    monkeypatch.setattr(casatasks, 'gencal', fake_gencal, raising=False)
+
+    vis_names = list(metadata.keys())
+
+    report_file = str(tmp_path / "report.txt")
+
+    results = make_offline_antpos_tables(vis_names, data_folder=str(data_folder),
+                                         report_file=report_file)
+
+    assert [result['status'] for result in results] == ['corrected', 'no_offsets', 'pre-2010']
+
+    assert calls == [(vis_names[0], antpos_table_name(vis_names[0]), 'ea01', [0.1, 0.2, 0.3])]
+
+    with open(report_file) as f:
+        lines = f.readlines()
+    assert len(lines) == 4
+    assert lines[1].split()[1:4] == ['corrected', '1', 'ea01']
+
+
+def test_batch_antpos_tables_failure(tmp_path, monkeypatch):
+
+    casatasks = pytest.importorskip("casatasks")
+
+    data_folder = tmp_path / "VLA_antcorr_tables"
+    data_folder.mkdir()
+
+    monkeypatch.setattr(offline_antposn_corrections.datetime, 'datetime',
+                        type('fixed', (), {'now': staticmethod(lambda: type('now', (), {'year': 2010}))}))
+
+    with open(data_folder / "2010.txt", 'w') as f:
+        f.write("FEB01 FEB10 12:00 1 W08 0.1 0.2 0.3\n")
+
+    metadata = {}
+    for ii in range(3):
+        vis = str(tmp_path / "track{}.ms".format(ii))
+        (tmp_path / "track{}.ms.hifv_priorcals.s5_3.gc.tbl".format(ii)).mkdir()
+        metadata[vis] = {'vis': vis, 'obs_year': 2010, 'obs_time': 20100101.,
+                         'ant_num_stas': [[1, 'ea01', 'W08']]}
+
+    monkeypatch.setattr(offline_antposn_corrections, 'read_antpos_metadata',
+                        lambda vis: metadata[vis])
+
+    calls = []
+
+    def fake_gencal(vis, caltable, caltype, antenna, parameter):
+        calls.append(vis)
+        if vis.endswith("track1.ms"):
+            raise ValueError("gencal failed")
+
+    monkeypatch.setattr(casatasks, 'gencal', fake_gencal, raising=False)
+
+    vis_names = list(metadata.keys())
+
+    report_file = str(tmp_path / "report.txt")
+
+    with pytest.raises(RuntimeError, match="track1.ms") as excinfo:
+        make_offline_antpos_tables(vis_names, data_folder=str(data_folder),
+                                   report_file=report_file)
+
+    assert str(excinfo.value.__cause__) == "gencal failed"
+
+    # Every MS is still processed and reported.
+    assert calls == vis_names
+
+    with open(report_file) as f:
+        lines = f.readlines()
+    assert [line.split()[1] for line in lines[1:]] == ['corrected', 'failed', 'corrected']
+
+
+def test_run_offline_antpos_cli_failure(tmp_path, monkeypatch, capsys):
+
+    report_file = str(tmp_path / "report.txt")
+
+    def fake_tables(vis_names, data_folder, skip_existing, nworkers, report_file):
+        results = [{'vis': vis, 'status': status, 'table': None, 'antennas': antennas,
+                    'error': None}
+                   for vis, status, antennas in [('track0.ms', 'corrected', 'ea01,ea02'),
+                                                 ('track1.ms', 'failed', 'ea03'),
+                                                 ('track2.ms', 'no_offsets', '')]]
+        write_antpos_report(results, report_file)
+        raise RuntimeError("Antenna position tables failed for: ['track1.ms']")
+
+    monkeypatch.setattr(offline_antposn_corrections, 'make_offline_antpos_tables', fake_tables)
+    monkeypatch.setattr(sys, 'argv', ['run_offline_antpos', '--report', report_file,
+                                      'track0.ms', 'track1.ms', 'track2.ms'])
+
+    with pytest.raises(SystemExit) as excinfo:
+        runpy.run_module('lband_pipeline.run_offline_antpos', run_name='__main__')
+
+    assert excinfo.value.code == 1
+
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ['track0.ms: corrected ea01,ea02', 'track1.ms: failed ea03',
+                                'track2.ms: no_offsets ']
+    assert 'track1.ms' in err
@@ -0,0 +1,54 @@
+'''
+Tests for the shared process pool and its failure handling.
+'''
+
+import math
+import time
+
+import pytest
+
+from lband_pipeline.process_pool import run_process_pool, raise_job_failures
+
+
+def timed_sleep(duration):
+    start = time.time()
+    time.sleep(duration)
+    return start, time.time()
+
+
+@pytest.mark.parametrize('nworkers', [1, 2])
+def test_run_process_pool_failures(nworkers):
+
+    jobs = [4., -1., 9., -4.]
+
+    results, failures = run_process_pool(math.sqrt, jobs, nworkers=nworkers,
+                                         label="sqrt", job_names=['a', 'b', 'c', 'd'])
+
+    # All jobs run and the results keep the job order.
+    assert results == [2., None, 3., None]
+
+    assert list(failures.keys()) == ['b', 'd']
+    assert all([isinstance(exc, ValueError) for exc in failures.values()])
+
+    with pytest.raises(RuntimeError, match=r"sqrt failed for: \['b', 'd'\]") as excinfo:
+        raise_job_failures(failures, label="sqrt")
+
+    assert excinfo.value.__cause__ is failures['b']
+
+    # No failures
+    raise_job_failures({}, label="sqrt")
+
+
+def test_run_process_pool_memory_limit():
+
+    jobs = [0.3, 0.3, 0.3]
+
+    # Only one job fits within the memory limit at a time.
+    results, failures = run_process_pool(timed_sleep, jobs, nworkers=3,
+                                         job_memory_gb=[2., 2., 2.],
+                                         memory_limit_gb=3.)
+
+    assert failures == {}
+
+    for (_, end), (start, _) in zip(results[:-1], results[1:]):
+        assert start >= end
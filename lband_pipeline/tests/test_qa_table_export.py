@@ -0,0 +1,221 @@
+'''
+Tests for the NumPy QA table exporter.
+'''
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from lband_pipeline.qa_plotting.qa_table_export import (QA_TABLE_COLUMNS,
+                                                        accumulate_qa_chunk,
+                                                        new_qa_accumulator,
+                                                        qa_table_rows,
+                                                        write_qa_table)
+
+
+def make_chunk(seed=0, nchan=16, ncorr=2):
+
+    rng = np.random.default_rng(seed)
+
+    scans, times, ant1, ant2 = [], [], [], []
+    for scan in [3, 4]:
+        for time in scan * 100. + np.arange(3) * 10.:
+            for (a1, a2) in [(0, 1), (0, 2), (1, 2)]:
+                scans.append(scan)
+                times.append(time)
+                ant1.append(a1)
+                ant2.append(a2)
+
+    nrow = len(scans)
+
+    chunk = {'data': rng.normal(size=(ncorr, nchan, nrow)) + 1j * rng.normal(size=(ncorr, nchan, nrow)),
+             'model': np.ones((ncorr, nchan, nrow), dtype=complex),
+             'flag': rng.random((ncorr, nchan, nrow)) > 0.7,
+             'weight': rng.uniform(0.5, 2., size=(ncorr, nrow)),
+             'time': np.array(times),
+             'scan': np.array(scans),
+             'antenna1': np.array(ant1),
+             'antenna2': np.array(ant2),
+             'uvw': rng.normal(scale=1000., size=(3, nrow)),
+             'field': 1,
+             'spw': 2}
+
+    return chunk
+
+
+def spw_info(nchan=16, chanavg=4):
+    return {2: {'chan_freqs': 1.4e9 + 1e6 * np.arange(nchan),
+                'corr_names': ['RR', 'LL'],
+                'chanavg': chanavg}}
+
+
+def split_chunk(chunk, rows):
+    out = {}
+    for key, val in chunk.items():
+        if isinstance(val, np.ndarray):
+            out[key] = val[..., rows]
+        else:
+            out[key] = val
+    return out
+
+
+def test_accumulate_matches_brute_force():
+
+    chunk = make_chunk()
+    chanavg = 4
+
+    acc = new_qa_accumulator()
+    accumulate_qa_chunk(acc, chunk, chanavg=chanavg)
+
+    w = chunk['weight'][:, np.newaxis, :] * ~chunk['flag']
+    wvis = w * chunk['data']
+
+    # Amp vs. time: scan 4, second integration, corr LL, channels 4-7
+    rows = (chunk['scan'] == 4) & (chunk['time'] == 410.)
+    expected = np.abs(wvis[1, 4:8][:, rows].sum() / w[1, 4:8][:, rows].sum())
+
+    out = qa_table_rows(acc, 'amp_time', 1, 4, spw_info(), ['ea01', 'ea02', 'ea03'])
+    match = (out['time'] == 410.) & (out['corr'] == 'LL') & (out['chan'] == 5)
+    assert match.sum() == 1
+    assert out['y'][match][0] == pytest.approx(expected)
+
+    # Phase vs. channel: scan 3, channel 7, corr RR
+    rows = chunk['scan'] == 3
+    expected = np.rad2deg(np.angle(wvis[0, 7][rows].sum() / w[0, 7][rows].sum()))
+
+    out = qa_table_rows(acc, 'phase_chan', 1, 3, spw_info(), ['ea01', 'ea02', 'ea03'])
+    match = (out['chan'] == 7) & (out['corr'] == 'RR')
+    assert out['y'][match][0] == pytest.approx(expected)
+
+    # Amp vs. uvdist: scan 3, baseline 0-2, corr RR, channels 0-3
+    rows = (chunk['scan'] == 3) & (chunk['antenna1'] == 0) & (chunk['antenna2'] == 2)
+    uvdist = np.sqrt(chunk['uvw'][0]**2 + chunk['uvw'][1]**2)
+    expected_y = np.abs(wvis[0, :4][:, rows].sum() / w[0, :4][:, rows].sum())
+    expected_x = (w[0, :4][:, rows] * uvdist[rows]).sum() / w[0, :4][:, rows].sum()
+
+    out = qa_table_rows(acc, 'amp_uvdist', 1, 3, spw_info(), ['ea01', 'ea02', 'ea03'])
+    match = (out['ant1'] == 0) & (out['ant2'] == 2) & (out['corr'] == 'RR') & (out['chan'] == 1)
+    assert out['y'][match][0] == pytest.approx(expected_y)
+    assert out['x'][match][0] == pytest.approx(expected_x)
+    assert out['ant2name'][match][0] == 'ea03'
+
+    # Calibrator residuals use the model.
+    out = qa_table_rows(acc, 'ampresid_uvwave', 1, 3, spw_info(), ['ea01', 'ea02', 'ea03'])
+    assert out.size > 0
+
+
+def test_accumulate_chunks_independent():
+
+    chunk = make_chunk(seed=1)
+
+    acc_full = new_qa_accumulator()
+    accumulate_qa_chunk(acc_full, chunk, chanavg=4)
+
+    # The same rows split into chunks in a different order.
+    nrow = chunk['time'].size
+    order = np.random.default_rng(2).permutation(nrow)
+
+    acc_split = new_qa_accumulator()
+    for rows in np.array_split(order, 4):
+        accumulate_qa_chunk(acc_split, split_chunk(chunk, rows), chanavg=4)
+
+    for product in ['amp_time', 'amp_chan', 'phase_uvdist', 'amp_ant1']:
+        for scan in [3, 4]:
+            out_full = qa_table_rows(acc_full, product, 1, scan, spw_info(), ['a', 'b', 'c'])
+            out_split = qa_table_rows(acc_split, product, 1, scan, spw_info(), ['a', 'b', 'c'])
+
+            np.testing.assert_allclose(out_full['x'], out_split['x'])
+            np.testing.assert_allclose(out_full['y'], out_split['y'])
+
+
+def test_accumulate_nan_in_flagged_data():
+
+    chunk = make_chunk(seed=3)
+
+    acc = new_qa_accumulator()
+    accumulate_qa_chunk(acc, chunk, chanavg=4)
+
+    # NaN and inf in flagged samples, or a NaN weight for a fully flagged row,
+    # do not change the averages.
+    bad_chunk = {key: val.copy() if isinstance(val, np.ndarray) else val
+                 for key, val in chunk.items()}
+    bad_chunk['data'][chunk['flag']] = np.nan
+    bad_chunk['data'][0, 0, 0] = np.inf
+    bad_chunk['flag'][0, 0, 0] = True
+    bad_chunk['model'][chunk['flag']] = np.nan
+    bad_chunk['flag'][:, :, 1] = True
+    bad_chunk['weight'][:, 1] = np.nan
+
+    ref_chunk = {key: val.copy() if isinstance(val, np.ndarray) else val
+                 for key, val in chunk.items()}
+    ref_chunk['flag'] = bad_chunk['flag']
+    ref_chunk['weight'][:, 1] = 0.
+
+    acc_ref = new_qa_accumulator()
+    accumulate_qa_chunk(acc_ref, ref_chunk, chanavg=4)
+
+    acc_bad = new_qa_accumulator()
+    accumulate_qa_chunk(acc_bad, bad_chunk, chanavg=4)
+
+    for product in ['amp_time', 'phase_chan', 'amp_uvdist', 'ampresid_uvwave']:
+        for scan in [3, 4]:
+            out_ref = qa_table_rows(acc_ref, product, 1, scan, spw_info(), ['a', 'b', 'c'])
+            out_bad = qa_table_rows(acc_bad, product, 1, scan, spw_info(), ['a', 'b', 'c'])
+
+            assert np.isfinite(out_bad['y']).all()
+            np.testing.assert_allclose(out_bad['x'], out_ref['x'])
+            np.testing.assert_allclose(out_bad['y'], out_ref['y'])
+
+
+def test_accumulate_single_precision():
+
+    chunk = make_chunk(seed=4, nchan=4096)
+
+    acc = new_qa_accumulator()
+    accumulate_qa_chunk(acc, chunk, chanavg=1024)
+
+    # The MS columns are complex64 and float32.
+    single_chunk = dict(chunk)
+    for key, dtype in [('data', np.complex64), ('model', np.complex64), ('weight', np.float32)]:
+        single_chunk[key] = chunk[key].astype(dtype)
+
+    acc_single = new_qa_accumulator()
+
+    tracemalloc.start()
+    accumulate_qa_chunk(acc_single, single_chunk, chanavg=1024)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Temporary memory, without the accumulated sums. No double precision copies
+    # of the full-resolution data.
+    assert peak - current < 2.5 * single_chunk['data'].nbytes
+
+    info = spw_info(nchan=4096, chanavg=1024)
+    for product in ['amp_time', 'phase_chan', 'amp_uvdist', 'ampresid_uvwave']:
+        out = qa_table_rows(acc, product, 1, 3, info, ['a', 'b', 'c'])
+        out_single = qa_table_rows(acc_single, product, 1, 3, info, ['a', 'b', 'c'])
+
+        np.testing.assert_allclose(out_single['x'], out['x'], rtol=1e-5)
+        np.testing.assert_allclose(out_single['y'], out['y'], rtol=1e-3, atol=1e-3)
+
+
+def test_write_qa_table_plotms_layout(tmp_path):
+
+    chunk = make_chunk(seed=3)
+
+    acc = new_qa_accumulator()
+    accumulate_qa_chunk(acc, chunk, chanavg=4)
+
+    rows = qa_table_rows(acc, 'amp_uvdist', 1, 3, spw_info(), ['ea01', 'ea02', 'ea03'])
+
+    filename = str(tmp_path / "field_J0137+3309_amp_uvdist.scan_3.txt")
+    write_qa_table(filename, rows, 'amp_uvdist', 'test.ms', 'J0137+3309', 3, 4)
+
+    # Same read as for the plotms exports in `uvresid_plot.get_uvdata`
+    dat = np.genfromtxt(filename, names=True, dtype=None, skip_header=6, encoding=None)
+
+    assert list(dat.dtype.names) == QA_TABLE_COLUMNS
+    assert dat.size == rows.size
+    np.testing.assert_allclose(dat['y'], rows['y'], rtol=1e-9)
+    assert set(dat['corr']) == set(['RR', 'LL'])
@@ -0,0 +1,203 @@
+'''
+Tests for the QA table writers and readers.
+'''
+
+import json
+import numpy as np
+import pytest
+
+from lband_pipeline.qa_plotting.qa_table_io import (QA_TABLE_FORMATS,
+                                                    qa_table_formats,
+                                                    read_qa_table,
+                                                    register_qa_table_format,
+                                                    write_qa_table_data,
+                                                    convert_txt_table,
+                                                    read_plotms_txt)
+
+
+def make_table(nrow=50, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    table = np.zeros(nrow, dtype=[('x', float), ('y', float), ('spw', int),
+                                  ('ant1name', 'U8'), ('scan', int)])
+    table['x'] = rng.uniform(0, 1000, nrow)
+    table['y'] = rng.normal(1, 0.1, nrow)
+    table['spw'] = rng.integers(0, 4, nrow)
+    table['ant1name'] = np.array(['ea01', 'ea02', 'ea10'])[rng.integers(0, 3, nrow)]
+    table['scan'] = rng.integers(1, 10, nrow)
+
+    return table
+
+
+def check_table(table, out):
+    for name in table.dtype.names:
+        np.testing.assert_array_equal(np.asarray(out[name]), table[name])
+
+
+@pytest.mark.parametrize('outtype', ['npz', 'npy', 'hdf5', 'parquet'])
+def test_binary_roundtrip(tmp_path, outtype):
+
+    if outtype == 'hdf5':
+        pytest.importorskip('h5py')
+    if outtype == 'parquet':
+        pytest.importorskip('pyarrow')
+
+    table = make_table()
+
+    metadata = {'field_names': ['3C286', 'J1331+3030', 'M33'], 'scan': 4}
+
+    filenames = write_qa_table_data(str(tmp_path / "qa_table"), table, outtype=outtype,
+                                    metadata=metadata)
+
+    assert filenames == [str(tmp_path / "qa_table.{}".format(outtype))]
+
+    out, out_metadata = read_qa_table(filenames[0])
+
+    check_table(table, out)
+
+    assert out_metadata['field_names'] == metadata['field_names']
+    assert out_metadata['scan'] == 4
+    assert out_metadata['columns'] == list(table.dtype.names)
+
+    # Column selection
+    out, _ = read_qa_table(filenames[0], columns=['y', 'spw'])
+    assert sorted(out.keys()) == ['spw', 'y']
+    np.testing.assert_array_equal(out['y'], table['y'])
+
+
+def test_npy_memory_mapped(tmp_path):
+
+    table = make_table()
+
+    filename = write_qa_table_data(str(tmp_path / "qa_table"), table, outtype='npy')[0]
+
+    out, _ = read_qa_table(filename)
+    assert isinstance(out['x'], np.memmap)
+
+    out, _ = read_qa_table(filename, mmap=False)
+    assert not isinstance(out['x'], np.memmap)
+
+    # The structured array is a copy that can be modified.
+    out, _ = read_qa_table(filename, as_structured=True)
+    out['y'] *= 2
+    check_table(make_table()[['x', 'spw']], out)
+
+
+def test_txt_matches_savetxt(tmp_path):
+
+    table = make_table()[['x', 'y', 'spw', 'scan']]
+
+    filename = write_qa_table_data(str(tmp_path / "qa_table"), table, outtype=['txt'],
+                                   txt_kwargs={'fmt': '%f %f %d %d',
+                                               'header': "x,y,spw,scan"})[0]
+
+    np.savetxt(tmp_path / "direct.txt", table, fmt='%f %f %d %d', header="x,y,spw,scan")
+
+    with open(filename) as f:
+        written = f.read()
+    with open(tmp_path / "direct.txt") as f:
+        direct = f.read()
+
+    assert written == direct
+
+
+def test_multiple_outtypes_and_convert(tmp_path):
+
+    table = make_table()
+
+    filenames = write_qa_table_data(str(tmp_path / "qa_table"), table,
+                                    outtype=['txt', 'npz'])
+    assert [fname.split(".")[-1] for fname in filenames] == ['txt', 'npz']
+
+    # Add the plotms-style 6 line preamble and convert.
+    with open(filenames[0]) as f:
+        lines = f.readlines()
+    with open(tmp_path / "plotms.txt", 'w') as f:
+        f.write("# preamble\n" * 6)
+        f.write(lines[0].replace("# ", "").replace("#", ""))
+        f.writelines(lines[1:])
+
+    new_filenames = convert_txt_table(str(tmp_path / "plotms.txt"), ['txt', 'npy'],
+                                      metadata={'source': 'plotms'})
+    assert new_filenames == [str(tmp_path / "plotms.npy")]
+
+    out, metadata = read_qa_table(new_filenames[0])
+    np.testing.assert_allclose(out['x'], table['x'], rtol=1e-15)
+    np.testing.assert_array_equal(out['ant1name'], table['ant1name'])
+    assert metadata['source'] == 'plotms'
+
+
+def test_unknown_format():
+
+    with pytest.raises(ValueError):
+        qa_table_formats(['txt', 'fits'])
+
+    with pytest.raises(ValueError):
+        read_qa_table("qa_table.fits")
+
+
+def test_register_format(tmp_path):
+
+    def write_json(filename, columns, metadata):
+        with open(filename, 'w') as f:
+            json.dump({'columns': {name: val.tolist() for name, val in columns.items()},
+                       'metadata': metadata}, f)
+
+    def read_json(filename, columns=None, mmap=True):
+        with open(filename) as f:
+            out = json.load(f)
+        return {name: np.array(val) for name, val in out['columns'].items()}, out['metadata']
+
+    register_qa_table_format('json', write_json, read_json)
+
+    try:
+        table = make_table()
+
+        filename = write_qa_table_data(str(tmp_path / "qa_table"), table, outtype='json')[0]
+
+        out, _ = read_qa_table(filename)
+        check_table(table, out)
+    finally:
+        del QA_TABLE_FORMATS['json']
+
+
+def write_plotms_txt(filename, nrow=40, seed=0, extra_column=False):
+
+    rng = np.random.default_rng(seed)
+
+    columns = ['x', 'y', 'chan', 'scan', 'field', 'ant1', 'ant2', 'ant1name', 'ant2name',
+               'time', 'freq', 'spw', 'corr', 'obs']
+    if extra_column:
+        columns.append('note')
+
+    with open(filename, 'w') as f:
+        f.write("# From plot 0\n" * 6)
+        f.write("# {}\n".format(" ".join(columns)))
+        for ii in range(nrow):
+            row = [rng.uniform(0, 1e4), rng.normal(1, 0.1), 0, rng.integers(1, 5), 2,
+                   rng.integers(0, 3), rng.integers(3, 6), "ea01", "ea12",
+                   5.1e9 + ii, 1.4, rng.integers(0, 8), ["RR", "LL"][ii % 2], 0]
+            if extra_column:
+                row.append("abc")
+            f.write(" ".join([str(val) for val in row]) + "\n")
+
+
+@pytest.mark.parametrize('extra_column', [False, True])
+def test_read_plotms_txt_matches_genfromtxt(tmp_path, extra_column):
+
+    filename = str(tmp_path / "plotms.txt")
+    write_plotms_txt(filename, extra_column=extra_column)
+
+    dat_gen = np.genfromtxt(filename, names=True, dtype=None, skip_header=6, encoding=None)
+
+    # An unknown text column is read with np.genfromtxt
+    dat = read_plotms_txt(filename)
+
+    assert dat.dtype.names == dat_gen.dtype.names
+    for name in dat_gen.dtype.names:
+        np.testing.assert_array_equal(dat[name], dat_gen[name])
+
+    dat = read_plotms_txt(filename, columns=['y', 'spw', 'corr'])
+    assert dat.dtype.names == ('y', 'spw', 'corr')
+    np.testing.assert_array_equal(dat['corr'], dat_gen['corr'])
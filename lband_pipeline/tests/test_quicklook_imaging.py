@@ -0,0 +1,271 @@
+'''
+Tests for the quicklook imaging job scheduler.
+'''
+
+import os
+import re
+import sys
+import time
+import types
+
+import numpy as np
+import pytest
+
+from lband_pipeline import quicklook_imaging
+from lband_pipeline.read_config_files import read_targets_vrange_cfg
+from lband_pipeline.quicklook_imaging import (_chunk_uv_extent,
+                                              compute_uv_extents,
+                                              estimate_tclean_memory_gb,
+                                              read_uv_cache,
+                                              run_quicklook_jobs,
+                                              select_target_velrange,
+                                              uv_cache_filename,
+                                              write_uv_cache)
+
+
+def make_jobs(njobs, imsize=256):
+
+    jobs = []
+    for ii in range(njobs):
+        jobs.append({'field': f'M33_{ii}',
+                     'spw': str(ii),
+                     'label': 'continuum',
+                     'imagename': f'quicklook-M33_{ii}-spw{ii}',
+                     'imsize': imsize,
+                     'memory_gb': estimate_tclean_memory_gb(imsize),
+                     'export_fits': True,
+                     'tclean_kwargs': {'niter': 0}})
+
+    return jobs
+
+
+def test_estimate_tclean_memory_gb():
+
+    base = estimate_tclean_memory_gb(0, base_memory_gb=1.0)
+    assert base == 1.0
+
+    small = estimate_tclean_memory_gb(256, nchan=1)
+    cube = estimate_tclean_memory_gb(256, nchan=10)
+
+    assert small > base
+    assert cube - base == pytest.approx(10 * (small - base))
+
+
+def test_run_quicklook_jobs_serial_report(tmp_path, monkeypatch):
+
+    ran = []
+
+    def fake_job(job):
+        ran.append(job['imagename'])
+        return {'start': '2021-01-01T00:00:00', 'wall_time_s': 1.5, 'pid': 1}
+
+    monkeypatch.setattr(quicklook_imaging, '_run_quicklook_job', fake_job)
+
+    jobs = make_jobs(3)
+    report = tmp_path / "timing.txt"
+
+    results = run_quicklook_jobs(jobs, nworkers=1, timing_report=str(report))
+
+    assert ran == [job['imagename'] for job in jobs]
+    assert [result['status'] for result in results] == ['done'] * 3
+
+    lines = report.read_text().splitlines()
+
+    assert lines[0].split() == ['field', 'spw', 'label', 'imsize', 'memory_gb', 'start',
+                                'wall_time_s', 'pid', 'status']
+    assert len(lines) == 4
+    assert lines[1].split()[0] == 'M33_0'
+    assert lines[1].split()[6] == '1.50'
+
+
+def test_run_quicklook_jobs_report_on_failure(tmp_path, monkeypatch):
+
+    def fake_job(job):
+        if job['spw'] == '1':
+            raise RuntimeError("tclean failed")
+        return {'start': '2021-01-01T00:00:00', 'wall_time_s': 1., 'pid': 1}
+
+    monkeypatch.setattr(quicklook_imaging, '_run_quicklook_job', fake_job)
+
+    report = tmp_path / "timing.txt"
+
+    with pytest.raises(RuntimeError, match='quicklook-M33_1-spw1') as excinfo:
+        run_quicklook_jobs(make_jobs(3), nworkers=1, timing_report=str(report))
+
+    assert str(excinfo.value.__cause__) == "tclean failed"
+
+    # The failed job is recorded and the later jobs still run.
+    lines = report.read_text().splitlines()
+    assert len(lines) == 4
+    assert [line.split()[-1] for line in lines[1:]] == ['done', 'failed', 'done']
+
+
+def test_available_memory_gb(tmp_path):
+
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:       65843068 kB\n"
+                       "MemFree:         1048576 kB\n"
+                       "MemAvailable:   33554432 kB\n")
+
+    # MemAvailable includes the reclaimable page cache, unlike MemFree.
+    assert quicklook_imaging._available_memory_gb(str(meminfo)) == 32.
+
+    # Falls back to sysconf without /proc/meminfo.
+    out = quicklook_imaging._available_memory_gb(str(tmp_path / "missing"))
+    assert out is None or out > 0.
+
+
+def test_chunk_uv_extent():
+
+    rng = np.random.default_rng(3)
+
+    nrow, nchan, ncorr = 50, 8, 2
+
+    uvw = rng.normal(scale=1000., size=(3, nrow))
+    flag = rng.random((ncorr, nchan, nrow)) > 0.3
+    chan_freqs = 1.4e9 + 1e6 * np.arange(nchan)
+
+    # Brute force over every unflagged row, channel pair.
+    expected = 0.
+    for row in range(nrow):
+        for chan in range(nchan):
+            if flag[:, chan, row].all():
+                continue
+            uv = max(abs(uvw[0, row]), abs(uvw[1, row])) * chan_freqs[chan] / 299792458.
+            expected = max(expected, uv)
+
+    assert _chunk_uv_extent(uvw, flag, chan_freqs) == pytest.approx(expected)
+
+    # Descending and unordered channel frequencies
+    assert _chunk_uv_extent(uvw, flag[:, ::-1], chan_freqs[::-1]) == pytest.approx(expected)
+
+    order = rng.permutation(nchan)
+    assert _chunk_uv_extent(uvw, flag[:, order], chan_freqs[order]) == pytest.approx(expected)
+
+    assert _chunk_uv_extent(uvw, np.ones_like(flag), chan_freqs) == 0.
+
+
+class FakeTable:
+    '''
+    Stand-in for the casatools table with the subtables as columns and the main
+    table as a list of rows.
+    '''
+
+    tables = {}
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+    def open(self, name):
+        self.name = os.path.basename(name)
+        self.rows = self.tables[self.name] if self.name.isupper() else self.tables['MAIN']
+
+    def close(self):
+        self.closed = True
+
+    def getcol(self, colname, startrow=0, nrow=-1):
+        if isinstance(self.rows, dict):
+            return np.asarray(self.rows[colname])
+        rows = self.rows[startrow:startrow + nrow]
+        return np.stack([row[colname] for row in rows], axis=-1)
+
+    def getcell(self, colname, rownr):
+        return np.asarray(self.rows[colname][rownr])
+
+    def query(self, query, columns=None):
+        field_ids = [int(val) for val in re.search(r"IN \[(.*)\]", query).group(1).split(",")]
+        ddid = int(re.search(r"DATA_DESC_ID == (\d+)", query).group(1))
+        sub_tb = FakeTable([row for row in self.rows
+                            if row['FIELD_ID'] in field_ids and row['DATA_DESC_ID'] == ddid])
+        sub_tb.closed = False
+        FakeTable.queries.append(sub_tb)
+        return sub_tb
+
+    def nrows(self):
+        return len(self.rows)
+
+
+def test_compute_uv_extents_empty_ddid(monkeypatch):
+
+    rng = np.random.default_rng(4)
+
+    # DDID 0 has no rows for the field. DDIDs 1 and 2 have different shapes.
+    nchans = {0: 4, 1: 16, 2: 2}
+    chan_freqs = {spw: 1.4e9 + 1e6 * np.arange(nchan) for spw, nchan in nchans.items()}
+
+    rows = []
+    for ddid, nchan in nchans.items():
+        field_id = 1 if ddid == 0 else 0
+        for _ in range(7):
+            rows.append({'FIELD_ID': field_id, 'DATA_DESC_ID': ddid,
+                         'UVW': rng.normal(scale=1000., size=3),
+                         'FLAG': rng.random((2, nchan)) > 0.5})
+
+    FakeTable.tables = {'FIELD': {'NAME': ['M33', 'M31']},
+                        'DATA_DESCRIPTION': {'SPECTRAL_WINDOW_ID': [0, 1, 2],
+                                             'POLARIZATION_ID': [0, 0, 0]},
+                        'POLARIZATION': {'NUM_CORR': [2]},
+                        'SPECTRAL_WINDOW': {'CHAN_FREQ': [chan_freqs[0], chan_freqs[1],
+                                                          chan_freqs[2]]},
+                        'MAIN': rows}
+    FakeTable.queries = []
+
+    fake_casatools = types.ModuleType('casatools')
+    fake_casatools.table = FakeTable
+    monkeypatch.setitem(sys.modules, 'casatools', fake_casatools)
+
+    # 3 rows per chunk for the 16 channel SPW.
+    uv_extents = compute_uv_extents("track.ms", "M33", [0, 1, 2], chunk_elements=100)
+
+    assert uv_extents['0'] == 0.
+
+    for spw in [1, 2]:
+        spw_rows = [row for row in rows if row['DATA_DESC_ID'] == spw]
+        uvw = np.stack([row['UVW'] for row in spw_rows], axis=-1)
+        flag = np.stack([row['FLAG'] for row in spw_rows], axis=-1)
+        assert uv_extents[str(spw)] == pytest.approx(_chunk_uv_extent(uvw, flag, chan_freqs[spw]))
+
+    assert all([sub_tb.closed for sub_tb in FakeTable.queries])
+
+
+def test_uv_cache_invalidation(tmp_path):
+
+    myvis = str(tmp_path / "test.ms")
+    os.mkdir(myvis)
+    for name in ["table.dat", "table.f1"]:
+        (tmp_path / "test.ms" / name).write_bytes(b"0")
+
+    cache = read_uv_cache(myvis)
+    assert cache['fields'] == {}
+
+    cache['fields']['M33_1'] = {'2': {'uvmax': 1.e4, 'cell': 10.3, 'mean_freq': 1.4,
+                                      'imsize': 540}}
+    write_uv_cache(cache, uv_cache_filename(myvis))
+
+    assert read_uv_cache(myvis)['fields'] == cache['fields']
+
+    # Re-flagging modifies the main table storage files.
+    time.sleep(0.01)
+    (tmp_path / "test.ms" / "table.f1").write_bytes(b"01")
+
+    assert read_uv_cache(myvis)['fields'] == {}
+
+
+def test_select_target_velrange(tmp_path):
+
+    filename = str(tmp_path / "vrange.cfg")
+    with open(filename, 'w') as f:
+        f.write("[M33]\nHI = 50, -60, -100, -350\n[IC10]\nHI = 50, -625\n")
+
+    # The registry returns tuples of tuples.
+    target_line_range_kms = read_targets_vrange_cfg(filename)
+
+    assert select_target_velrange(target_line_range_kms['M33']['HI'], -180.) == (-100., -350.)
+    assert select_target_velrange(target_line_range_kms['IC10']['HI'], -350.) == (50., -625.)
+
+    # Single range and lists
+    assert select_target_velrange((-100., -350.), -180.) == (-100., -350.)
+    assert select_target_velrange([[50., -60.], [-100., -350.]], 0.) == [50., -60.]
+
+    with pytest.raises(ValueError):
+        select_target_velrange(target_line_range_kms['M33']['HI'], 200., thisgal='M33')
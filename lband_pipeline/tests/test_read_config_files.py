@@ -0,0 +1,133 @@
+'''
+Tests for the config registry.
+'''
+
+import os
+import json
+import pickle
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lband_pipeline import read_config_files
+from lband_pipeline.read_config_files import (read_calibrator_absorption_cfg,
+                                              read_target_vsys_cfg,
+                                              read_targets_vrange_cfg,
+                                              clear_config_registry,
+                                              config_registry_state,
+                                              preload_configs,
+                                              thaw_config)
+
+
+def read_sections(filename):
+    config = configparser.RawConfigParser()
+    config.optionxform = str
+    config.read(filename)
+    return {section: dict(config.items(section)) for section in config.sections()}
+
+
+def test_default_configs():
+
+    clear_config_registry()
+
+    config_folder = os.path.join(os.path.dirname(read_config_files.__file__), "..", "config_files")
+
+    cal_ranges = read_calibrator_absorption_cfg()
+    sections = read_sections(os.path.join(config_folder, "lglbs_calibrators.cfg"))
+
+    assert thaw_config(cal_ranges) == {source: {line: [float(val) for val in vrange.split(",")]
+                                                for line, vrange in sections[source].items()}
+                                       for source in sections}
+
+    vsys = read_target_vsys_cfg()
+    sections = read_sections(os.path.join(config_folder, "lglbs_targets_vsys.cfg"))
+    assert thaw_config(vsys) == {source: float(val)
+                                 for source, val in sections['target_vsys_kms'].items()}
+
+    vranges = read_targets_vrange_cfg()
+    for source in vranges:
+        for line in vranges[source]:
+            assert all([len(pair) == 2 for pair in vranges[source][line]])
+
+    # Parsed once
+    assert read_calibrator_absorption_cfg() is cal_ranges
+    assert read_target_vsys_cfg(filename=None) is vsys
+
+
+def test_read_only_and_reload(tmp_path):
+
+    filename = str(tmp_path / "vsys.cfg")
+    with open(filename, 'w') as f:
+        f.write("[target_vsys_kms]\nM33 = -180\nM31 = -300\n")
+
+    vsys = read_target_vsys_cfg(filename)
+
+    assert dict(vsys) == {'M33': -180., 'M31': -300.}
+    assert read_target_vsys_cfg(filename) is vsys
+
+    with pytest.raises(TypeError):
+        vsys['M33'] = 0.
+
+    # A mutable copy that can be written to JSON
+    assert json.loads(json.dumps(thaw_config(vsys))) == {'M33': -180., 'M31': -300.}
+
+    with open(filename, 'w') as f:
+        f.write("[target_vsys_kms]\nM33 = -179.5\n")
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert dict(read_target_vsys_cfg(filename)) == {'M33': -179.5}
+
+    with pytest.raises(OSError):
+        read_target_vsys_cfg(str(tmp_path / "missing.cfg"))
+
+
+def test_vrange_pairs(tmp_path):
+
+    filename = str(tmp_path / "vrange.cfg")
+    with open(filename, 'w') as f:
+        f.write("[M33]\nHI = -300, -50, 10, 20\n")
+
+    assert read_targets_vrange_cfg(filename)['M33']['HI'] == ((-300., -50.), (10., 20.))
+
+    with open(filename, 'w') as f:
+        f.write("[M33]\nHI = -300, -50, 10\n")
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    with pytest.raises(ValueError):
+        read_targets_vrange_cfg(filename)
+
+
+def test_registry_state_and_threads(tmp_path, monkeypatch):
+
+    clear_config_registry()
+
+    filename = str(tmp_path / "cal.cfg")
+    with open(filename, 'w') as f:
+        f.write("[3C48]\nHI = -50, 50\n")
+
+    nparse = []
+    read_sections_orig = read_config_files._read_config_sections
+
+    def counting_read(filename):
+        nparse.append(filename)
+        return read_sections_orig(filename)
+
+    monkeypatch.setattr(read_config_files, '_read_config_sections', counting_read)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outs = list(executor.map(lambda ii: read_calibrator_absorption_cfg(filename), range(32)))
+
+    assert len(nparse) == 1
+    assert all([out is outs[0] for out in outs])
+
+    # Serialize for a worker process and load into a fresh registry.
+    state = pickle.loads(pickle.dumps(config_registry_state()))
+
+    clear_config_registry()
+    preload_configs(state)
+
+    assert read_calibrator_absorption_cfg(filename)['3C48']['HI'] == (-50., 50.)
+    assert len(nparse) == 1
@@ -0,0 +1,168 @@
+'''
+Tests for the cached SPW metadata index and JSON SPW dictionary.
+'''
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from lband_pipeline.spw_setup import (SPW_INDEX_VERSION, load_spw_dict,
+                                      read_spw_index, save_spw_dict,
+                                      spw_index_filename, write_spw_index)
+
+spw_dict_example = {0: {'label': 'continuum_A0',
+                        'origname': 'EVLA_L#A0C0#0',
+                        'chanwidth': np.float64(1.0e6),
+                        'bandwidth': 6.4e7,
+                        'centerfreq': np.float64(1.0e6),
+                        'baseband': 'A0C0',
+                        'freq_0_topo': np.float64(9.68e8)},
+                    np.int32(5): {'label': 'HI',
+                                  'origname': 'EVLA_L#A0C0#5',
+                                  'chanwidth': 976.5625,
+                                  'bandwidth': 4.0e6,
+                                  'centerfreq': 1.419e6,
+                                  'baseband': 'A0C0',
+                                  'freq_0_topo': 1.417e9}}
+
+field_metadata = {'names': ['3C48', 'J0119+3210', 'M33_1'],
+                  'target_fields': ['M33_1'],
+                  'science_scans': [5, 7]}
+
+settings = {'continuum_only': False,
+            'target_vsys_kms': {'M33': -180.},
+            'min_continuum_chanwidth_kHz': 50,
+            'allow_failed_line_identification': True,
+            'linerest_dict_GHz': {'HI': 1.420405752, 'OH1612': 1.612231}}
+
+
+def make_fake_ms(path):
+    '''
+    Directory layout of an MS with the table descriptors used in the fingerprint.
+    '''
+
+    for subtable in ["", "SPECTRAL_WINDOW", "FIELD", "STATE",
+                     "DATA_DESCRIPTION", "OBSERVATION"]:
+        os.makedirs(os.path.join(path, subtable), exist_ok=True)
+        with open(os.path.join(path, subtable, "table.dat"), 'w') as f:
+            f.write("table")
+
+    return path
+
+
+def test_spw_dict_json_roundtrip(tmp_path):
+
+    filename = str(tmp_path / "spw_definitions.json")
+
+    save_spw_dict(spw_dict_example, filename)
+
+    out = load_spw_dict(filename)
+
+    assert list(out.keys()) == [0, 5]
+    assert out[5] == {key: float(val) if isinstance(val, np.generic) else val
+                      for key, val in spw_dict_example[np.int32(5)].items()}
+
+
+def test_spw_dict_legacy_npy(tmp_path):
+
+    filename = str(tmp_path / "spw_definitions.npy")
+
+    np.save(filename, spw_dict_example)
+
+    out = load_spw_dict(filename)
+
+    assert out[0]['label'] == 'continuum_A0'
+
+
+def test_spw_index_valid(tmp_path):
+
+    myvis = make_fake_ms(str(tmp_path / "track.ms"))
+
+    write_spw_index(myvis, spw_dict_example, field_metadata, settings)
+
+    assert os.path.exists(spw_index_filename(myvis))
+
+    index = read_spw_index(myvis, settings=settings)
+
+    assert index is not None
+    assert index['version'] == SPW_INDEX_VERSION
+    assert index['spw_dict'][5]['label'] == 'HI'
+    assert index['fields']['target_fields'] == ['M33_1']
+
+
+def test_spw_index_invalidation(tmp_path):
+
+    myvis = make_fake_ms(str(tmp_path / "track.ms"))
+
+    write_spw_index(myvis, spw_dict_example, field_metadata, settings)
+
+    # Different settings
+    other_settings = dict(settings)
+    other_settings['continuum_only'] = True
+    assert read_spw_index(myvis, settings=other_settings) is None
+
+    # A different line list
+    other_settings = dict(settings)
+    other_settings['linerest_dict_GHz'] = {'HI': 1.420405752}
+    assert read_spw_index(myvis, settings=other_settings) is None
+
+    # Settings check can be skipped.
+    assert read_spw_index(myvis, settings=None) is not None
+
+    # Modifying the SPW subtable invalidates the index.
+    spw_table = os.path.join(myvis, "SPECTRAL_WINDOW", "table.dat")
+    with open(spw_table, 'a') as f:
+        f.write("modified")
+    stat = os.stat(spw_table)
+    os.utime(spw_table, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert read_spw_index(myvis, settings=settings) is None
+
+    # Rewriting makes it valid again.
+    write_spw_index(myvis, spw_dict_example, field_metadata, settings)
+    assert read_spw_index(myvis, settings=settings) is not None
+
+
+def test_spw_index_other_ms(tmp_path):
+
+    myvis = make_fake_ms(str(tmp_path / "track.ms"))
+    othervis = make_fake_ms(str(tmp_path / "other.ms"))
+
+    write_spw_index(myvis, spw_dict_example, field_metadata, settings,
+                    index_filename=spw_index_filename(othervis))
+
+    assert read_spw_index(othervis, settings=settings) is None
+
+
+def test_spw_index_version_mismatch(tmp_path):
+
+    myvis = make_fake_ms(str(tmp_path / "track.ms"))
+
+    write_spw_index(myvis, spw_dict_example, field_metadata, settings)
+
+    with open(spw_index_filename(myvis), 'r') as f:
+        index = json.load(f)
+
+    index['version'] = SPW_INDEX_VERSION + 1
+
+    with open(spw_index_filename(myvis), 'w') as f:
+        json.dump(index, f)
+
+    assert read_spw_index(myvis, settings=settings) is None
+
+
+def test_spw_index_unserializable_settings(tmp_path):
+
+    myvis = make_fake_ms(str(tmp_path / "track.ms"))
+
+    bad_settings = dict(settings)
+    bad_settings['target_vsys_kms'] = {'M33': object()}
+
+    with pytest.raises(TypeError):
+        write_spw_index(myvis, spw_dict_example, field_metadata, bad_settings)
+
+    # Nothing is left behind and the settings are never matched.
+    assert os.listdir(str(tmp_path)) == ["track.ms"]
+    assert read_spw_index(myvis, settings=bad_settings) is None
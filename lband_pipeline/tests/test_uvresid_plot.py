@@ -0,0 +1,219 @@
+'''
+Tests for the uv residual statistics.
+'''
+
+import numpy as np
+import pytest
+
+from lband_pipeline.qa_plotting import uvresid_plot
+from lband_pipeline.qa_plotting.uvresid_plot import (disk_usage_bytes,
+                                                     run_uvstats_jobs,
+                                                     get_uvdata,
+                                                     bin_uvdata,
+                                                     bin_uvdata_perscan,
+                                                     grouped_uv_stats)
+
+
+def bin_uvdata_perscan_loop(dat):
+    '''
+    The original nested loop `bin_uvdata_perscan`.
+    '''
+
+    list_x, list_y, list_yerr = [], [], []
+    for ant1 in np.unique(dat['ant1']):
+        for ant2 in np.unique(dat['ant2']):
+            for scan in np.unique(dat['scan']):
+                hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2) & (dat['scan'] == scan))[0]
+                if len(hits) > 5:
+                    q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
+                    iqr = (1 / 1.35) * (q75 - q25)
+                    list_x.append(np.median(dat['x'][hits]))
+                    list_y.append(q50)
+                    list_yerr.append(np.abs(iqr) / np.sqrt(len(hits)))
+    return np.array([list_x, list_y, list_yerr])
+
+
+def bin_uvdata_loop(dat):
+    '''
+    The original nested loop `bin_uvdata`.
+    '''
+
+    list_x, list_y, list_yerr = [], [], []
+    for ant1 in np.unique(dat['ant1']):
+        for ant2 in np.unique(dat['ant2']):
+            hits = np.where((dat['ant1'] == ant1) & (dat['ant2'] == ant2))[0]
+            if len(hits) > 5:
+                q25, q50, q75 = np.percentile(dat['y'][hits], [25, 50, 75])
+                iqr = (1 / 1.35) * (q75 - q25)
+                list_x.append(np.median(dat['x'][hits]))
+                list_y.append(q50)
+                list_yerr.append(np.abs(iqr) / np.sqrt(len(hits)))
+    return np.array([list_x, list_y, list_yerr])
+
+
+def make_uvtable(nrow=3000, nant=8, nscan=4, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    dat = np.zeros(nrow, dtype=[('x', float), ('y', float), ('ant1', int),
+                                ('ant2', int), ('scan', int), ('spw', int)])
+
+    dat['ant1'] = rng.integers(0, nant - 1, nrow)
+    dat['ant2'] = rng.integers(1, nant, nrow)
+    dat['scan'] = rng.integers(1, nscan + 1, nrow)
+    dat['spw'] = rng.integers(0, 2, nrow)
+    dat['x'] = rng.uniform(100, 5000, nrow)
+    # Include ties in y
+    dat['y'] = np.round(rng.normal(0, 5, nrow), 1)
+
+    return dat
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bin_uvdata_matches_loop(seed):
+
+    # Small tables so some groups fall below the count threshold.
+    for nrow in [200, 3000]:
+        dat = make_uvtable(nrow=nrow, seed=seed)
+
+        np.testing.assert_array_equal(bin_uvdata(dat), bin_uvdata_loop(dat))
+        np.testing.assert_array_equal(bin_uvdata_perscan(dat), bin_uvdata_perscan_loop(dat))
+
+
+def test_grouped_uv_stats_keys_and_counts():
+
+    dat = make_uvtable()
+
+    stats = grouped_uv_stats(dat, keys=('ant1', 'ant2', 'scan'), min_count=1)
+
+    assert stats['count'].sum() == dat.size
+
+    for ii in range(stats['count'].size):
+        hits = (dat['ant1'] == stats['ant1'][ii]) & (dat['ant2'] == stats['ant2'][ii]) & \
+            (dat['scan'] == stats['scan'][ii])
+        assert hits.sum() == stats['count'][ii]
+
+
+def test_bin_uvdata_empty_and_nan():
+
+    dat = make_uvtable(nrow=5)
+    assert bin_uvdata(dat).shape == (3, 0)
+
+    dat = make_uvtable()
+    dat['y'][10] = np.nan
+
+    with np.errstate(invalid='ignore'):
+        np.testing.assert_array_equal(bin_uvdata(dat), bin_uvdata_loop(dat))
+
+
+def get_uvdata_genfromtxt(infile):
+    '''
+    The original `get_uvdata` without the unused argsort.
+    '''
+
+    dat = np.genfromtxt(infile, names=True, dtype=None, skip_header=6, encoding=None)
+    spws = sorted(np.unique(dat['spw']))
+    median_flux = []
+    for spw in spws:
+        median_flux.append(np.median(dat[dat['spw'] == spw]['y']))
+        dat['y'][dat['spw'] == spw] = 100. * (dat['y'][dat['spw'] == spw] / np.median(dat[dat['spw'] == spw]['y']) - 1.)
+    return dat, np.median(median_flux)
+
+
+def test_get_uvdata_matches_genfromtxt(tmp_path):
+
+    dat = make_uvtable(nrow=500)
+    dat['y'] = np.abs(dat['y']) + 1.
+
+    infile = str(tmp_path / "plotms_amp_uvwave_field_J0000.txt")
+
+    with open(infile, 'w') as f:
+        f.write("# From plot 0\n" * 6)
+        f.write("# x y chan scan field ant1 ant2 ant1name ant2name time freq spw corr obs\n")
+        for row in dat:
+            f.write("{0!r} {1!r} 0 {2} 1 {3} {4} ea01 ea02 5.1e9 1.4 {5} RR 0\n"
+                    .format(float(row['x']), float(row['y']), row['scan'], row['ant1'], row['ant2'], row['spw']))
+
+    out, median_flux = get_uvdata(infile)
+    out_orig, median_flux_orig = get_uvdata_genfromtxt(infile)
+
+    assert median_flux == median_flux_orig
+
+    for name in out.dtype.names:
+        np.testing.assert_array_equal(out[name], out_orig[name])
+
+
+def test_disk_usage_bytes(tmp_path):
+
+    table_dir = tmp_path / "cal_fields.ms"
+    (table_dir / "ANTENNA").mkdir(parents=True)
+
+    (table_dir / "table.f0").write_bytes(b"0" * 1000)
+    (table_dir / "ANTENNA" / "table.f0").write_bytes(b"0" * 24)
+
+    assert disk_usage_bytes(str(table_dir)) == 1024
+    assert disk_usage_bytes(str(table_dir / "table.f0")) == 1000
+    assert disk_usage_bytes(str(tmp_path / "missing.ms")) == 0
+
+
+def test_run_uvstats_jobs_isolates_failures(tmp_path, monkeypatch):
+
+    casatasks = pytest.importorskip("casatasks")
+
+    def fake_export(vis, field_name, datacolumn, plotms_outfile):
+        if field_name == 'J0002':
+            raise ValueError("plotms export failed")
+        return True
+
+    calls = []
+
+    def fake_gaincal(vis, caltable, field, **kwargs):
+        if field == 'J0003':
+            raise RuntimeError("no solutions")
+        calls.append(('gaincal', vis, field))
+
+    def fake_applycal(vis, gaintable, field, **kwargs):
+        calls.append(('applycal', vis, field))
+
+    monkeypatch.setattr(uvresid_plot, '_export_and_plot_uvstats', fake_export)
+    monkeypatch.setattr(casatasks, 'gaincal', fake_gaincal, raising=False)
+    monkeypatch.setattr(casatasks, 'applycal', fake_applycal, raising=False)
+
+    jobs = [{'vis': 'parent.ms', 'out_path': str(tmp_path), 'field_name': field_name,
+             'try_phase_selfcal': True, 'cleanup_calsplit': True,
+             'shared_ms': str(tmp_path / 'cal_fields.ms'),
+             'field_spws': [0], 'field_nchans': [64],
+             'field_split': 'shared', 'export_vis': str(tmp_path / 'cal_fields.ms'),
+             'export_datacolumn': 'data'}
+            for field_name in ['J0001', 'J0002', 'J0003']]
+
+    results = run_uvstats_jobs(jobs)
+
+    assert [res['field'] for res in results] == ['J0001', 'J0002', 'J0003']
+    assert [res['status'] for res in results] == ['done', 'failed', 'done']
+    assert [res['selfcal_status'] for res in results] == ['done', 'skipped', 'failed']
+
+    assert isinstance(results[1]['error'], ValueError)
+    assert results[0]['gaincal_table'] == str(tmp_path / 'cal_field_J0001.g')
+
+    assert calls == [('gaincal', str(tmp_path / 'cal_fields.ms'), 'J0001'),
+                     ('applycal', str(tmp_path / 'cal_fields.ms'), 'J0001')]
+
+
+def test_run_uvstats_jobs_worker_failure(monkeypatch):
+
+    def fake_uvstats_field(job):
+        if job['field_name'] == 'J0002':
+            raise MemoryError("worker died")
+        return uvresid_plot._uvstats_result(job['field_name'], status='done')
+
+    monkeypatch.setattr(uvresid_plot, '_uvstats_field', fake_uvstats_field)
+
+    jobs = [{'field_name': field_name} for field_name in ['J0001', 'J0002']]
+
+    results = run_uvstats_jobs(jobs)
+
+    # Same keys as a completed field.
+    assert results[1].keys() == results[0].keys()
+    assert results[1]['status'] == 'failed'
+    assert isinstance(results[1]['error'], MemoryError)